@@ -1,66 +1,87 @@
-import string
-from dataclasses import dataclass
+from collections import Counter
 from itertools import count
 
+from .cse import cse_program
+from .dce import eliminate_program
+from .fold import fold_program
+from .inline import inline_program
+from .loops import loop_program
 from .io import Line
+from .nodes import (
+    App,
+    Binding,
+    Const,
+    If,
+    Lambda,
+    Let,
+    Letrec,
+    Loop,
+    PrimCall,
+    Recur,
+    Ref,
+    nodes,
+    same,
+)
+from .values import (
+    BOOL_BIT,
+    BOOL_F,
+    BOOL_MASK,
+    BOOL_T,
+    CAR_OFFSET,
+    CDR_OFFSET,
+    CHARMASK,
+    CHARS,
+    CHARSHIFT,
+    CHARTAG,
+    FIXNUM_BITS,
+    FXLOWER,
+    FXMASK,
+    FXSHIFT,
+    FXTAG,
+    FXUPPER,
+    NULL,
+    OBJ_MASK,
+    PAIR_TAG,
+    WORDSIZE,
+    Var,
+    immediate_rep,
+    is_bool,
+    is_char,
+    is_fixnum,
+    is_immediate,
+    is_null,
+)
+from .regalloc import REGISTERS, allocate
+from .walk import trampoline
+
+
+class Compilation:
+    """
+    The state of one call to emit_program: its options, the label counter
+    and statistics. Emitters reach it through env.compilation, so separate
+    compilations, in one thread or several, never share labels or counts.
+    The primitive and emitter registries are only written at import time.
+    """
 
+    def __init__(self, optimize=True, comments=True):
+        self.optimize = optimize
+        self.comments = comments
+        self.registers = REGISTERS if optimize else ()
+        self.labels = count()
+        # labels made, procedures emitted and variables kept in registers
+        self.stats = Counter()
 
-class Label:
-    counter = -1
-
-    @classmethod
-    def unique(cls):
-        cls.counter += 1
-        return f"L_{cls.counter}"
-
-    @classmethod
-    def _reset(cls):
-        cls.counter = -1
-
-
-###
-# Masks                 Tags
-# fixnum: | 00000011 |  00000000
-# bool:   | 10111111 |
-# char:   | 00111111 |  00001111
-#         |          |
-# Values  |          |
-# F       | 00101111 |
-# T       | 01101111 |
-# null    | 00111111 |
-###
-
-FXSHIFT = 2
-FXMASK = 0x03
-FXTAG = 0x00
-BOOL_F = 0x2F
-BOOL_T = 0x6F
-BOOL_BIT = 6
-BOOL_MASK = 0xBF  # BOOL_MASK & (T or F) give F. Doesn't clash with null
-NULL = 0x3F
-WORDSIZE = 8  # bytes
-
-FIXNUM_BITS = WORDSIZE * 8 - FXSHIFT
-FXLOWER = -(2 ** (FIXNUM_BITS - 1))
-FXUPPER = (2 ** (FIXNUM_BITS - 1)) - 1
-
-CHARS = string.ascii_letters + string.punctuation + string.whitespace + string.digits
-CHARSHIFT = 8
-CHARTAG = 0x0F
-CHARMASK = 0x3F
-
-PAIR_TAG = 1
-OBJ_MASK = 7
-CAR_OFFSET = 0
-CDR_OFFSET = 8
+    def label(self):
+        self.stats["labels"] += 1
+        return f"L_{next(self.labels)}"
 
-PRIMITIVES = {}
-PREDICATES = set()
+    def commented(self, line, comment):
+        """line with comment, or line alone when comments are off."""
+        return line // comment if self.comments else line
 
 
-@dataclass
-class Var:
-    name: str
+PRIMITIVES = {}
+PREDICATES = set()
 
 
 def next_stack_index(si):
@@ -95,139 +116,287 @@ def predicate(f):
     return f
 
 
-def is_fixnum(x):
-    return not is_bool(x) and isinstance(x, int) and FXLOWER <= x <= FXUPPER
+def is_variable(x):
+    return isinstance(x, Var)
 
 
-def is_bool(x):
-    return x is True or x is False
+SPECIAL_FORMS = {}
 
 
-def is_null(x):
-    return x == ()
+def special_form(name):
+    def decorator(f):
+        SPECIAL_FORMS[name] = f
+        return f
 
+    return decorator
 
-def is_char(x):
-    return isinstance(x, str) and len(x) == 1 and x in CHARS
 
+class Scope:
+    """
+    Names visible while parsing. names maps each Var to its innermost
+    Binding; shadowed bindings are kept on an undo log and restored when the
+    inner scope is left.
+    """
 
-def is_immediate(x):
-    return is_fixnum(x) or is_bool(x) or is_null(x) or is_char(x)
+    def __init__(self, labels=frozenset()):
+        self.labels = labels
+        self.names = {}
+        self.shadowed = []
+
+    def bind(self, var):
+        binding = Binding(var)
+        self.shadowed.append((var, self.names.get(var)))
+        self.names[var] = binding
+        return binding
+
+    def unbind(self, n):
+        for _ in range(n):
+            var, binding = self.shadowed.pop()
+            if binding is None:
+                del self.names[var]
+            else:
+                self.names[var] = binding
+
+    def resolve(self, var):
+        try:
+            return self.names[var]
+        except KeyError:
+            raise LookupError(f"Unbound {var}") from None
+
+
+def parse_program(p):
+    """
+    Parse a program in the input representation (see readme) into the typed
+    AST in compiler.nodes.
+    """
+    match p:
+        case ["letrec", [*bindings], body]:
+            return trampoline(parse_letrec(bindings, body))
+        case _:
+            return Letrec((), trampoline(parse(p, Scope())))
 
 
-def immediate_rep(x):
-    if is_fixnum(x):
-        return x << FXSHIFT
-    elif is_bool(x):
-        return BOOL_T if x else BOOL_F
-    elif is_null(x):
-        return NULL
-    elif is_char(x):
-        return (ord(x) << CHARSHIFT) | CHARTAG
+def procedure_name(x):
+    """
+    Procedures are named by strs, or by Vars when read from Scheme source
+    (see compiler.reader).
+    """
+    return x.name if is_variable(x) else x
 
 
-def is_primcall(x):
-    match x:
-        case (rator, *_):
-            return rator in PRIMITIVES
-        case _:
-            return False
+def parse_letrec(bindings, body):
+    lvars = [procedure_name(lvar) for lvar, _ in bindings]
+    scope = Scope(frozenset(lvars))
+    lambdas = []
+    for lvar, (_, lam) in zip(lvars, bindings):
+        lambdas.append((lvar, (yield parse_lambda(lam, scope))))
+    return Letrec(tuple(lambdas), (yield parse(body, scope)))
 
 
-def is_predicate_call(x):
+def parse_lambda(x, scope):
     match x:
-        case (rator, *_):
-            return rator in PRIMITIVES and rator in PREDICATES
+        case [_, [*formals], body]:
+            if not all(is_variable(formal) for formal in formals):
+                raise ValueError("lambda formals must be Vars")
+            bindings = tuple(scope.bind(formal) for formal in formals)
+            lam = Lambda(bindings, (yield parse(body, scope)))
+            scope.unbind(len(bindings))
+            return lam
         case _:
-            return False
+            raise ValueError(f"Unknown lambda: {x}")
 
 
-def is_if(x):
+def parse(x, scope):
+    """
+    Parse the expression x. Variables are resolved against scope, whose
+    labels are the names bound by the enclosing letrec and so the valid
+    operators of an application.
+
+    Leaves are returned directly; compound expressions are parsed by
+    generators, to be run by compiler.walk.trampoline.
+    """
+    if is_immediate(x):
+        return Const(x)
+    elif is_variable(x):
+        return Ref(scope.resolve(x))
     match x:
-        case ("if", _, _, _):
-            return True
-        case _:
-            return False
+        case [str() as head, *args]:
+            if (form := SPECIAL_FORMS.get(head)) is not None:
+                return form(x, scope)
+            elif head in PRIMITIVES:
+                return parse_primcall(head, args, scope)
+            elif head in scope.labels:
+                return parse_app(head, args, scope)
+        case [Var(name=head), *args] if head in scope.labels:
+            return parse_app(head, args, scope)
+    raise ValueError(f"Unknown expression: {x}")
 
 
-def is_and(x):
-    match x:
-        case ("and", *_):
-            return True
-        case _:
-            return False
+def parse_args(args, scope):
+    parsed = []
+    for arg in args:
+        parsed.append((yield parse(arg, scope)))
+    return tuple(parsed)
 
 
-def is_or(x):
-    match x:
-        case ("or", *_):
-            return True
-        case _:
-            return False
+def parse_primcall(op, args, scope):
+    if len(args) != PRIMITIVES[op]["nargs"]:
+        raise TypeError(f"{op}: wrong number of args")
+    return PrimCall(op, (yield parse_args(args, scope)))
 
 
-def is_let(x):
-    match x:
-        case ("let", ([_, _], *_), _):
-            return True
-        case _:
-            return False
+def parse_app(rator, args, scope):
+    return App(rator, (yield parse_args(args, scope)))
 
 
-def is_let_star(x):
+@special_form("if")
+def parse_if(x, scope):
     match x:
-        case ("let*", ([_, _], *_), _):
-            return True
+        case [_, test, consequent, alternative]:
+            return If(
+                (yield parse(test, scope)),
+                (yield parse(consequent, scope)),
+                (yield parse(alternative, scope)),
+            )
         case _:
-            return False
+            raise ValueError(f"Unknown expression: {x}")
 
 
-def is_variable(x):
-    return isinstance(x, Var)
+@special_form("and")
+def parse_and(x, scope):
+    return parse(desugar_and(x), scope)
 
 
-def is_letrec(x):
-    match x:
-        case ["letrec", [*_], _]:
+@special_form("or")
+def parse_or(x, scope):
+    return parse(desugar_or(x), scope)
+
+
+def desugar_and(expr):
+    match expr:
+        case ["and"]:
             return True
-        case _:
+        case ["and", *tests]:
+            result = tests[-1]
+            for test in reversed(tests[:-1]):
+                result = ("if", test, result, False)
+            return result
+
+
+def desugar_or(expr):
+    match expr:
+        case ["or"]:
             return False
+        case ["or", *tests]:
+            result = tests[-1]
+            for test in reversed(tests[:-1]):
+                result = ("if", test, test, result)
+            return result
+
+
+def check_binding(binding):
+    match binding:
+        case [lhs, rhs]:
+            if not is_variable(lhs):
+                raise ValueError("lhs of let binding must be a Var")
+            return lhs, rhs
+        case _:
+            raise ValueError(f"Unknown binding: {binding}")
 
 
-def is_lambda(x):
+@special_form("let")
+def parse_let(x, scope):
     match x:
-        case ["lambda", [*_], _]:
-            return True
+        case [_, [*bindings], body]:
+            bindings = [check_binding(binding) for binding in bindings]
+            rhss = yield parse_args([rhs for _, rhs in bindings], scope)
+            lhss = [scope.bind(lhs) for lhs, _ in bindings]
+            let = Let(tuple(zip(lhss, rhss)), (yield parse(body, scope)))
+            scope.unbind(len(lhss))
+            return let
         case _:
-            return False
+            raise ValueError(f"Unknown expression: {x}")
 
 
-def is_app(x, env):
+@special_form("let*")
+def parse_let_star(x, scope):
     match x:
-        case [rator, *_]:
-            try:
-                lookup(rator, env)
-                return True
-            except KeyError:
-                return False
+        case [_, [*bindings], body]:
+            parsed = []
+            for lhs, rhs in map(check_binding, bindings):
+                rhs = yield parse(rhs, scope)
+                parsed.append((scope.bind(lhs), rhs))
+            expr = yield parse(body, scope)
+            scope.unbind(len(parsed))
+            for binding in reversed(parsed):
+                expr = Let((binding,), expr)
+            return expr
         case _:
-            return False
+            raise ValueError(f"Unknown expression: {x}")
+
+
+class Env:
+    """
+    Locations of bound names: stack indices or register names for variables,
+    labels for letrec procedures and the targets of Loops. registers holds
+    the register allocation, which emit_let and emit_lambda consult when
+    binding variables. compilation is the Compilation being emitted.
+
+    Variables are keyed by their Binding, which the parser has already
+    resolved with the usual shadowing rules, so a single dict serves every
+    scope of a compilation. Extending the env never changes what an existing
+    name resolves to, so it is shared rather than copied on each binding.
+    """
+
+    __slots__ = ("locations", "registers", "compilation")
+
+    def __init__(self, locations, registers=None, compilation=None):
+        self.locations = locations
+        self.registers = {} if registers is None else registers
+        self.compilation = Compilation() if compilation is None else compilation
 
+    def __repr__(self):
+        return f"Env({self.locations!r}, {self.registers!r})"
 
-def make_initial_env(vars=None, vals=None):
+
+def make_initial_env(vars=None, vals=None, compilation=None):
     vars = vars or ()
     vals = vals or ()
-    return [(x[0], x[1]) for x in zip(vars, vals, strict=True)]
+    return Env(dict(zip(vars, vals, strict=True)), compilation=compilation)
 
 
-def emit_program(p, emit):
-    emit_function_header("scheme_entry", emit)
-    emit(Line() // "%rdi: Context")
-    emit(Line() // "%rsi: stack base")
-    emit(Line() // "%rdx: stack base")
+OPTIMIZATIONS = [
+    inline_program,
+    fold_program,
+    eliminate_program,
+    cse_program,
+    loop_program,
+]
+
+
+def optimize_program(program):
+    for optimization in OPTIMIZATIONS:
+        program = optimization(program)
+    return program
+
 
-    emit(1 >> Line("movq %rdi, %rcx") // "store Context location")
-    emit(1 >> Line() // "preserve startup register state")
+def emit_program(p, emit, optimize=True, comments=True):
+    """
+    Emit the listing for p. With comments false, emitters skip making their
+    comments altogether. Returns the Compilation, which holds the
+    statistics.
+    """
+    compilation = Compilation(optimize, comments)
+    commented = compilation.commented
+    emit_function_header("scheme_entry", emit)
+    if comments:
+        emit(Line() // "%rdi: Context")
+        emit(Line() // "%rsi: stack base")
+        emit(Line() // "%rdx: stack base")
+
+    emit(commented(1 >> Line("movq %rdi, %rcx"), "store Context location"))
+    if comments:
+        emit(1 >> Line() // "preserve startup register state")
     emit(1 >> Line("movq %rbx, 8(%rcx)"))
     emit(1 >> Line("movq %rbp, 48(%rcx)"))
     emit(1 >> Line("movq %rsp, 56(%rcx)"))
@@ -236,11 +405,12 @@ def emit_program(p, emit):
     emit(1 >> Line("movq %r14, 112(%rcx)"))
     emit(1 >> Line("movq %r15, 120(%rcx)"))
 
-    emit(1 >> Line("movq %rsi, %rsp") // "load stack base")
-    emit(1 >> Line("movq %rdx, %rbp") // "load allocation pointer")
+    emit(commented(1 >> Line("movq %rsi, %rsp"), "load stack base"))
+    emit(commented(1 >> Line("movq %rdx, %rbp"), "load allocation pointer"))
     emit(1 >> Line("call L_scheme_entry"))
 
-    emit(1 >> Line() // "restore startup state")
+    if comments:
+        emit(1 >> Line() // "restore startup state")
     emit(1 >> Line("movq 8(%rcx), %rbx"))
     emit(1 >> Line("movq 48(%rcx), %rbp"))
     emit(1 >> Line("movq 56(%rcx), %rsp"))
@@ -250,81 +420,101 @@ def emit_program(p, emit):
     emit(1 >> Line("movq 120(%rcx), %r15"))
 
     emit_ret(emit)
-    if is_letrec(p):
-        emit_letrec(p, emit)
-    else:
-        emit_scheme_entry(p, make_initial_env(), emit)
+    program = parse_program(p)
+    if optimize:
+        program = optimize_program(program)
+    emit_letrec(program, emit, compilation)
+    return compilation
 
 
 def emit_scheme_entry(expr, env, emit):
     emit_function_header("L_scheme_entry", emit)
-    emit_expr(-WORDSIZE, env, expr, tail=True, emit=emit)
+    allocate_registers(env, (), expr)
+    trampoline(emit_expr(-WORDSIZE, env, expr, tail=True, emit=emit))
 
 
 def emit_function_header(name, emit, comment=""):
     emit(1 >> Line(".text"))
     emit(Line(f".globl {name}"))
     emit(1 >> Line(f".type {name}, @function"))
-    emit(Line(f"{name}:") // comment)
+    line = Line(f"{name}:")
+    emit(line // comment if comment else line)
+
+
+EMITTERS = {}
+
+
+def emitter(node_type):
+    def decorator(f):
+        EMITTERS[node_type] = f
+        return f
+
+    return decorator
 
 
 def emit_expr(si, env, expr, tail, emit):
-    if is_immediate(expr):
-        emit_immediate(expr, emit)
-        emit_ret_when(tail, emit)
-    elif is_variable(expr):
-        emit_variable_ref(env, expr, emit)
-        emit_ret_when(tail, emit)
-    elif is_primcall(expr):
-        emit_primcall(si, env, expr, emit)
-        emit_ret_when(tail, emit)
-    elif is_if(expr):
-        emit_if(si, env, expr, tail=tail, emit=emit)
-    elif is_and(expr):
-        emit_expr(si, env, desugar_and(expr), tail=tail, emit=emit)
-    elif is_or(expr):
-        emit_expr(si, env, desugar_or(expr), tail=tail, emit=emit)
-    elif is_let(expr):
-        emit_let(si, env, expr, tail=tail, emit=emit)
-    elif is_let_star(expr):
-        emit_let_star(si, env, expr, tail=tail, emit=emit)
-    elif is_app(expr, env):
-        emit_app(si, env, expr, tail=tail, emit=emit)
-    else:
-        raise ValueError(f"Unknown expression: {expr}")
+    """
+    Emit expr. Emitters of compound expressions are generators, to be run by
+    compiler.walk.trampoline, that yield the emission of each sub-expression.
+    """
+    return EMITTERS[type(expr)](si, env, expr, tail, emit)
+
+
+@emitter(Const)
+def emit_const(si, env, expr, tail, emit):
+    emit_immediate(expr.value, emit)
+    emit_ret_when(tail, emit)
 
 
 def emit_immediate(x, emit):
     emit(1 >> Line(f"movq ${immediate_rep(x)}, %rax"))
 
 
-def emit_primcall(si, env, x, emit):
-    primitive = PRIMITIVES[x[0]]
-    if len(x[1:]) != primitive["nargs"]:
-        raise TypeError(f"{x[0]}: wrong number of args")
-    emit(1 >> Line() // f"begin {x[0]}")
-    primitive["emitter"](si, env, *x[1:], emit)
-    emit(1 >> Line() // f"end {x[0]}")
+@emitter(PrimCall)
+def emit_primcall(si, env, expr, tail, emit):
+    if env.compilation.comments:
+        emit(1 >> Line() // f"begin {expr.op}")
+    cc = yield PRIMITIVES[expr.op]["emitter"](si, env, *expr.args, emit)
+    if expr.op in PREDICATES:
+        # predicates leave their result in the flags, as condition code cc
+        emit_boolcmp(env, emit, cc)
+    if env.compilation.comments:
+        emit(1 >> Line() // f"end {expr.op}")
+    emit_ret_when(tail, emit)
+
+
+def is_predicate_call(expr):
+    return isinstance(expr, PrimCall) and expr.op in PREDICATES
+
+
+def emit_predicate(si, env, expr, emit):
+    """Emit a predicate call, leaving the result in the flags. Returns cc."""
+    if env.compilation.comments:
+        emit(1 >> Line() // f"begin {expr.op}")
+    cc = yield PRIMITIVES[expr.op]["emitter"](si, env, *expr.args, emit)
+    if env.compilation.comments:
+        emit(1 >> Line() // f"end {expr.op}")
+    return cc
 
 
 @primitive
 @scheme_name("fxadd1")
 def emit_fxadd1(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"addq ${immediate_rep(1)}, %rax"))
 
 
 @primitive
 @scheme_name("fxsub1")
 def emit_fxsub1(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"subq ${immediate_rep(1)}, %rax"))
 
 
 @primitive
 @scheme_name("fixnum->char")
 def emit_fixnum2char(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"shlq ${CHARSHIFT - FXSHIFT}, %rax"))
     emit(1 >> Line(f"orq ${CHARTAG}, %rax"))
 
@@ -332,22 +522,45 @@ def emit_fixnum2char(si, env, arg, emit):
 @primitive
 @scheme_name("char->fixnum")
 def emit_char2fixnum(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"shrq ${CHARSHIFT - FXSHIFT}, %rax"))
 
 
-def emit_boolcmp(emit, cmp="e"):
+NEGATED_CONDITIONS = {
+    "e": "ne",
+    "ne": "e",
+    "l": "ge",
+    "ge": "l",
+    "le": "g",
+    "g": "le",
+}
+
+# the condition codes that hold when the operands of cmp are exchanged
+SWAPPED_CONDITIONS = {
+    "e": "e",
+    "ne": "ne",
+    "l": "g",
+    "g": "l",
+    "le": "ge",
+    "ge": "le",
+}
+
+
+def emit_boolcmp(env, emit, cmp="e"):
+    commented = env.compilation.commented
     emit(1 >> Line(f"set{cmp} %al"))
-    emit(1 >> Line("movzbq %al, %rax") // "extend al to fill rax")
+    emit(commented(1 >> Line("movzbq %al, %rax"), "extend al to fill rax"))
     emit(
-        1
-        >> Line(f"sal ${BOOL_BIT}, %al")
-        // "shift the result to the bit which discriminates T/F"
+        commented(
+            1 >> Line(f"sal ${BOOL_BIT}, %al"),
+            "shift the result to the bit which discriminates T/F",
+        )
     )
     emit(
-        1
-        >> Line(f"or ${BOOL_F}, %al")
-        // "fill the preceding bits with the common bool bits"
+        commented(
+            1 >> Line(f"or ${BOOL_F}, %al"),
+            "fill the preceding bits with the common bool bits",
+        )
     )
 
 
@@ -355,80 +568,86 @@ def emit_boolcmp(emit, cmp="e"):
 @primitive
 @scheme_name("null?")
 def emit_nullp(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"cmp ${NULL}, %rax"))
-    emit_boolcmp(emit)
+    return "e"
 
 
 @predicate
 @primitive
 @scheme_name("fixnum?")
 def emit_fixnump(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"andq ${FXMASK}, %rax"))
     emit(1 >> Line(f"cmp ${FXTAG}, %rax"))
-    emit_boolcmp(emit)
+    return "e"
 
 
 @predicate
 @primitive
 @scheme_name("fxzero?")
 def emit_fxzerop(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
-    emit(1 >> Line(f"cmp ${FXTAG}, %rax") // "0 is all zeros")
-    emit_boolcmp(emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
+    emit(env.compilation.commented(1 >> Line(f"cmp ${FXTAG}, %rax"), "0 is all zeros"))
+    return "e"
 
 
 @predicate
 @primitive
 @scheme_name("boolean?")
 def emit_booleanp(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
-    emit(1 >> Line(f"and ${BOOL_MASK}, %al") // "F & F and F & T both evaluate to F")
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
+    emit(
+        env.compilation.commented(
+            1 >> Line(f"and ${BOOL_MASK}, %al"), "F & F and F & T both evaluate to F"
+        )
+    )
     emit(1 >> Line(f"cmp ${BOOL_F}, %al"))
-    emit_boolcmp(emit)
+    return "e"
 
 
 @predicate
 @primitive
 @scheme_name("char?")
 def emit_charp(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"and ${CHARMASK}, %al"))
     emit(1 >> Line(f"cmp ${CHARTAG}, %al"))
-    emit_boolcmp(emit)
+    return "e"
 
 
 @primitive
 @scheme_name("not")
 def emit_not(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    if is_predicate_call(arg):
+        cc = yield emit_predicate(si, env, arg, emit)
+        emit_boolcmp(env, emit, NEGATED_CONDITIONS[cc])
+        return
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line(f"cmp ${BOOL_F}, %al"))
-    emit_boolcmp(emit)
+    emit_boolcmp(env, emit)
 
 
 @primitive
 @scheme_name("fxlognot")
 def emit_fxlognot(si, env, arg, emit):
-    emit_expr(si, env, arg, tail=False, emit=emit)
+    yield emit_expr(si, env, arg, tail=False, emit=emit)
     emit(1 >> Line("not %rax"))
-    emit(1 >> Line("and $0xFC, %al") // "reset the tag bits")
+    emit(env.compilation.commented(1 >> Line("and $0xFC, %al"), "reset the tag bits"))
 
 
-def emit_if(si, env, program, tail, emit):
-    _, test, consequent, alternative = program
-    alt_label = Label.unique()
-    end_label = Label.unique()
-    emit(Line() // f"begin if {alt_label} {end_label}")
-    # TODO: (if (fxzero? e0) conseq alt) causes an extra comparison,
-    # and extra work creating a #t or #f value that we don't use
+@emitter(If)
+def emit_if(si, env, expr, tail, emit):
+    test, consequent, alternative = expr.test, expr.consequent, expr.alternative
+    alt_label = env.compilation.label()
+    end_label = env.compilation.label()
+    if env.compilation.comments:
+        emit(Line() // f"begin if {alt_label} {end_label}")
     # write the test
-    emit_expr(si, env, test, tail=False, emit=emit)
+    yield emit_branch(si, env, test, alt_label, False, emit)
 
     # write the consequent
-    emit(1 >> Line(f"cmp ${BOOL_F}, %al") // "compare result of test to False")
-    emit(1 >> Line(f"je {alt_label}") // "jump to alt if False")
-    emit_expr(si, env, consequent, tail=tail, emit=emit)
+    yield emit_expr(si, env, consequent, tail=tail, emit=emit)
     if not tail:
         # if this expression is in tail position the sub-expressions
         # will eventually return so we don't need the end label
@@ -436,31 +655,63 @@ def emit_if(si, env, program, tail, emit):
 
     # write the alternative
     emit(Line(f"{alt_label}:"))
-    emit_expr(si, env, alternative, tail=tail, emit=emit)
+    yield emit_expr(si, env, alternative, tail=tail, emit=emit)
 
     if not tail:
         emit(Line(f"{end_label}:"))
-    emit(Line() // f"end if {alt_label} {end_label}")
+    if env.compilation.comments:
+        emit(Line() // f"end if {alt_label} {end_label}")
 
 
-def desugar_and(expr):
-    match expr:
-        case ["and"]:
-            return True
-        case ["and", rator]:
-            return rator
-        case ["and", rator, *rest]:
-            return ("if", rator, desugar_and(["and", *rest]), False)
-
-
-def desugar_or(expr):
+def emit_branch(si, env, expr, label, when, emit):
+    """
+    Emit expr as a condition: jump to label if its truth value is when, and
+    fall through otherwise. Predicates jump directly on their condition
+    code, so no boolean is materialized; not, and nested ifs (including
+    and/or) are compiled into jumps.
+    """
     match expr:
-        case ["or"]:
-            return False
-        case ["or", rator]:
-            return rator
-        case ["or", rator, *rest]:
-            return ("if", rator, rator, desugar_or(["or", *rest]))
+        case Const(value=value):
+            if (value is not False) == when:
+                emit(1 >> Line(f"jmp {label}"))
+        case PrimCall(op="not", args=(arg,)):
+            yield emit_branch(si, env, arg, label, not when, emit)
+        case PrimCall(op=op) if op in PREDICATES:
+            cc = yield emit_predicate(si, env, expr, emit)
+            cc = cc if when else NEGATED_CONDITIONS[cc]
+            emit(1 >> Line(f"j{cc} {label}"))
+        case If():
+            yield emit_branch_if(si, env, expr, label, when, emit)
+        case _:
+            yield emit_expr(si, env, expr, tail=False, emit=emit)
+            line = 1 >> Line(f"cmp ${BOOL_F}, %al")
+            emit(env.compilation.commented(line, "compare to False"))
+            emit(1 >> Line(f"{'jne' if when else 'je'} {label}"))
+
+
+def emit_branch_if(si, env, expr, label, when, emit):
+    test, consequent, alternative = expr.test, expr.consequent, expr.alternative
+    end_label = env.compilation.label()
+    if same(consequent, test):
+        # (or a b) is (if a a b): a is true whenever the consequent is reached
+        consequent = Const(True)
+    if isinstance(alternative, Const):
+        # e.g. (and a b): (if a b #f)
+        taken = (alternative.value is not False) == when
+        yield emit_branch(si, env, test, label if taken else end_label, False, emit)
+        yield emit_branch(si, env, consequent, label, when, emit)
+    elif isinstance(consequent, Const):
+        taken = (consequent.value is not False) == when
+        yield emit_branch(si, env, test, label if taken else end_label, True, emit)
+        yield emit_branch(si, env, alternative, label, when, emit)
+    else:
+        alt_label = env.compilation.label()
+        yield emit_branch(si, env, test, alt_label, False, emit)
+        yield emit_branch(si, env, consequent, label, when, emit)
+        emit(1 >> Line(f"jmp {end_label}"))
+        emit(Line(f"{alt_label}:"))
+        yield emit_branch(si, env, alternative, label, when, emit)
+    emit(Line(f"{end_label}:"))
 
 
 def emit_binargs(si, env, arg1, arg2, emit):
@@ -469,32 +720,77 @@ def emit_binargs(si, env, arg1, arg2, emit):
 
     arg1 result will be in <si>(%rsp), arg2 in %rax
     """
-    emit_expr(si, env, arg1, tail=False, emit=emit)
-    emit_stack_save(si, emit)
-    emit_expr(next_stack_index(si), env, arg2, tail=False, emit=emit)
+    yield emit_expr(si, env, arg1, tail=False, emit=emit)
+    emit_stack_save(si, emit, comment=stack_save_comment(env))
+    yield emit_expr(next_stack_index(si), env, arg2, tail=False, emit=emit)
 
 
-def emit_stack_save(si, emit, source="rax", comment="stack save"):
-    emit(1 >> Line(f"movq %{source}, {si}(%rsp)") // comment)
+def stack_save_comment(env):
+    return "stack save" if env.compilation.comments else ""
+
+
+def emit_stack_save(si, emit, source="rax", comment=""):
+    line = 1 >> Line(f"movq %{source}, {si}(%rsp)")
+    emit(line // comment if comment else line)
 
 
 def emit_stack_load(si, emit, dest="rax", comment=""):
-    emit(1 >> Line(f"movq {si}(%rsp), %{dest}") // comment)
+    line = 1 >> Line(f"movq {si}(%rsp), %{dest}")
+    emit(line // comment if comment else line)
+
+
+def is_imm32(n):
+    return -(1 << 31) <= n < 1 << 31
+
+
+def operand(env, expr):
+    """
+    Return expr as an instruction operand, if it needs no evaluation: an
+    immediate for a constant that fits in 32 bits, or the location of a
+    variable. Otherwise return None.
+    """
+    match expr:
+        case Const(value=value) if is_imm32(immediate_rep(value)):
+            return f"${immediate_rep(value)}"
+        case Ref(binding=binding):
+            return location_operand(lookup(binding, env))
+    return None
+
+
+def emit_binop_args(si, env, arg1, arg2, emit):
+    """
+    Evaluate one of arg1 and arg2 into %rax, and return (source, swapped):
+    source is an operand holding the other, and swapped is True when %rax
+    holds arg2. arg2 is evaluated into %rax only when arg1 is an operand,
+    or when neither is and arg1 must be spilled to <si>(%rsp).
+    """
+    if (source := operand(env, arg2)) is not None:
+        yield emit_expr(si, env, arg1, tail=False, emit=emit)
+        return source, False
+    elif (source := operand(env, arg1)) is not None:
+        yield emit_expr(si, env, arg2, tail=False, emit=emit)
+        return source, True
+    yield emit_binargs(si, env, arg1, arg2, emit)
+    return f"{si}(%rsp)", True
 
 
 @primitive
 @scheme_name("fx+")
 def emit_fxplus(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"addq {si}(%rsp), %rax"))
+    source, _ = yield emit_binop_args(si, env, arg1, arg2, emit)
+    emit(1 >> Line(f"addq {source}, %rax"))
 
 
 @primitive
 @scheme_name("fx-")
 def emit_fxminus(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"subq %rax, {si}(%rsp)"))
-    emit_stack_load(si, emit)
+    source, swapped = yield emit_binop_args(si, env, arg1, arg2, emit)
+    if swapped:
+        # arg1 - arg2 = -arg2 + arg1
+        emit(1 >> Line("negq %rax"))
+        emit(1 >> Line(f"addq {source}, %rax"))
+    else:
+        emit(1 >> Line(f"subq {source}, %rax"))
 
 
 @primitive
@@ -505,120 +801,163 @@ def emit_fxmul(si, env, arg1, arg2, emit):
     4x * 4y = 16xy, where we want 4x * 4y = 4xy.
 
     Thus we implement multiplication as 4xy = (4x / 4) * 4y, using sarq to
-    implement the division.
+    implement the division. When one operand is a constant, the other is
+    multiplied by its unscaled value, which keeps the tag bits clear.
     """
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"sarq ${FXSHIFT}, {si}(%rsp)"))
-    emit(1 >> Line(f"imulq {si}(%rsp), %rax"))
+    match arg1, arg2:
+        case _, Const(value=y) if (multiply := multiply_by(y)) is not None:
+            yield emit_expr(si, env, arg1, tail=False, emit=emit)
+            for text in multiply:
+                emit(1 >> Line(text))
+        case Const(value=x), _ if (multiply := multiply_by(x)) is not None:
+            yield emit_expr(si, env, arg2, tail=False, emit=emit)
+            for text in multiply:
+                emit(1 >> Line(text))
+        case _:
+            source, _ = yield emit_binop_args(si, env, arg1, arg2, emit)
+            emit(1 >> Line(f"sarq ${FXSHIFT}, %rax"))
+            emit(1 >> Line(f"imulq {source}, %rax"))
+
+
+# the scales of an lea index
+LEA_SCALES = (2, 4, 8)
+
+
+def multiply_by(k):
+    """
+    Return the instructions that multiply %rax by the fixnum k, reduced to
+    shifts and leas where possible, or None if k is not a fixnum or does not
+    fit an immediate. Shifting left and adding multiples of %rax leave the
+    FXSHIFT tag bits of a fixnum zero, as imulq does.
+    """
+    if not is_fixnum(k):
+        return None
+    elif k == 0:
+        return ["movq $0, %rax"]
+    n = abs(k)
+    # n = m * 2**shift, with m odd
+    shift = (n & -n).bit_length() - 1
+    m = n >> shift
+    if m == 1:
+        texts = [f"salq ${shift}, %rax"] if shift else []
+    elif m - 1 in LEA_SCALES:
+        texts = [f"leaq (%rax,%rax,{m - 1}), %rax"]
+        if shift:
+            texts.append(f"salq ${shift}, %rax")
+    elif is_imm32(k):
+        return [f"imulq ${k}, %rax"]
+    else:
+        return None
+    if k < 0:
+        texts.append("negq %rax")
+    return texts
 
 
 @primitive
 @scheme_name("fxlogand")
 def emit_fxlogand(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"andq {si}(%rsp), %rax"))
+    source, _ = yield emit_binop_args(si, env, arg1, arg2, emit)
+    emit(1 >> Line(f"andq {source}, %rax"))
 
 
 @primitive
 @scheme_name("fxlogor")
 def emit_fxlogor(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"orq {si}(%rsp), %rax"))
+    source, _ = yield emit_binop_args(si, env, arg1, arg2, emit)
+    emit(1 >> Line(f"orq {source}, %rax"))
+
+
+def emit_compare(si, env, arg1, arg2, cc, emit):
+    """Compare arg1 with arg2. Returns the condition code for cc."""
+    source, swapped = yield emit_binop_args(si, env, arg1, arg2, emit)
+    emit(1 >> Line(f"cmpq {source}, %rax"))
+    return SWAPPED_CONDITIONS[cc] if swapped else cc
 
 
 @predicate
 @primitive
 @scheme_name("fx=")
 def emit_fxequal(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"cmpq {si}(%rsp), %rax"))
-    emit_boolcmp(emit)
+    return (yield emit_compare(si, env, arg1, arg2, "e", emit))
 
 
 @predicate
 @primitive
 @scheme_name("fx<")
 def emit_fxlt(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"cmpq %rax, {si}(%rsp)"))
-    emit_boolcmp(emit, "l")
+    return (yield emit_compare(si, env, arg1, arg2, "l", emit))
 
 
 @predicate
 @primitive
 @scheme_name("fx<=")
 def emit_fxlte(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"cmpq %rax, {si}(%rsp)"))
-    emit_boolcmp(emit, "le")
+    return (yield emit_compare(si, env, arg1, arg2, "le", emit))
 
 
 @predicate
 @primitive
 @scheme_name("fx>")
 def emit_fxgt(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"cmpq %rax, {si}(%rsp)"))
-    emit_boolcmp(emit, "g")
+    return (yield emit_compare(si, env, arg1, arg2, "g", emit))
 
 
 @predicate
 @primitive
 @scheme_name("fx>=")
 def emit_fxgte(si, env, arg1, arg2, emit):
-    emit_binargs(si, env, arg1, arg2, emit)
-    emit(1 >> Line(f"cmpq %rax, {si}(%rsp)"))
-    emit_boolcmp(emit, "ge")
+    return (yield emit_compare(si, env, arg1, arg2, "ge", emit))
 
 
 @predicate
 @primitive
 @scheme_name("char=")
 def emit_charequal(si, env, arg1, arg2, emit):
-    emit_fxequal(si, env, arg1, arg2, emit)
+    return (yield emit_fxequal(si, env, arg1, arg2, emit))
 
 
 @predicate
 @primitive
 @scheme_name("char<")
 def emit_charlt(si, env, arg1, arg2, emit):
-    emit_fxlt(si, env, arg1, arg2, emit)
+    return (yield emit_fxlt(si, env, arg1, arg2, emit))
 
 
 @predicate
 @primitive
 @scheme_name("char<=")
 def emit_charlte(si, env, arg1, arg2, emit):
-    emit_fxlte(si, env, arg1, arg2, emit)
+    return (yield emit_fxlte(si, env, arg1, arg2, emit))
 
 
 @predicate
 @primitive
 @scheme_name("char>")
 def emit_chargt(si, env, arg1, arg2, emit):
-    emit_fxgt(si, env, arg1, arg2, emit)
+    return (yield emit_fxgt(si, env, arg1, arg2, emit))
 
 
 @predicate
 @primitive
 @scheme_name("char>=")
 def emit_chargte(si, env, arg1, arg2, emit):
-    emit_fxgte(si, env, arg1, arg2, emit)
+    return (yield emit_fxgte(si, env, arg1, arg2, emit))
 
 
 @primitive
 @scheme_name("cons")
 def emit_cons(si, env, a, d, emit):
-    emit_expr(si, env, a, tail=False, emit=emit)
-    emit_stack_save(si, emit)
-    emit_expr(next_stack_index(si), env, d, tail=False, emit=emit)
-    emit_stack_save(next_stack_index(si), emit)
+    commented = env.compilation.commented
+    yield emit_expr(si, env, a, tail=False, emit=emit)
+    emit_stack_save(si, emit, comment=stack_save_comment(env))
+    yield emit_expr(next_stack_index(si), env, d, tail=False, emit=emit)
+    emit_stack_save(next_stack_index(si), emit, comment=stack_save_comment(env))
 
     emit_stack_load(si, emit)
-    emit(1 >> Line(f"movq %rax, {CAR_OFFSET}(%rbp)") // "store car on heap")
+    emit(commented(1 >> Line(f"movq %rax, {CAR_OFFSET}(%rbp)"), "store car on heap"))
     emit_stack_load(next_stack_index(si), emit)
-    emit(1 >> Line(f"movq %rax, {CDR_OFFSET}(%rbp)") // "store cdr on heap")
-    emit(1 >> Line("movq %rbp, %rax") // "store pair address in rax")
+    emit(commented(1 >> Line(f"movq %rax, {CDR_OFFSET}(%rbp)"), "store cdr on heap"))
+    emit(commented(1 >> Line("movq %rbp, %rax"), "store pair address in rax"))
     emit(1 >> Line(f"orq ${PAIR_TAG}, %rax"))
     emit(1 >> Line(f"add ${2 * CDR_OFFSET}, %rbp"))
 
@@ -626,7 +965,7 @@ def emit_cons(si, env, a, d, emit):
 @primitive
 @scheme_name("car")
 def emit_car(si, env, pair, emit):
-    emit_expr(si, env, pair, tail=False, emit=emit)
+    yield emit_expr(si, env, pair, tail=False, emit=emit)
     emit(1 >> Line("subq $1, %rax"))
     emit(1 >> Line("movq 0(%rax), %rax"))
 
@@ -634,7 +973,7 @@ def emit_car(si, env, pair, emit):
 @primitive
 @scheme_name("cdr")
 def emit_cdr(si, env, pair, emit):
-    emit_expr(si, env, pair, tail=False, emit=emit)
+    yield emit_expr(si, env, pair, tail=False, emit=emit)
     emit(1 >> Line("addq $7, %rax"))
     emit(1 >> Line("movq 0(%rax), %rax"))
 
@@ -643,113 +982,226 @@ def emit_cdr(si, env, pair, emit):
 @primitive
 @scheme_name("pair?")
 def emit_pairp(si, env, expr, emit):
-    emit_expr(si, env, expr, tail=False, emit=emit)
+    yield emit_expr(si, env, expr, tail=False, emit=emit)
     emit(1 >> Line(f"andq ${OBJ_MASK}, %rax"))
     emit(1 >> Line(f"cmpq ${PAIR_TAG}, %rax"))
-    emit_boolcmp(emit)
+    return "e"
 
 
+@emitter(Let)
 def emit_let(si, env, expr, tail, emit):
-    def process_let(bindings, si, new_env):
-        match bindings:
-            case []:
-                return emit_expr(si, new_env, expr[2], tail=tail, emit=emit)
-            case [(lhs, rhs), *rest]:
-                if not isinstance(lhs, Var):
-                    raise ValueError("lhs of let binding must be a Var")
-                emit_expr(si, env, rhs, tail=False, emit=emit)
-                emit_stack_save(si, emit, comment=f"let bind {lhs.name}")
-                return process_let(
-                    rest, next_stack_index(si), extend_env(lhs, si, new_env)
-                )
-
-    return process_let(expr[1], si, env)
-
-
-def emit_let_star(si, env, expr, tail, emit):
-    def process_let_star(bindings, si, new_env):
-        match bindings:
-            case []:
-                return emit_expr(si, new_env, expr[2], tail=tail, emit=emit)
-            case [(lhs, rhs), *rest]:
-                if not isinstance(lhs, Var):
-                    raise ValueError("lhs of let binding must be a Var")
-                emit_expr(si, new_env, rhs, tail=False, emit=emit)
-                emit_stack_save(si, emit)
-                return process_let_star(
-                    rest, next_stack_index(si), extend_env(lhs, si, new_env)
-                )
-
-    return process_let_star(expr[1], si, env)
+    new_env = env
+    for lhs, rhs in expr.bindings:
+        yield emit_expr(si, env, rhs, tail=False, emit=emit)
+        comment = f"let bind {lhs.name}" if env.compilation.comments else ""
+        if (register := env.registers.get(lhs)) is not None:
+            line = 1 >> Line(f"movq %rax, %{register}")
+            emit(line // comment if comment else line)
+            new_env = extend_env(lhs, register, new_env)
+        else:
+            emit_stack_save(si, emit, comment=comment)
+            new_env = extend_env(lhs, si, new_env)
+            si = next_stack_index(si)
+    yield emit_expr(si, new_env, expr.body, tail=tail, emit=emit)
 
 
 def extend_env(var, si, env):
-    return [(var, si), *env]
+    env.locations[var] = si
+    return env
+
+
+def location_operand(location):
+    """The operand for a variable's location: a register or a stack slot."""
+    if isinstance(location, str):
+        return f"%{location}"
+    return f"{location}(%rsp)"
 
 
 def lookup(var, env):
-    for x, si in env:
-        if x == var:
-            return si
-    raise KeyError(f"'{var}' not in env: {env!r}")
+    try:
+        return env.locations[var]
+    except KeyError:
+        raise KeyError(f"'{var}' not in env: {env!r}") from None
 
 
-def emit_variable_ref(env, expr, emit):
-    if (si := lookup(expr, env)) is not None:
-        emit_stack_load(si, emit, comment=f"lookup {expr.name}")
+@emitter(Ref)
+def emit_variable_ref(si, env, expr, tail, emit):
+    source = location_operand(lookup(expr.binding, env))
+    if env.compilation.comments:
+        emit(1 >> Line(f"movq {source}, %rax") // f"lookup {expr.binding.name}")
     else:
-        raise LookupError(f"Unbound {expr}")
+        emit(1 >> Line(f"movq {source}, %rax"))
+    emit_ret_when(tail, emit)
 
 
-def emit_letrec(expr, emit):
-    _, bindings, body = expr
-    lvars = [x[0] for x in bindings]
-    lambdas = [x[1] for x in bindings]
-    labels = [Label.unique() for _ in lvars]
-    env = make_initial_env(lvars, labels)
+def emit_letrec(expr, emit, compilation=None):
+    """
+    Emit expr, keeping variables in registers where compilation allows.
+    """
+    compilation = Compilation() if compilation is None else compilation
+    lvars = [x[0] for x in expr.bindings]
+    lambdas = [x[1] for x in expr.bindings]
+    labels = [compilation.label() for _ in lvars]
+    env = make_initial_env(lvars, labels, compilation)
     for lvar, lam, label in zip(lvars, lambdas, labels, strict=True):
-        emit_lambda(env, lam, label, emit, comment=f"lambda@{lvar}")
-    emit_scheme_entry(body, env, emit)
+        comment = f"lambda@{lvar}" if compilation.comments else ""
+        emit_lambda(env, lam, label, emit, comment)
+    emit_scheme_entry(expr.body, env, emit)
+
+
+def allocate_registers(env, formals, body):
+    compilation = env.compilation
+    allocation = allocate(formals, body, compilation.registers)
+    compilation.stats["procedures"] += 1
+    compilation.stats["registers"] += len(allocation)
+    env.registers.update(allocation)
 
 
 def emit_lambda(env, expr, label, emit, comment=""):
     emit_function_header(label, emit, comment=comment)
-    _, formals, body = expr
+    allocate_registers(env, expr.formals, expr.body)
     si = -WORDSIZE
-    for formal, si in zip(formals, count(si, -WORDSIZE)):
-        env = extend_env(formal, si, env)
-    emit_expr(next_stack_index(si), env, body, tail=True, emit=emit)
-
-
+    for formal, si in zip(expr.formals, count(si, -WORDSIZE)):
+        # the caller passes the args on the stack
+        if (register := env.registers.get(formal)) is not None:
+            comment = f"load {formal.name}" if env.compilation.comments else ""
+            emit_stack_load(si, emit, register, comment=comment)
+            env = extend_env(formal, register, env)
+        else:
+            env = extend_env(formal, si, env)
+    body_si = next_stack_index(si)
+    trampoline(emit_expr(body_si, env, expr.body, tail=True, emit=emit))
+
+
+@emitter(App)
 def emit_app(si, env, expr, tail, emit):
-    def emit_arguments(si, args):
-        match args:
-            case first, *rest:
-                emit_expr(si, env, first, tail=False, emit=emit)
-                emit_stack_save(si, emit, comment="save arg on stack")
-                return emit_arguments(next_stack_index(si), rest)
-            case _:
-                return
-
-    rator, *args = expr
-    emit(1 >> Line() // f"{lookup(rator, env)} ({rator}) prologue")
-    emit_arguments(
-        next_stack_index(si),  # leave one cell empty for the return address
-        args,
-    )
+    rator, args = expr.rator, expr.args
+    label = lookup(rator, env)
+    if env.compilation.comments:
+        emit(1 >> Line() // f"{label} ({rator}) prologue")
     if tail:
-        # shift the args from (si + WORDSIZE)... down to -WORDSIZE(%rsp)...
+        yield emit_tail_call(si, env, label, args, emit)
+        return
+    # leave one cell empty for the return address
+    arg_si = next_stack_index(si)
+    for arg in args:
+        yield emit_expr(arg_si, env, arg, tail=False, emit=emit)
+        comment = "save arg on stack" if env.compilation.comments else ""
+        emit_stack_save(arg_si, emit, comment=comment)
+        arg_si = next_stack_index(arg_si)
+    # adjust rsp so call puts the return address in the empty cell
+    emit_adjust_base(si + WORDSIZE, emit)
+    emit_call(label, emit)
+    emit_adjust_base(-(si + WORDSIZE), emit)
+
+
+def emit_tail_call(si, env, label, args, emit, targets=None):
+    """
+    Pass args in targets, by default -WORDSIZE(%rsp)..., and jump to label.
+
+    Args that are constants or variables are moved into place last, by
+    emit_parallel_move. The others are evaluated in order, each straight
+    into its target unless a later arg or move still reads that location, in
+    which case it is evaluated into a temporary below every target.
+    """
+    if targets is None:
+        targets = [-i * WORDSIZE for i in range(1, len(args) + 1)]
+    if slots := [target for target in targets if isinstance(target, int)]:
+        si = min(si, next_stack_index(min(slots)))
+    sources = [operand(env, arg) for arg in args]
+    reads = [locations_read(env, arg) for arg in args]
+    # the locations read by the moves, and by the args evaluated after each
+    move_reads = set()
+    later_reads = [set()]
+    for source, read in zip(reversed(sources), reversed(reads)):
+        if source is None:
+            later_reads.append(later_reads[-1] | read)
+        else:
+            move_reads |= read
+            later_reads.append(later_reads[-1])
+    later_reads = later_reads[-2::-1]
+    moves = []
+    if env.compilation.comments:
         emit(1 >> Line() // "begin TCO")
-        for i in range(1, len(args) + 1):
-            emit(1 >> Line() // f"shift arg {i} to local {i} position")
-            emit(1 >> Line(f"movq {si - i * WORDSIZE}(%rsp), %rax"))
-            emit(1 >> Line(f"movq %rax, {-i * WORDSIZE}(%rsp)"))
-        emit(1 >> Line(f"jmp {lookup(rator, env)}") // "end TCO")
+    for i, (arg, target, source) in enumerate(zip(args, targets, sources)):
+        if source is not None:
+            moves.append((source, location_operand(target)))
+            continue
+        yield emit_expr(si, env, arg, tail=False, emit=emit)
+        comment = f"arg {i + 1}" if env.compilation.comments else ""
+        if target in later_reads[i] or target in move_reads:
+            emit_stack_save(si, emit, comment=comment)
+            moves.append((location_operand(si), location_operand(target)))
+            si = next_stack_index(si)
+        else:
+            dest = location_operand(target)
+            line = 1 >> Line(f"movq %rax, {dest}")
+            emit(line // comment if comment else line)
+    emit_parallel_move(moves, emit, env.compilation.comments)
+    emit(env.compilation.commented(1 >> Line(f"jmp {label}"), "end TCO"))
+
+
+def locations_read(env, expr):
+    """The locations of the variables referenced in expr."""
+    return {
+        env.locations[node.binding]
+        for node in nodes(expr)
+        # variables bound within expr have no location yet
+        if isinstance(node, Ref) and node.binding in env.locations
+    }
+
+
+def emit_parallel_move(moves, emit, comments=True):
+    """
+    Perform moves, a list of (source, destination) operands, as if all at
+    once. A move waits while its destination is the source of another, and
+    a cycle of such moves is broken by saving one destination in %r11.
+    """
+    moves = [(source, dest) for source, dest in moves if source != dest]
+    while moves:
+        sources = {source for source, _ in moves}
+        for i, (source, dest) in enumerate(moves):
+            if dest not in sources:
+                emit_move(source, dest, emit)
+                del moves[i]
+                break
+        else:
+            _, dest = moves[0]
+            comment = "break move cycle" if comments else ""
+            emit_move(dest, "%r11", emit, comment=comment)
+            moves = [
+                ("%r11" if source == dest else source, other)
+                for source, other in moves
+            ]
+
+
+def emit_move(source, dest, emit, comment=""):
+    if source.endswith(")") and dest.endswith(")"):
+        # there is no memory to memory mov
+        emit(1 >> Line(f"movq {source}, %rax"))
+        source = "%rax"
+    line = 1 >> Line(f"movq {source}, {dest}")
+    emit(line // comment if comment else line)
+
+
+@emitter(Loop)
+def emit_loop(si, env, expr, tail, emit):
+    label = env.compilation.label()
+    env = extend_env(expr.target, label, env)
+    if env.compilation.comments:
+        emit(Line(f"{label}:") // f"loop {expr.target.name}")
     else:
-        # adjust rsp so call puts the return address in the empty cell
-        emit_adjust_base(si + WORDSIZE, emit)
-        emit_call(lookup(rator, env), emit)
-        emit_adjust_base(-(si + WORDSIZE), emit)
+        emit(Line(f"{label}:"))
+    yield emit_expr(si, env, expr.body, tail=tail, emit=emit)
+
+
+@emitter(Recur)
+def emit_recur(si, env, expr, tail, emit):
+    label = lookup(expr.target, env)
+    targets = [lookup(formal, env) for formal in expr.formals]
+    if env.compilation.comments:
+        emit(1 >> Line() // f"{label} ({expr.target.name}) next iteration")
+    yield emit_tail_call(si, env, label, expr.args, emit, targets)
 
 
 def emit_adjust_base(offset, emit):
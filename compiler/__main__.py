@@ -1,4 +1,6 @@
 import argparse
+import hashlib
+import io
 import os
 import pathlib
 import subprocess
@@ -6,9 +8,20 @@ import sys
 import tempfile
 
 from compiler import Var, emit_program
-from compiler.io import FileWriter, StdoutWriter
-
-project_dir = pathlib.Path(__file__).parent.parent
+from compiler.build import (
+    RUNTIME,
+    Assembler,
+    assemble,
+    cached_executable,
+    encode_executable,
+    executable_key,
+    runtime_object,
+)
+from compiler.cache import Cache, default_cache_dir, load_program
+from compiler.io import FileWriter, StdoutWriter, Tee
+from compiler.jit import Jit
+from compiler.peephole import Peephole
+from compiler.reader import read_program
 
 builtins = {
     "λ": "lambda",
@@ -29,6 +42,13 @@ output_group.add_argument(
     action="store_true",
     help="compile and execute program",
 )
+output_group.add_argument(
+    "-j",
+    "--jit",
+    required=False,
+    action="store_true",
+    help="compile and execute program in process, without gcc",
+)
 output_group.add_argument(
     "-p", "--print", required=False, action="store_true", help="print listing"
 )
@@ -44,44 +64,160 @@ input_group.add_argument(
     dest="read_stdin",
     help="read from stdin",
 )
+parser.add_argument(
+    "--cache-dir",
+    type=pathlib.Path,
+    default=default_cache_dir(),
+    help="directory for cached parsed programs and the compiled runtime",
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    dest="no_cache",
+    help="always parse the source and compile the runtime, without reading or "
+    "writing the cache",
+)
+parser.add_argument(
+    "--no-peephole",
+    action="store_true",
+    dest="no_peephole",
+    help="write the listing without peephole optimization",
+)
+parser.add_argument(
+    "--peephole-stats",
+    action="store_true",
+    dest="peephole_stats",
+    help="report the instructions removed by each peephole rule on stderr",
+)
+parser.add_argument(
+    "--no-comments",
+    action="store_true",
+    dest="no_comments",
+    help="write the listing without comments, skipping their formatting",
+)
+parser.add_argument(
+    "--keep-asm",
+    type=pathlib.Path,
+    metavar="PATH",
+    dest="keep_asm",
+    help="write the listing to PATH and assemble it from there, instead of "
+    "piping it to gcc; with -j, write it there as it is encoded",
+)
+parser.add_argument(
+    "--gas",
+    action="store_true",
+    help="assemble the listing with gas instead of the built-in encoder",
+)
+
+
+def read_source(args):
+    if args.no_cache:
+        if args.read_stdin:
+            return read_program(sys.stdin, builtins)
+        with open(args.file, "r") as f:
+            return read_program(f, builtins)
+
+    cache = Cache(args.cache_dir / "programs")
+    if args.read_stdin:
+        source = sys.stdin.buffer.read()
+        digest = hashlib.sha256(source).hexdigest()
+        return load_program(
+            cache,
+            digest,
+            lambda: io.TextIOWrapper(io.BytesIO(source), "utf-8"),
+            builtins,
+        )
+    with open(args.file, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return load_program(cache, digest, lambda: open(args.file, "r"), builtins)
+
+
+def runtime(args):
+    if args.no_cache:
+        return RUNTIME
+    return runtime_object(Cache(args.cache_dir / "runtime"))
+
+
+def write_listing(program, writer, args):
+    comments = not args.no_comments
+    if args.no_peephole:
+        emit_program(program, writer.write, comments=comments)
+        return
+    with Peephole(writer.write) as peephole:
+        emit_program(program, peephole.write, comments=comments)
+    if args.peephole_stats:
+        for name, removed in sorted(peephole.removed.items()):
+            print(f"{name}: {removed}", file=sys.stderr)
+
+
+def listing_options(args):
+    return {"peephole": not args.no_peephole, "comments": not args.no_comments}
 
 
-def clean(input):
-    return input.replace("\n", "").replace("\r", "")
+def execute(binfile):
+    print(
+        ">",
+        subprocess.run([binfile], check=True, capture_output=True).stdout.decode(
+            "utf-8"
+        ),
+        end="",
+    )
+
+
+def jit_execute(program, args):
+    # the runtime library is loaded from the cache even with --no-cache
+    jit = Jit(Cache(args.cache_dir / "runtime"))
+    if args.keep_asm:
+        with FileWriter(args.keep_asm) as writer:
+            code = jit.encode(
+                lambda encoder: write_listing(program, Tee(writer, encoder), args)
+            )
+    else:
+        code = jit.encode(lambda encoder: write_listing(program, encoder, args))
+    try:
+        print(">", jit.execute(code), end="")
+    finally:
+        code.close()
 
 
 def main():
     args = parser.parse_args()
-    if args.read_stdin:
-        program = clean(sys.stdin.read())
-    else:
-        with open(args.file, "r") as f:
-            program = clean(f.read())
+    if args.jit and args.gas:
+        parser.error("argument --gas: not allowed with argument -j/--jit")
+    program = read_source(args)
 
     if args.print:
         with StdoutWriter() as writer:
-            emit_program(eval(program, builtins), writer.write)
+            write_listing(program, writer, args)
+    elif args.jit:
+        jit_execute(program, args)
+    # a cached executable is not emitted again, so has no peephole stats
+    elif not (args.no_cache or args.keep_asm or args.gas or args.peephole_stats):
+        cache = Cache(args.cache_dir / "executables")
+        binfile = cached_executable(
+            cache,
+            executable_key(program, listing_options(args)),
+            lambda writer: write_listing(program, writer, args),
+            runtime(args),
+        )
+        execute(binfile)
     else:
         with tempfile.TemporaryDirectory() as tmpdirname:
-            asmfile = os.path.join(tmpdirname, "stst.s")
             binfile = os.path.join(tmpdirname, "stst")
-            runtimefile = project_dir / "startup.c"
-            with FileWriter(asmfile) as writer:
-                emit_program(
-                    eval(program, builtins),
-                    writer.write,
+            if args.keep_asm:
+                with FileWriter(args.keep_asm) as writer:
+                    write_listing(program, writer, args)
+                assemble(args.keep_asm, binfile, runtime(args))
+            elif args.gas:
+                with Assembler(binfile, runtime(args)) as assembler:
+                    write_listing(program, assembler, args)
+            else:
+                encode_executable(
+                    lambda writer: write_listing(program, writer, args),
+                    binfile,
+                    runtime(args),
                 )
-            subprocess.run(
-                ["gcc", "-fomit-frame-pointer", runtimefile, asmfile, "-o", binfile],
-                check=True,
-            )
-            print(
-                ">",
-                subprocess.run(
-                    [binfile], check=True, capture_output=True
-                ).stdout.decode("utf-8"),
-                end="",
-            )
+            execute(binfile)
 
 
 if __name__ == "__main__":
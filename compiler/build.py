@@ -0,0 +1,179 @@
+"""
+Building executables from listings.
+
+encode_executable encodes the listing with compiler.encoder and has gcc
+link the object, so no assembler runs:
+
+    encode_executable(lambda writer: emit_program(program, writer.write), binary)
+
+Assembler is a Writer whose lines stream into gcc's stdin instead, so gas
+assembles the listing as it is emitted:
+
+    with Assembler(binary) as assembler:
+        emit_program(program, assembler.write)
+
+assemble builds from a listing or object already written to a file, for
+when the listing should be kept. Either links against runtime, which may be the
+runtime's source or the object that runtime_object compiles it to once.
+
+cached_executable keeps built executables, and their listings, in a Cache
+keyed by the program and everything else that determines the binary.
+"""
+import functools
+import hashlib
+import pathlib
+import subprocess
+import tempfile
+
+from .cache import encode_program
+from .encoder import Encoder
+from .io import FLUSH_THRESHOLD, FileWriter, StreamWriter, Tee
+
+project_dir = pathlib.Path(__file__).parent.parent
+
+RUNTIME = project_dir / "startup.c"
+# files the runtime object is compiled from
+RUNTIME_SOURCES = (RUNTIME, project_dir / "startup.h")
+CFLAGS = ("-fomit-frame-pointer",)
+
+
+def gcc_command(inputs, output, flags=CFLAGS):
+    return ["gcc", *flags, *inputs, "-o", output]
+
+
+# the runtime as a library for compiler.jit, which supplies scheme_entry
+LIBRARY_FLAGS = ("-shared", "-fPIC", "-DINC_SHARED")
+
+
+def runtime_key(sources=RUNTIME_SOURCES, flags=CFLAGS, suffix=".o"):
+    key = hashlib.sha256(repr(flags).encode())
+    for source in sources:
+        key.update(b"\0")
+        key.update(pathlib.Path(source).read_bytes())
+    return f"{key.hexdigest()}{suffix}"
+
+
+def runtime_object(cache, sources=RUNTIME_SOURCES, flags=CFLAGS):
+    """
+    Return the path of the runtime compiled to an object, compiling it into
+    cache unless an object compiled from the same sources with the same
+    flags is already there. The first of sources is the one compiled.
+    """
+    return compile_runtime(cache, sources, flags, ("-c",), ".o")
+
+
+def runtime_library(cache, sources=RUNTIME_SOURCES, flags=CFLAGS):
+    """As runtime_object, for the runtime as a shared library."""
+    return compile_runtime(cache, sources, (*flags, *LIBRARY_FLAGS), (), ".so")
+
+
+def compile_runtime(cache, sources, flags, options, suffix):
+    key = runtime_key(sources, flags, suffix)
+    if (path := cache.locate(key)) is not None:
+        return path
+    with tempfile.TemporaryDirectory() as directory:
+        output = pathlib.Path(directory) / f"runtime{suffix}"
+        command = gcc_command([*options, sources[0]], output, flags)
+        subprocess.run(command, check=True)
+        cache.put(key, output.read_bytes(), mode=0o755)
+    return cache.path(key)
+
+
+def assemble(asm_file, binary, runtime=RUNTIME):
+    subprocess.run(gcc_command([runtime, asm_file], binary), check=True)
+
+
+def encode_executable(write_listing, binary, runtime=RUNTIME):
+    """
+    Build binary from the listing that write_listing(writer) emits to
+    writer, encoding it to an object and linking that with runtime.
+    """
+    encoder = Encoder()
+    write_listing(encoder)
+    obj = pathlib.Path(f"{binary}.o")
+    obj.write_bytes(encoder.object())
+    try:
+        assemble(obj, binary, runtime)
+    finally:
+        obj.unlink()
+
+
+class Assembler(StreamWriter):
+    """Link the lines written, with the runtime, into binary."""
+
+    def __init__(self, binary, runtime=RUNTIME, threshold=FLUSH_THRESHOLD):
+        super().__init__(threshold)
+        self.binary = binary
+        self.runtime = runtime
+        self.process = None
+
+    def __enter__(self):
+        # the runtime comes before -x, which applies to the inputs after it
+        command = gcc_command([self.runtime, "-x", "assembler", "-"], self.binary)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, text=True)
+        self.file = self.process.stdin
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # don't let gcc build a binary from part of the listing
+            self.process.kill()
+            self.close()
+            self.process.wait()
+            return
+        try:
+            self.flush()
+        except BrokenPipeError:
+            # gcc exited early; its status says why
+            pass
+        self.close()
+        if returncode := self.process.wait():
+            raise subprocess.CalledProcessError(returncode, self.process.args)
+
+    def close(self):
+        try:
+            self.file.close()
+        except BrokenPipeError:
+            pass
+
+
+@functools.cache
+def compiler_digest():
+    """A hash of the compiler's source, which stands in for its version."""
+    digest = hashlib.sha256()
+    for path in sorted(pathlib.Path(__file__).parent.glob("*.py")):
+        digest.update(path.name.encode() + b"\0" + path.read_bytes())
+    return digest.hexdigest()
+
+
+def executable_key(program, options, runtime=RUNTIME_SOURCES, flags=CFLAGS):
+    """
+    The key of the executable for program, in the input representation, as
+    emitted with the options that affect the listing and linked against
+    runtime.
+    """
+    key = hashlib.sha256(compiler_digest().encode())
+    key.update(repr(sorted(options.items())).encode())
+    key.update(runtime_key(runtime, flags).encode())
+    key.update(encode_program(program))
+    return key.hexdigest()
+
+
+def cached_executable(cache, key, write_listing, runtime=RUNTIME):
+    """
+    Return the path of the executable for key in cache. On a miss it is
+    built by write_listing(writer), which emits the listing to writer, and
+    stored along with the listing, whose key is key + ".s".
+    """
+    if (path := cache.locate(key)) is not None:
+        return path
+    with tempfile.TemporaryDirectory() as directory:
+        asm_file = pathlib.Path(directory) / "program.s"
+        binary = pathlib.Path(directory) / "program"
+        with FileWriter(asm_file) as writer:
+            encode_executable(
+                lambda encoder: write_listing(Tee(writer, encoder)), binary, runtime
+            )
+        cache.put(f"{key}.s", asm_file.read_bytes())
+        cache.put(key, binary.read_bytes(), mode=0o755)
+    return cache.path(key)
@@ -0,0 +1,167 @@
+"""
+On-disk caches keyed by content hash.
+
+A Cache is a directory of entries bounded in total size; the least recently
+used entries are evicted first. Entries are written to a temporary file and
+renamed into place, so concurrent compiles only ever see complete entries.
+"""
+import hashlib
+import marshal
+import os
+import pathlib
+import tempfile
+
+from . import Var
+from .reader import read_program
+
+DEFAULT_MAX_BYTES = 64 << 20
+
+# bump when the encoding or the reader's output changes
+PROGRAM_FORMAT = 1
+
+VAR = b"v"
+TUPLE = b"t"
+LIST = b"l"
+
+
+def default_cache_dir():
+    if directory := os.environ.get("INC_CACHE_DIR"):
+        return pathlib.Path(directory)
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "inc"
+
+
+class Cache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.directory / key
+
+    def get(self, key):
+        """Return the entry for key, or None on a miss."""
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process between the read and the utime
+            return None
+        return data
+
+    def locate(self, key):
+        """Return the path of the entry for key, or None on a miss."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data, mode=None):
+        """Store data for key, with permission bits mode if given."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            if mode is not None:
+                os.chmod(tmp, mode)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def discard(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def encode_program(program):
+    """
+    Encode a program in the input representation as marshal data. The
+    program is flattened in postfix order: leaves as themselves, a Var as its
+    name followed by VAR, and a list or tuple as its items followed by LIST or
+    TUPLE and the number of items.
+    """
+    ops = []
+    stack = [(program, False)]
+    while stack:
+        x, visited = stack.pop()
+        if isinstance(x, (list, tuple)):
+            if visited:
+                ops += (TUPLE if isinstance(x, tuple) else LIST, len(x))
+            else:
+                stack.append((x, True))
+                stack.extend((item, False) for item in reversed(x))
+        elif isinstance(x, Var):
+            ops += (x.name, VAR)
+        else:
+            ops.append(x)
+    return marshal.dumps(ops)
+
+
+def decode_program(data):
+    stack = []
+    ops = iter(marshal.loads(data))
+    for op in ops:
+        if op.__class__ is not bytes:
+            stack.append(op)
+        elif op == VAR:
+            stack.append(Var(stack.pop()))
+        else:
+            n = next(ops)
+            items = stack[len(stack) - n :]
+            del stack[len(stack) - n :]
+            stack.append(tuple(items) if op == TUPLE else items)
+    [program] = stack
+    return program
+
+
+def program_key(source_digest, symbols=None):
+    key = hashlib.sha256(f"{PROGRAM_FORMAT}:{source_digest}:".encode())
+    key.update(repr(sorted((symbols or {}).items())).encode())
+    return key.hexdigest()
+
+
+def load_program(cache, source_digest, open_source, symbols=None):
+    """
+    Read the program whose source text has the hex digest source_digest. On
+    a cache hit the program is decoded without reading the source; on a miss
+    it is read from the text stream returned by open_source() and cached.
+    """
+    key = program_key(source_digest, symbols)
+    if (data := cache.get(key)) is not None:
+        try:
+            return decode_program(data)
+        except (EOFError, IndexError, StopIteration, TypeError, ValueError):
+            cache.discard(key)
+    with open_source() as stream:
+        program = read_program(stream, symbols)
+    cache.put(key, encode_program(program))
+    return program
@@ -0,0 +1,229 @@
+"""
+Common subexpression elimination.
+
+Calls of pure primitives, which is every primitive but cons, are value
+numbered: two calls get the same number when they apply the same primitive
+to operands with the same numbers, constants being numbered by value and
+references by Binding. A call repeated within a region (a procedure body,
+a let body or an if arm) is bound once by a let at the start of the region,
+and its occurrences refer to the binding, which the emitters then keep in
+a register or stack slot like any other variable.
+
+A call belongs to the outermost region where all its operands are bound and
+where it is always evaluated, so calls under an if test are never hoisted
+out of an arm. Within a region the largest repeated calls are bound first,
+and a call only counts towards being bound where it is not already inside a
+bound call.
+"""
+from collections import defaultdict
+
+from .nodes import App, Binding, Const, If, Lambda, Let, Letrec, PrimCall, Ref
+from .values import Var
+from .walk import trampoline
+
+
+def cse_program(program):
+    bindings = []
+    for name, lam in program.bindings:
+        bindings.append((name, Lambda(lam.formals, eliminate_common(lam.body))))
+    return Letrec(tuple(bindings), eliminate_common(program.body))
+
+
+def eliminate_common(expr):
+    analysis = Analysis()
+    trampoline(analysis.analyze(expr))
+    chosen = analysis.choose()
+    if not chosen:
+        return expr
+    return trampoline(Rewrite(analysis, chosen).bind(0, expr))
+
+
+def is_pure_call(expr):
+    return isinstance(expr, PrimCall) and expr.op != "cons"
+
+
+class Regions:
+    """The path of regions enclosing the expression being walked."""
+
+    def __init__(self):
+        self.count = 0
+        self.path = [0]
+        # depths of the enclosing regions that an if arm or the root starts
+        self.barriers = [0]
+
+    @property
+    def depth(self):
+        return len(self.path) - 1
+
+    def enter(self, barrier):
+        self.count += 1
+        self.path.append(self.count)
+        if barrier:
+            self.barriers.append(self.depth)
+
+    def leave(self, barrier):
+        self.path.pop()
+        if barrier:
+            self.barriers.pop()
+
+
+class Analysis(Regions):
+    def __init__(self):
+        super().__init__()
+        # the region depth at which each let-bound Binding is bound
+        self.depths = {}
+        self.numbers = {}
+        # value numbers of pure calls, by id
+        self.values = {}
+        self.sizes = {}
+        # a call with each value number
+        self.calls = {}
+        # (region, value number, parent occurrence) for each pure call, where
+        # the parent is the index of the pure call it is an operand of
+        self.occurrences = []
+
+    def number(self, key):
+        return self.numbers.setdefault(key, len(self.numbers))
+
+    def analyze(self, expr):
+        """
+        Number expr and its operands. Returns (value number, depth, index),
+        where depth is the depth of the innermost region binding a variable
+        in expr and index that of expr in occurrences; all are None for an
+        expression that is not pure.
+        """
+        match expr:
+            case Const(value=value):
+                return self.number((type(value), value)), 0, None
+            case Ref(binding=binding):
+                return self.number(binding), self.depths.get(binding, 0), None
+            case PrimCall(args=args) | App(args=args):
+                operands = []
+                for arg in args:
+                    operands.append((yield self.analyze(arg)))
+                if not is_pure_call(expr) or any(vn is None for vn, *_ in operands):
+                    return None, None, None
+                vn = self.number((expr.op, *(vn for vn, _, _ in operands)))
+                depth = max((depth for _, depth, _ in operands), default=0)
+                self.sizes[vn] = 1 + sum(
+                    self.sizes.get(operand, 1) for operand, _, _ in operands
+                )
+                self.calls[vn] = expr
+                self.values[id(expr)] = vn
+                home = self.path[max(self.barriers[-1], depth)]
+                index = len(self.occurrences)
+                self.occurrences.append([home, vn, None])
+                for _, _, operand in operands:
+                    if operand is not None:
+                        self.occurrences[operand][2] = index
+                return vn, depth, index
+            case If():
+                yield self.analyze(expr.test)
+                for arm in (expr.consequent, expr.alternative):
+                    self.enter(barrier=True)
+                    yield self.analyze(arm)
+                    self.leave(barrier=True)
+            case Let():
+                for _, rhs in expr.bindings:
+                    yield self.analyze(rhs)
+                self.enter(barrier=False)
+                for lhs, _ in expr.bindings:
+                    self.depths[lhs] = self.depth
+                yield self.analyze(expr.body)
+                self.leave(barrier=False)
+        return None, None, None
+
+    def choose(self):
+        """
+        Return the value numbers to bind in each region, smallest first. The
+        largest calls are considered first, and an occurrence inside one that
+        is bound does not count.
+        """
+        by_key = defaultdict(list)
+        for index, (region, vn, _) in enumerate(self.occurrences):
+            by_key[region, vn].append(index)
+        bound = set()
+
+        def covered(index):
+            while (index := self.occurrences[index][2]) is not None:
+                if index in bound:
+                    return True
+            return False
+
+        chosen = defaultdict(list)
+        keys = [key for key, indices in by_key.items() if len(indices) > 1]
+        keys.sort(key=lambda key: self.sizes[key[1]], reverse=True)
+        for region, vn in keys:
+            indices = [i for i in by_key[region, vn] if not covered(i)]
+            if len(indices) > 1:
+                bound.update(indices)
+                chosen[region].append(vn)
+        for vns in chosen.values():
+            vns.reverse()
+        return chosen
+
+
+class Rewrite(Regions):
+    def __init__(self, analysis, chosen):
+        super().__init__()
+        self.analysis = analysis
+        self.chosen = chosen
+        # the Bindings of the value numbers bound by enclosing regions
+        self.available = {}
+
+    def rewrite(self, expr):
+        match expr:
+            case Const() | Ref():
+                return expr
+            case PrimCall() if (
+                binding := self.available.get(self.analysis.values.get(id(expr)))
+            ) is not None:
+                return Ref(binding)
+            case PrimCall():
+                return PrimCall(expr.op, (yield self.rewrite_args(expr.args)))
+            case App():
+                return App(expr.rator, (yield self.rewrite_args(expr.args)))
+            case If():
+                test = yield self.rewrite(expr.test)
+                arms = []
+                for arm in (expr.consequent, expr.alternative):
+                    arms.append((yield self.rewrite_region(arm, barrier=True)))
+                return If(test, *arms)
+            case Let():
+                bindings = []
+                for lhs, rhs in expr.bindings:
+                    bindings.append((lhs, (yield self.rewrite(rhs))))
+                body = yield self.rewrite_region(expr.body, barrier=False)
+                return Let(tuple(bindings), body)
+
+    def rewrite_args(self, args):
+        rewritten = []
+        for arg in args:
+            rewritten.append((yield self.rewrite(arg)))
+        return tuple(rewritten)
+
+    def rewrite_region(self, expr, barrier):
+        self.enter(barrier)
+        expr = yield self.bind(self.path[-1], expr)
+        self.leave(barrier)
+        return expr
+
+    def bind(self, region, expr):
+        """Rewrite expr, the body of region, binding its common calls."""
+        lets = []
+        shadowed = {}
+        for vn in self.chosen.get(region, ()):
+            call = self.analysis.calls[vn]
+            binding = Binding(Var(f"cse{vn}"))
+            lets.append((binding, (yield self.rewrite(call))))
+            shadowed[vn] = self.available.get(vn)
+            self.available[vn] = binding
+        body = yield self.rewrite(expr)
+        for vn, binding in shadowed.items():
+            if binding is None:
+                del self.available[vn]
+            else:
+                self.available[vn] = binding
+        for binding, rhs in reversed(lets):
+            body = Let(((binding, rhs),), body)
+        return body
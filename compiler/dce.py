@@ -0,0 +1,117 @@
+"""
+Dead code elimination.
+
+Removes let bindings that are never referenced and whose right-hand side
+has no effect, the arm of an if that a constant test never takes, and
+letrec procedures that cannot be reached from the program body. Calls may
+not return, and cons allocates, so a binding whose right-hand side contains
+either is kept.
+"""
+from collections import Counter
+
+from .inline import calls
+from .nodes import App, Const, If, Lambda, Let, Letrec, PrimCall, Ref, nodes
+from .walk import trampoline
+
+
+def is_pure(expr):
+    return not any(
+        isinstance(node, App) or isinstance(node, PrimCall) and node.op == "cons"
+        for node in nodes(expr)
+    )
+
+
+def eliminate_program(program):
+    # the number of live references to each Binding, decremented as code
+    # containing references is removed
+    references = Counter(
+        node.binding for node in nodes_of(program) if isinstance(node, Ref)
+    )
+    body = trampoline(eliminate(program.body, references))
+    procedures = {
+        name: Lambda(lam.formals, trampoline(eliminate(lam.body, references)))
+        for name, lam in program.bindings
+    }
+    reachable = set()
+    stack = list(calls(body))
+    while stack:
+        name = stack.pop()
+        if name in procedures and name not in reachable:
+            reachable.add(name)
+            stack.extend(calls(procedures[name].body))
+    bindings = tuple(
+        (name, lam) for name, lam in procedures.items() if name in reachable
+    )
+    return Letrec(bindings, body)
+
+
+def nodes_of(program):
+    for _, lam in program.bindings:
+        yield from nodes(lam.body)
+    yield from nodes(program.body)
+
+
+def forget(expr, references):
+    for node in nodes(expr):
+        if isinstance(node, Ref):
+            references[node.binding] -= 1
+
+
+def eliminate(expr, references):
+    return ELIMINATE[type(expr)](expr, references)
+
+
+def eliminate_leaf(expr, references):
+    return expr
+
+
+def eliminate_primcall(expr, references):
+    args = []
+    for arg in expr.args:
+        args.append((yield eliminate(arg, references)))
+    return PrimCall(expr.op, tuple(args))
+
+
+def eliminate_app(expr, references):
+    args = []
+    for arg in expr.args:
+        args.append((yield eliminate(arg, references)))
+    return App(expr.rator, tuple(args))
+
+
+def eliminate_if(expr, references):
+    if isinstance(expr.test, Const):
+        if expr.test.value is False:
+            taken, dead = expr.alternative, expr.consequent
+        else:
+            taken, dead = expr.consequent, expr.alternative
+        forget(dead, references)
+        return (yield eliminate(taken, references))
+    return If(
+        (yield eliminate(expr.test, references)),
+        (yield eliminate(expr.consequent, references)),
+        (yield eliminate(expr.alternative, references)),
+    )
+
+
+def eliminate_let(expr, references):
+    # the body first, so that references it drops are not counted against
+    # the bindings
+    body = yield eliminate(expr.body, references)
+    bindings = []
+    for lhs, rhs in expr.bindings:
+        if references[lhs] == 0 and is_pure(rhs):
+            forget(rhs, references)
+        else:
+            bindings.append((lhs, (yield eliminate(rhs, references))))
+    return Let(tuple(bindings), body) if bindings else body
+
+
+ELIMINATE = {
+    Const: eliminate_leaf,
+    Ref: eliminate_leaf,
+    PrimCall: eliminate_primcall,
+    If: eliminate_if,
+    Let: eliminate_let,
+    App: eliminate_app,
+}
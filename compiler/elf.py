@@ -0,0 +1,120 @@
+"""
+Relocatable ELF64 objects for x86-64.
+
+write_object writes an object holding code whose labels are already
+resolved, so it needs no relocations.
+"""
+import struct
+
+ELF_HEADER = struct.Struct("<16sHHIQQQIHHHHHH")
+SECTION_HEADER = struct.Struct("<IIQQQQIIQQ")
+SYMBOL = struct.Struct("<IBBHQQ")
+
+ELF_MAGIC = b"\x7fELF"
+# 64-bit, little endian, version 1, System V ABI
+ELF_IDENT = ELF_MAGIC + bytes([2, 1, 1, 0]) + bytes(8)
+ET_REL = 1
+EM_X86_64 = 62
+EV_CURRENT = 1
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+
+SHF_ALLOC = 2
+SHF_EXECINSTR = 4
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_FUNC = 2
+
+
+class Strings:
+    """A string table under construction."""
+
+    def __init__(self):
+        self.data = bytearray(1)
+        self.offsets = {"": 0}
+
+    def add(self, string):
+        if string not in self.offsets:
+            self.offsets[string] = len(self.data)
+            self.data += string.encode() + b"\0"
+        return self.offsets[string]
+
+
+def align(data, n):
+    data += bytes(-len(data) % n)
+
+
+def write_object(code, symbols, globals=(), functions=()):
+    """
+    Return an object whose .text holds code, defining symbols, a dict of
+    offsets in code, of which those in globals are global and those in
+    functions are functions.
+    """
+    strings = Strings()
+    entries = []
+    # local symbols come first
+    for name, offset in sorted(
+        symbols.items(), key=lambda symbol: (symbol[0] in globals, symbol[1])
+    ):
+        bind = STB_GLOBAL if name in globals else STB_LOCAL
+        kind = STT_FUNC if name in functions else STT_NOTYPE
+        entries.append((strings.add(name), bind << 4 | kind, 0, 1, offset, 0))
+    first_global = 1 + sum(1 for name in symbols if name not in globals)
+    symtab = bytes(SYMBOL.size) + b"".join(SYMBOL.pack(*e) for e in entries)
+
+    names = Strings()
+    data = bytearray(ELF_HEADER.size)
+    headers = [bytes(SECTION_HEADER.size)]
+
+    def section(name, kind, contents, flags=0, link=0, info=0, alignment=1, size=0):
+        align(data, alignment)
+        headers.append(
+            SECTION_HEADER.pack(
+                names.add(name),
+                kind,
+                flags,
+                0,
+                len(data),
+                len(contents),
+                link,
+                info,
+                alignment,
+                size,
+            )
+        )
+        data.extend(contents)
+
+    section(".text", SHT_PROGBITS, code, SHF_ALLOC | SHF_EXECINSTR)
+    section(".symtab", SHT_SYMTAB, symtab, 0, 3, first_global, 8, SYMBOL.size)
+    section(".strtab", SHT_STRTAB, strings.data)
+    # the stack need not be executable
+    section(".note.GNU-stack", SHT_PROGBITS, b"")
+    names.add(".shstrtab")
+    section(".shstrtab", SHT_STRTAB, names.data)
+    align(data, 8)
+    shoff = len(data)
+    data += b"".join(headers)
+    ELF_HEADER.pack_into(
+        data,
+        0,
+        ELF_IDENT,
+        ET_REL,
+        EM_X86_64,
+        EV_CURRENT,
+        0,
+        0,
+        shoff,
+        0,
+        ELF_HEADER.size,
+        0,
+        0,
+        SECTION_HEADER.size,
+        len(headers),
+        # .shstrtab is the last section
+        len(headers) - 1,
+    )
+    return bytes(data)
@@ -0,0 +1,368 @@
+"""
+Machine code for listings, without an assembler.
+
+Encoder is a Writer that encodes each line of a listing as it is written.
+It knows the small part of x86-64 that the emitters and the peephole rules
+produce: mov, lea, add, sub, and, or, cmp, imul, neg, not, the shifts,
+setcc, movzbq, jmp, jcc, call and ret, on registers, immediates and
+base + displacement (or base + scaled index) memory operands. Where there
+is a choice of encoding it makes the one gas makes, so both produce the
+same code.
+
+Jumps are encoded short and lengthened until every displacement fits,
+again as gas does, when the code is finished; calls are always near.
+
+    encoder = Encoder()
+    emit_program(program, encoder.write)
+    code, symbols = encoder.finish()
+"""
+import functools
+import re
+import struct
+from typing import NamedTuple
+
+from .elf import write_object
+
+REGISTERS = {
+    **{
+        name: (number, 64)
+        for number, name in enumerate(
+            ("rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi")
+            + tuple(f"r{n}" for n in range(8, 16))
+        )
+    },
+    **{name: (number, 8) for number, name in enumerate(("al", "cl", "dl", "bl"))},
+}
+
+CONDITIONS = {
+    **dict.fromkeys(("o",), 0),
+    **dict.fromkeys(("no",), 1),
+    **dict.fromkeys(("b", "c", "nae"), 2),
+    **dict.fromkeys(("ae", "nb", "nc"), 3),
+    **dict.fromkeys(("e", "z"), 4),
+    **dict.fromkeys(("ne", "nz"), 5),
+    **dict.fromkeys(("be", "na"), 6),
+    **dict.fromkeys(("a", "nbe"), 7),
+    **dict.fromkeys(("s",), 8),
+    **dict.fromkeys(("ns",), 9),
+    **dict.fromkeys(("p", "pe"), 10),
+    **dict.fromkeys(("np", "po"), 11),
+    **dict.fromkeys(("l", "nge"), 12),
+    **dict.fromkeys(("ge", "nl"), 13),
+    **dict.fromkeys(("le", "ng"), 14),
+    **dict.fromkeys(("g", "nle"), 15),
+}
+
+# the /digit opcode extensions of the arithmetic group
+ARITHMETIC = {"add": 0, "or": 1, "and": 4, "sub": 5, "cmp": 7}
+SHIFTS = {"sal": 4, "shl": 4, "shr": 5, "sar": 7}
+UNARY = {"not": 2, "neg": 3}
+
+SCALES = {1: 0, 2: 1, 4: 2, 8: 3}
+
+MEMORY = re.compile(r"(-?\w*)\(%(\w+)(?:,%(\w+),(\d))?\)")
+LABEL = re.compile(r"[A-Za-z_.][\w.]*")
+
+
+class Register(NamedTuple):
+    number: int
+    size: int
+
+
+class Memory(NamedTuple):
+    base: int
+    disp: int
+    index: int | None
+    scale: int
+
+
+class Branch(NamedTuple):
+    """A jmp, jcc (with condition code cc) or call to label."""
+
+    op: str
+    cc: int | None
+    label: str
+
+
+def split_operands(text):
+    if not text:
+        return []
+    operands = []
+    depth = start = 0
+    for i, c in enumerate(text):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and not depth:
+            operands.append(text[start:i].strip())
+            start = i + 1
+    operands.append(text[start:].strip())
+    return operands
+
+
+def parse_operand(text):
+    if text.startswith("$"):
+        return int(text[1:], 0)
+    elif text.startswith("%"):
+        return Register(*REGISTERS[text[1:]])
+    elif match := MEMORY.fullmatch(text):
+        disp, base, index, scale = match.groups()
+        return Memory(
+            REGISTERS[base][0],
+            int(disp, 0) if disp else 0,
+            REGISTERS[index][0] if index else None,
+            int(scale) if scale else 1,
+        )
+    elif LABEL.fullmatch(text):
+        return text
+    raise ValueError(f"unknown operand {text!r}")
+
+
+def fits8(n):
+    return -128 <= n < 128
+
+
+def fits32(n):
+    return -(1 << 31) <= n < 1 << 31
+
+
+def imm8(n):
+    return struct.pack("<B", n & 0xFF)
+
+
+def imm32(n, what="immediate"):
+    """Encode n, a signed 32-bit immediate or displacement."""
+    if not fits32(n):
+        raise ValueError(f"{what} {n} does not fit in 32 bits")
+    return struct.pack("<i", n)
+
+
+def modrm(reg, rm):
+    """
+    Return the REX bits and the ModRM, SIB and displacement bytes addressing
+    rm, a Register or Memory, with reg in the reg field.
+    """
+    rex = (reg >> 3) << 2
+    if isinstance(rm, Register):
+        return rex | rm.number >> 3, bytes([0xC0 | (reg & 7) << 3 | rm.number & 7])
+    base, disp, index, scale = rm
+    rex |= base >> 3
+    if disp == 0 and base & 7 != 5:
+        mod, displacement = 0, b""
+    elif fits8(disp):
+        mod, displacement = 1, imm8(disp)
+    else:
+        mod, displacement = 2, imm32(disp, "displacement")
+    if index is None and base & 7 != 4:
+        return rex, bytes([mod << 6 | (reg & 7) << 3 | base & 7]) + displacement
+    if index is None:
+        # an index of rsp means none
+        sib = SCALES[scale] << 6 | 4 << 3 | base & 7
+    else:
+        rex |= (index >> 3) << 1
+        sib = SCALES[scale] << 6 | (index & 7) << 3 | base & 7
+    return rex, bytes([mod << 6 | (reg & 7) << 3 | 4, sib]) + displacement
+
+
+def instruction(opcode, reg, rm, size=64, suffix=b""):
+    """Encode opcode with a ModRM operand, behind a REX prefix if needed."""
+    rex, operand = modrm(reg, rm)
+    if size == 64:
+        rex |= 8
+    prefix = bytes([0x40 | rex]) if rex else b""
+    return prefix + opcode + operand + suffix
+
+
+def operand_size(operands):
+    for operand in operands:
+        if isinstance(operand, Register):
+            return operand.size
+    return 64
+
+
+def strip_suffix(mnemonic, names):
+    if mnemonic not in names and mnemonic.endswith("q") and mnemonic[:-1] in names:
+        return mnemonic[:-1]
+    return mnemonic
+
+
+def encode_arithmetic(digit, source, dest, size):
+    if isinstance(source, int):
+        if size == 8:
+            if dest == (0, 8):
+                # the short form for %al
+                return bytes([digit << 3 | 4]) + imm8(source)
+            return instruction(b"\x80", digit, dest, size, imm8(source))
+        elif fits8(source):
+            return instruction(b"\x83", digit, dest, size, imm8(source))
+        elif dest == (0, 64):
+            # the short form for %rax
+            return b"\x48" + bytes([digit << 3 | 5]) + imm32(source)
+        return instruction(b"\x81", digit, dest, size, imm32(source))
+    wide = size != 8
+    if isinstance(source, Register):
+        return instruction(bytes([digit << 3 | wide]), source.number, dest, size)
+    return instruction(bytes([digit << 3 | 2 | wide]), dest.number, source, size)
+
+
+def encode_mov(source, dest):
+    if isinstance(source, int):
+        if isinstance(dest, Register) and not fits32(source):
+            prefix = 0x48 | dest.number >> 3
+            opcode = 0xB8 | dest.number & 7
+            return bytes([prefix, opcode]) + struct.pack("<Q", source & (1 << 64) - 1)
+        return instruction(b"\xc7", 0, dest, suffix=imm32(source))
+    elif isinstance(source, Register):
+        return instruction(b"\x89", source.number, dest)
+    return instruction(b"\x8b", dest.number, source)
+
+
+def encode_imul(source, dest):
+    if isinstance(source, int):
+        if fits8(source):
+            return instruction(b"\x6b", dest.number, dest, suffix=imm8(source))
+        return instruction(b"\x69", dest.number, dest, suffix=imm32(source))
+    return instruction(b"\x0f\xaf", dest.number, source)
+
+
+def encode_shift(digit, count, dest):
+    wide = dest.size != 8
+    if count == 1:
+        return instruction(bytes([0xD0 | wide]), digit, dest, dest.size)
+    return instruction(bytes([0xC0 | wide]), digit, dest, dest.size, imm8(count))
+
+
+@functools.lru_cache(maxsize=4096)
+def encode(text):
+    """
+    Encode the instruction text. Returns its bytes, or a Branch for a jump
+    or call, which is encoded once its label is placed.
+    """
+    mnemonic, _, rest = text.partition(" ")
+    operands = [parse_operand(operand) for operand in split_operands(rest)]
+    if mnemonic == "ret":
+        return b"\xc3"
+    elif mnemonic in ("jmp", "call"):
+        return Branch(mnemonic, None, operands[0])
+    elif mnemonic[0] == "j" and mnemonic[1:] in CONDITIONS:
+        return Branch("j", CONDITIONS[mnemonic[1:]], operands[0])
+    elif mnemonic.startswith("set") and mnemonic[3:] in CONDITIONS:
+        opcode = bytes([0x0F, 0x90 | CONDITIONS[mnemonic[3:]]])
+        return instruction(opcode, 0, operands[0], size=8)
+    elif mnemonic == "movzbq":
+        source, dest = operands
+        return instruction(b"\x0f\xb6", dest.number, source)
+    size = operand_size(operands)
+    if (op := strip_suffix(mnemonic, ARITHMETIC)) in ARITHMETIC:
+        return encode_arithmetic(ARITHMETIC[op], *operands, size)
+    elif (op := strip_suffix(mnemonic, SHIFTS)) in SHIFTS:
+        return encode_shift(SHIFTS[op], *operands)
+    elif (op := strip_suffix(mnemonic, UNARY)) in UNARY:
+        opcode = b"\xf6" if size == 8 else b"\xf7"
+        return instruction(opcode, UNARY[op], operands[0], size)
+    elif mnemonic == "movq":
+        return encode_mov(*operands)
+    elif mnemonic == "leaq":
+        source, dest = operands
+        return instruction(b"\x8d", dest.number, source)
+    elif mnemonic == "imulq":
+        return encode_imul(*operands)
+    raise ValueError(f"cannot encode {text!r}")
+
+
+class Encoder:
+    def __init__(self):
+        # encoded instructions, and Branches in order
+        self.pieces = []
+        # label -> index in pieces
+        self.labels = {}
+        self.globals = set()
+        self.functions = set()
+
+    def write(self, line):
+        text = line.text
+        if not text:
+            return
+        elif text.endswith(":"):
+            self.labels[text[:-1]] = len(self.pieces)
+        elif text.startswith("."):
+            self.directive(text)
+        else:
+            self.pieces.append(encode(text))
+
+    def directive(self, text):
+        name, _, rest = text.partition(" ")
+        if name == ".globl":
+            self.globals.add(rest)
+        elif name == ".type":
+            symbol, _, kind = rest.partition(",")
+            if kind.strip() == "@function":
+                self.functions.add(symbol)
+        elif name != ".text":
+            raise ValueError(f"unknown directive {text!r}")
+
+    def finish(self):
+        """Return the code and a dict of the offsets of its labels."""
+        # jumps (not calls) that need a 32-bit displacement
+        near = set()
+        while True:
+            offsets = self.layout(near)
+            grown = {
+                i
+                for i, piece in enumerate(self.pieces)
+                if isinstance(piece, Branch)
+                and piece.op != "call"
+                and i not in near
+                and not fits8(self.displacement(i, piece, offsets, near))
+            }
+            if not grown:
+                break
+            near |= grown
+        code = bytearray()
+        for i, piece in enumerate(self.pieces):
+            if isinstance(piece, Branch):
+                piece = self.encode_branch(i, piece, offsets, near)
+            code += piece
+        symbols = {label: offsets[i] for label, i in self.labels.items()}
+        return bytes(code), symbols
+
+    def object(self):
+        """Return the code as a relocatable ELF object."""
+        code, symbols = self.finish()
+        return write_object(code, symbols, self.globals, self.functions)
+
+    def layout(self, near):
+        offsets = [0]
+        for i, piece in enumerate(self.pieces):
+            offsets.append(offsets[-1] + self.size(i, piece, near))
+        return offsets
+
+    @staticmethod
+    def size(i, piece, near):
+        if not isinstance(piece, Branch):
+            return len(piece)
+        elif piece.op == "call" or piece.op == "jmp" and i in near:
+            return 5
+        elif i in near:
+            return 6
+        return 2
+
+    def displacement(self, i, piece, offsets, near):
+        try:
+            target = offsets[self.labels[piece.label]]
+        except KeyError:
+            raise ValueError(f"undefined label {piece.label!r}") from None
+        return target - (offsets[i] + self.size(i, piece, near))
+
+    def encode_branch(self, i, piece, offsets, near):
+        displacement = self.displacement(i, piece, offsets, near)
+        if piece.op == "call":
+            return b"\xe8" + imm32(displacement, "displacement")
+        elif piece.op == "jmp":
+            if i in near:
+                return b"\xe9" + imm32(displacement, "displacement")
+            return b"\xeb" + imm8(displacement)
+        elif i in near:
+            return bytes([0x0F, 0x80 | piece.cc]) + imm32(displacement, "displacement")
+        return bytes([0x70 | piece.cc]) + imm8(displacement)
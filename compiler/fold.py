@@ -0,0 +1,168 @@
+"""
+Constant folding.
+
+Primitive calls whose operands are all immediates are evaluated at compile
+time, following the machine semantics of the emitted code: fixnum arithmetic
+wraps within FXLOWER..FXUPPER, and comparisons compare the tagged
+representations. Constants bound by let are substituted into the body, and
+ifs with a constant test are replaced by the arm that would be taken.
+
+Operands of the wrong type are left for the runtime, as is anything whose
+result is not an immediate.
+"""
+from .nodes import App, Const, If, Lambda, Let, Letrec, PrimCall, Ref
+from .values import (
+    CHARS,
+    FIXNUM_BITS,
+    FXLOWER,
+    immediate_rep,
+    is_bool,
+    is_char,
+    is_fixnum,
+    is_null,
+)
+from .walk import trampoline
+
+FOLDERS = {}
+
+
+def folder(*names):
+    def decorator(f):
+        FOLDERS.update({name: f for name in names})
+        return f
+
+    return decorator
+
+
+def wrap(n):
+    """Wrap n into the fixnum range, as the tagged machine arithmetic does."""
+    return (n - FXLOWER) % (1 << FIXNUM_BITS) + FXLOWER
+
+
+def fixnums(f):
+    def folder(*args):
+        if all(is_fixnum(arg) for arg in args):
+            return f(*args)
+
+    return folder
+
+
+folder("fxadd1")(fixnums(lambda x: wrap(x + 1)))
+folder("fxsub1")(fixnums(lambda x: wrap(x - 1)))
+folder("fx+")(fixnums(lambda x, y: wrap(x + y)))
+folder("fx-")(fixnums(lambda x, y: wrap(x - y)))
+folder("fx*")(fixnums(lambda x, y: wrap(x * y)))
+folder("fxlogand")(fixnums(lambda x, y: x & y))
+folder("fxlogor")(fixnums(lambda x, y: x | y))
+folder("fxlognot")(fixnums(lambda x: ~x))
+folder("fxzero?")(lambda x: is_fixnum(x) and x == 0)
+folder("fixnum?")(is_fixnum)
+folder("boolean?")(is_bool)
+folder("char?")(is_char)
+folder("null?")(is_null)
+folder("pair?")(lambda x: False)
+folder("not")(lambda x: x is False)
+
+
+@folder("fixnum->char")
+def fold_fixnum2char(x):
+    if is_fixnum(x) and 0 <= x < 0x110000 and chr(x) in CHARS:
+        return chr(x)
+
+
+@folder("char->fixnum")
+def fold_char2fixnum(x):
+    if is_char(x):
+        return ord(x)
+
+
+def comparison(compare):
+    return lambda x, y: compare(immediate_rep(x), immediate_rep(y))
+
+
+folder("fx=", "char=")(comparison(lambda x, y: x == y))
+folder("fx<", "char<")(comparison(lambda x, y: x < y))
+folder("fx<=", "char<=")(comparison(lambda x, y: x <= y))
+folder("fx>", "char>")(comparison(lambda x, y: x > y))
+folder("fx>=", "char>=")(comparison(lambda x, y: x >= y))
+
+
+def fold_program(program):
+    consts = {}
+    bindings = []
+    for lvar, lam in program.bindings:
+        body = trampoline(fold(lam.body, consts))
+        bindings.append((lvar, Lambda(lam.formals, body)))
+    return Letrec(tuple(bindings), trampoline(fold(program.body, consts)))
+
+
+def fold(expr, consts):
+    """
+    Fold expr. consts maps the Bindings of let-bound constants to their
+    values. Bindings are unique, so one dict serves every scope.
+    """
+    return FOLD_EXPR[type(expr)](expr, consts)
+
+
+def fold_const(expr, consts):
+    return expr
+
+
+def fold_ref(expr, consts):
+    return consts.get(expr.binding, expr)
+
+
+def fold_args(args, consts):
+    folded = []
+    for arg in args:
+        folded.append((yield fold(arg, consts)))
+    return tuple(folded)
+
+
+def fold_primcall(expr, consts):
+    args = yield fold_args(expr.args, consts)
+    if (f := FOLDERS.get(expr.op)) is not None and all(
+        isinstance(arg, Const) for arg in args
+    ):
+        value = f(*(arg.value for arg in args))
+        if value is not None:
+            return Const(value)
+    return PrimCall(expr.op, args)
+
+
+def fold_if(expr, consts):
+    test = yield fold(expr.test, consts)
+    if isinstance(test, Const):
+        arm = expr.alternative if test.value is False else expr.consequent
+        return (yield fold(arm, consts))
+    return If(
+        test,
+        (yield fold(expr.consequent, consts)),
+        (yield fold(expr.alternative, consts)),
+    )
+
+
+def fold_let(expr, consts):
+    bindings = []
+    for lhs, rhs in expr.bindings:
+        rhs = yield fold(rhs, consts)
+        if isinstance(rhs, Const):
+            consts[lhs] = rhs
+        else:
+            bindings.append((lhs, rhs))
+    body = yield fold(expr.body, consts)
+    return Let(tuple(bindings), body) if bindings else body
+
+
+def fold_app(expr, consts):
+    return App(expr.rator, (yield fold_args(expr.args, consts)))
+
+
+FOLD_EXPR = {
+    Const: fold_const,
+    Ref: fold_ref,
+    PrimCall: fold_primcall,
+    If: fold_if,
+    Let: fold_let,
+    App: fold_app,
+}
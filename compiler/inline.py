@@ -0,0 +1,158 @@
+"""
+Inlining of small letrec procedures.
+
+A call to a procedure that cannot reach itself through the calls in its body
+is replaced by a copy of the body, in a let that binds fresh copies of the
+formals to the args, so each arg is still evaluated exactly once. Procedures
+are expanded callees first, and only those whose expanded body is at most
+the threshold in size are inlined, which bounds the growth of every call.
+The procedures stay bound in the letrec.
+"""
+from .nodes import (
+    App,
+    Binding,
+    Const,
+    If,
+    Lambda,
+    Let,
+    Letrec,
+    PrimCall,
+    Ref,
+    nodes,
+)
+from .walk import trampoline
+
+INLINE_THRESHOLD = 16
+
+
+def size(expr):
+    return sum(1 for _ in nodes(expr))
+
+
+def calls(expr):
+    return {node.rator for node in nodes(expr) if isinstance(node, App)}
+
+
+def callees_first(graph):
+    """Order the names in graph so that callees precede their callers."""
+    order = []
+    visited = set()
+    for root in graph:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(graph[root]))]
+        while stack:
+            name, callees = stack[-1]
+            for callee in callees:
+                if callee in graph and callee not in visited:
+                    visited.add(callee)
+                    stack.append((callee, iter(graph[callee])))
+                    break
+            else:
+                stack.pop()
+                order.append(name)
+    return order
+
+
+def is_recursive(name, graph):
+    stack = list(graph[name])
+    seen = set()
+    while stack:
+        callee = stack.pop()
+        if callee == name:
+            return True
+        elif callee in graph and callee not in seen:
+            seen.add(callee)
+            stack.extend(graph[callee])
+    return False
+
+
+def inline_program(program, threshold=INLINE_THRESHOLD):
+    procedures = dict(program.bindings)
+    graph = {name: calls(lam.body) for name, lam in program.bindings}
+    expanded = {}
+    for name in callees_first(graph):
+        if is_recursive(name, graph):
+            continue
+        lam = procedures[name]
+        body = trampoline(inline(lam.body, expanded, None))
+        if size(body) <= threshold:
+            expanded[name] = Lambda(lam.formals, body)
+    if not expanded:
+        return program
+    bindings = tuple(
+        (name, Lambda(lam.formals, trampoline(inline(lam.body, expanded, None))))
+        for name, lam in program.bindings
+    )
+    return Letrec(bindings, trampoline(inline(program.body, expanded, None)))
+
+
+def inline(expr, expanded, renames):
+    """
+    Inline calls in expr to the procedures in expanded. renames is None
+    for an original body, or maps each Binding of a body being copied to its
+    copy.
+    """
+    return INLINE[type(expr)](expr, expanded, renames)
+
+
+def inline_const(expr, expanded, renames):
+    return expr
+
+
+def inline_ref(expr, expanded, renames):
+    if renames is None:
+        return expr
+    return Ref(renames[expr.binding])
+
+
+def inline_args(args, expanded, renames):
+    inlined = []
+    for arg in args:
+        inlined.append((yield inline(arg, expanded, renames)))
+    return tuple(inlined)
+
+
+def inline_primcall(expr, expanded, renames):
+    return PrimCall(expr.op, (yield inline_args(expr.args, expanded, renames)))
+
+
+def inline_if(expr, expanded, renames):
+    return If(
+        (yield inline(expr.test, expanded, renames)),
+        (yield inline(expr.consequent, expanded, renames)),
+        (yield inline(expr.alternative, expanded, renames)),
+    )
+
+
+def inline_let(expr, expanded, renames):
+    bindings = []
+    for lhs, rhs in expr.bindings:
+        rhs = yield inline(rhs, expanded, renames)
+        bindings.append((lhs if renames is None else Binding(lhs.var), rhs))
+    if renames is not None:
+        renames.update(
+            (lhs, copy) for (lhs, _), (copy, _) in zip(expr.bindings, bindings)
+        )
+    return Let(tuple(bindings), (yield inline(expr.body, expanded, renames)))
+
+
+def inline_app(expr, expanded, renames):
+    args = yield inline_args(expr.args, expanded, renames)
+    lam = expanded.get(expr.rator)
+    if lam is None or len(lam.formals) != len(args):
+        return App(expr.rator, args)
+    formals = tuple(Binding(formal.var) for formal in lam.formals)
+    body = yield inline(lam.body, {}, dict(zip(lam.formals, formals)))
+    return Let(tuple(zip(formals, args)), body)
+
+
+INLINE = {
+    Const: inline_const,
+    Ref: inline_ref,
+    PrimCall: inline_primcall,
+    If: inline_if,
+    Let: inline_let,
+    App: inline_app,
+}
@@ -1,31 +1,52 @@
 import sys
+from array import array
 
+INDENT = 4 * " "
+# lines a StreamWriter holds before writing them out
+FLUSH_THRESHOLD = 4096
 
-class Line:
-    INDENT = 4 * " "
 
-    def __init__(self, text="", comment="", indents=0):
-        self.text = text
-        self.comment = comment
-        self.indents = indents
+def render(text, comment, indents):
+    if comment:
+        if text:
+            out = f"{text}  # {comment}\n"
+        else:
+            out = f"# {comment}\n"
+    else:
+        out = f"{text}\n"
+    return f"{indents * INDENT}{out}"
+
+
+class Line(tuple):
+    """
+    A line of the listing: (text, comment, indents). Lines are tuples, so
+    one costs a single allocation and no instance dict.
+    """
+
+    __slots__ = ()
+    INDENT = INDENT
+
+    def __new__(cls, text="", comment="", indents=0):
+        return tuple.__new__(cls, (text, comment, indents))
+
+    @property
+    def text(self):
+        return self[0]
+
+    @property
+    def comment(self):
+        return self[1]
+
+    @property
+    def indents(self):
+        return self[2]
 
     def __str__(self):
-        if self.comment:
-            if self.text:
-                out = f"{self.text}  # {self.comment}\n"
-            else:
-                out = f"# {self.comment}\n"
-        else:
-            out = f"{self.text}\n"
-        return f"{self.indents * self.INDENT}{out}"
+        return render(*self)
 
     def __rshift__(self, other):
         if isinstance(other, int):
-            return self.__class__(
-                self.text,
-                comment=self.comment,
-                indents=self.indents + other,
-            )
+            return tuple.__new__(Line, (self[0], self[1], self[2] + other))
         else:
             raise TypeError(
                 f"__rshift__ not supported between {type(self)} and {type(other)}"
@@ -35,24 +56,95 @@ class Line:
         return self >> other
 
     def __floordiv__(self, other):
-        return self.__class__(
-            text=self.text, comment=other, indents=self.indents
-        )
+        return tuple.__new__(Line, (self[0], other, self[2]))
+
+
+class Buffer:
+    """
+    Lines stored field by field. Texts and comments are interned, since most
+    instructions and comments recur many times in a listing, and indents are
+    kept in a byte array.
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.texts = []
+        self.comments = []
+        self.indents = array("B")
+
+    def intern(self, string):
+        return self.strings.setdefault(string, string)
+
+    def write(self, line: Line):
+        text, comment, indents = line
+        self.texts.append(self.intern(text))
+        self.comments.append(self.intern(comment) if comment else "")
+        self.indents.append(indents)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        for fields in zip(self.texts, self.comments, self.indents):
+            yield Line(*fields)
+
+    def render(self):
+        """Yield the text of each line, as str(line) would."""
+        for fields in zip(self.texts, self.comments, self.indents):
+            yield render(*fields)
+
+    def clear(self):
+        self.strings.clear()
+        self.texts.clear()
+        self.comments.clear()
+        del self.indents[:]
 
 
 class Writer:
     def __init__(self):
-        self.lines = []
+        self.lines = Buffer()
 
     def write(self, line: Line):
-        self.lines.append(line)
+        self.lines.write(line)
 
 
-class StdoutWriter(Writer):
+class Tee:
+    """Write each line to every one of writers."""
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def write(self, line: Line):
+        for writer in self.writers:
+            writer.write(line)
+
+
+class StreamWriter(Writer):
+    """
+    Write lines to self.file in chunks of threshold lines, so that at most
+    that many are held at once. With threshold None every line is held
+    until flush.
+    """
+
+    def __init__(self, threshold=FLUSH_THRESHOLD):
+        super().__init__()
+        self.threshold = threshold
+        self.file = None
+
+    def write(self, line: Line):
+        self.lines.write(line)
+        if self.threshold is not None and len(self.lines) >= self.threshold:
+            self.drain()
+
+    def drain(self):
+        if not self.lines:
+            return
+        self.file.writelines(self.lines.render())
+        self.lines.clear()
+
     def flush(self):
-        for line in self.lines:
-            sys.stdout.write(str(line))
-        sys.stdout.flush()
+        self.drain()
+        self.file.flush()
 
     def __enter__(self):
         return self
@@ -61,21 +153,23 @@ class StdoutWriter(Writer):
         self.flush()
 
 
-class FileWriter(Writer):
-    def __init__(self, filename):
-        super().__init__()
-        self.filename = filename
-        self.file = None
+class StdoutWriter(StreamWriter):
+    def __init__(self, threshold=FLUSH_THRESHOLD):
+        super().__init__(threshold)
+        self.file = sys.stdout
 
-    def flush(self):
-        for line in self.lines:
-            self.file.write(str(line))
-        self.file.flush()
+
+class FileWriter(StreamWriter):
+    def __init__(self, filename, threshold=FLUSH_THRESHOLD):
+        super().__init__(threshold)
+        self.filename = filename
 
     def __enter__(self):
         self.file = open(self.filename, "w")
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.flush()
-        self.file.close()
+        try:
+            super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            self.file.close()
@@ -0,0 +1,91 @@
+"""
+In-process execution.
+
+Jit encodes a program's listing to machine code (see compiler.encoder),
+copies the code into an executable mmap region and calls it through
+ctypes, without spawning an assembler or running a new process. The
+runtime is loaded once as a shared library (see build.runtime_library);
+its execute allocates the stack and heap and prints the result, as an
+executable's main does, to a string.
+
+    jit = Jit(cache)
+    jit.run(("fx+", 1, 2))  # "3\n"
+
+The code runs in the Python process, so a program that faults takes the
+process down with it.
+"""
+import ctypes
+import mmap
+
+from . import emit_program
+from .build import runtime_library
+from .encoder import Encoder
+from .peephole import Peephole
+
+# ptr scheme_entry(Context *, char *stack_base, char *heap)
+ENTRY = ctypes.CFUNCTYPE(
+    ctypes.c_uint64, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p
+)
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.mprotect.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+
+
+class Code:
+    """Machine code in an executable region, entered at entry."""
+
+    def __init__(self, code, entry):
+        size = max(len(code), 1)
+        self.region = mmap.mmap(-1, size, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        self.region.write(code)
+        address = ctypes.addressof(ctypes.c_char.from_buffer(self.region))
+        if libc.mprotect(address, size, mmap.PROT_READ | mmap.PROT_EXEC):
+            self.region.close()
+            raise OSError(ctypes.get_errno(), "mprotect() failed")
+        self.entry = ENTRY(address + entry)
+
+    def close(self):
+        self.entry = None
+        self.region.close()
+
+
+class Jit:
+    def __init__(self, cache, optimize=True):
+        self.optimize = optimize
+        self.runtime = ctypes.CDLL(str(runtime_library(cache)))
+        self.runtime.execute_to_string.argtypes = (ENTRY,)
+        # a void pointer, so that the string can be freed
+        self.runtime.execute_to_string.restype = ctypes.c_void_p
+        self.runtime.free_output.argtypes = (ctypes.c_void_p,)
+
+    def compile(self, program):
+        def write_listing(encoder):
+            if self.optimize:
+                with Peephole(encoder.write) as peephole:
+                    emit_program(program, peephole.write, comments=False)
+            else:
+                emit_program(program, encoder.write, optimize=False, comments=False)
+
+        return self.encode(write_listing)
+
+    def encode(self, write_listing):
+        """Return the Code for the listing that write_listing(writer) emits."""
+        encoder = Encoder()
+        write_listing(encoder)
+        code, symbols = encoder.finish()
+        return Code(code, symbols["scheme_entry"])
+
+    def execute(self, code):
+        """Run code and return what it printed."""
+        output = self.runtime.execute_to_string(code.entry)
+        try:
+            return ctypes.string_at(output).decode()
+        finally:
+            self.runtime.free_output(output)
+
+    def run(self, program):
+        code = self.compile(program)
+        try:
+            return self.execute(code)
+        finally:
+            code.close()
@@ -0,0 +1,147 @@
+"""
+Loop conversion of self tail calls.
+
+The body of a procedure that calls itself in tail position becomes a Loop,
+and each such call a Recur, which moves the args straight into the formals'
+locations and jumps back to the top of the loop instead of re-entering the
+procedure. Args that are the formal in the same position are not moved.
+
+Expressions in the loop that do not depend on the formals the Recurs change
+are evaluated once, before the loop. Only primitives that cannot fault are
+hoisted, since a hoisted expression may have been under an if that would
+not have taken its arm; procedures are closed, so after constant folding
+these are mostly expressions over the unchanged formals, or let bindings of
+expressions that could not be folded.
+"""
+from .nodes import (
+    App,
+    Binding,
+    Const,
+    If,
+    Lambda,
+    Let,
+    Letrec,
+    Loop,
+    PrimCall,
+    Recur,
+    Ref,
+)
+from .values import Var
+from .walk import trampoline
+
+# primitives that may fault on operands of the wrong type, or allocate
+UNHOISTABLE = {"car", "cdr", "cons"}
+
+
+def loop_program(program):
+    bindings = []
+    for name, lam in program.bindings:
+        target = Binding(Var(str(name)))
+        recurs = []
+        body = trampoline(convert(lam.body, name, target, lam.formals, recurs))
+        if recurs:
+            body = hoist_invariants(target, lam.formals, body, recurs)
+            lam = Lambda(lam.formals, body)
+        bindings.append((name, lam))
+    return Letrec(tuple(bindings), program.body)
+
+
+def convert(expr, name, target, formals, recurs):
+    """Replace the calls to name in tail position in expr with Recurs."""
+    match expr:
+        case App(rator=rator, args=args) if (
+            rator == name and len(args) == len(formals)
+        ):
+            recur = Recur(target, formals, args)
+            recurs.append(recur)
+            return recur
+        case If():
+            return If(
+                expr.test,
+                (yield convert(expr.consequent, name, target, formals, recurs)),
+                (yield convert(expr.alternative, name, target, formals, recurs)),
+            )
+        case Let():
+            body = yield convert(expr.body, name, target, formals, recurs)
+            return Let(expr.bindings, body)
+    return expr
+
+
+def hoist_invariants(target, formals, body, recurs):
+    # formals that every Recur passes back unchanged are invariant
+    variant = {
+        formal
+        for i, formal in enumerate(formals)
+        if not all(unchanged(recur.args[i], formal) for recur in recurs)
+    }
+    hoisted = []
+    body, _ = trampoline(hoist(body, variant, hoisted))
+    body = Loop(target, formals, body)
+    for lhs, rhs in reversed(hoisted):
+        body = Let(((lhs, rhs),), body)
+    return body
+
+
+def unchanged(arg, formal):
+    return isinstance(arg, Ref) and arg.binding is formal
+
+
+def hoist_operand(expr, invariant, hoisted):
+    """Return expr, or a reference to it if it is worth hoisting."""
+    if invariant and isinstance(expr, PrimCall):
+        binding = Binding(Var(f"invariant{len(hoisted)}"))
+        hoisted.append((binding, expr))
+        return Ref(binding)
+    return expr
+
+
+def hoist_operands(operands, hoisted):
+    return tuple(
+        hoist_operand(expr, invariant, hoisted) for expr, invariant in operands
+    )
+
+
+def hoist(expr, variant, hoisted):
+    """
+    Move the largest invariant expressions in expr to hoisted, a list of
+    (Binding, expression) pairs. variant is the set of Bindings whose values
+    may change between iterations. Returns (expression, invariant).
+    """
+    match expr:
+        case Const():
+            return expr, True
+        case Ref(binding=binding):
+            return expr, binding not in variant
+        case PrimCall(op=op, args=args):
+            operands = []
+            for arg in args:
+                operands.append((yield hoist(arg, variant, hoisted)))
+            if op not in UNHOISTABLE and all(inv for _, inv in operands):
+                return PrimCall(op, tuple(arg for arg, _ in operands)), True
+            return PrimCall(op, hoist_operands(operands, hoisted)), False
+        case App() | Recur():
+            operands = []
+            for arg in expr.args:
+                operands.append((yield hoist(arg, variant, hoisted)))
+            args = hoist_operands(operands, hoisted)
+            if isinstance(expr, App):
+                return App(expr.rator, args), False
+            return Recur(expr.target, expr.formals, args), False
+        case If():
+            operands = []
+            for arg in (expr.test, expr.consequent, expr.alternative):
+                operands.append((yield hoist(arg, variant, hoisted)))
+            return If(*hoist_operands(operands, hoisted)), False
+        case Let():
+            bindings = []
+            for lhs, rhs in expr.bindings:
+                rhs, invariant = yield hoist(rhs, variant, hoisted)
+                if invariant:
+                    hoisted.append((lhs, rhs))
+                else:
+                    variant.add(lhs)
+                    bindings.append((lhs, rhs))
+            body, invariant = yield hoist(expr.body, variant, hoisted)
+            if not bindings:
+                return body, invariant
+            return Let(tuple(bindings), hoist_operand(body, invariant, hoisted)), False
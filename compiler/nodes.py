@@ -0,0 +1,186 @@
+"""
+Typed AST for the input language.
+
+Programs are parsed once into these nodes (see compiler.parse) so the
+emitters can dispatch on the node type instead of re-matching the structure
+of every expression.
+"""
+
+
+class Node:
+    __slots__ = ()
+
+    def __repr__(self):
+        fields = ", ".join(repr(getattr(self, name)) for name in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+
+class Binding:
+    """
+    A variable binding site. The parser resolves every Ref to the Binding it
+    refers to, so shadowed variables with the same name never alias.
+    """
+
+    __slots__ = ("var",)
+
+    def __init__(self, var):
+        self.var = var
+
+    @property
+    def name(self):
+        return self.var.name
+
+    def __repr__(self):
+        return f"Binding({self.var.name!r})"
+
+
+class Const(Node):
+    """An immediate: fixnum, boolean, char or null."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Ref(Node):
+    __slots__ = ("binding",)
+
+    def __init__(self, binding):
+        self.binding = binding
+
+
+class PrimCall(Node):
+    __slots__ = ("op", "args")
+
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+
+
+class If(Node):
+    __slots__ = ("test", "consequent", "alternative")
+
+    def __init__(self, test, consequent, alternative):
+        self.test = test
+        self.consequent = consequent
+        self.alternative = alternative
+
+
+class Let(Node):
+    """
+    Parallel let. bindings is a tuple of (Binding, Node) pairs; let* is
+    parsed into nested single-binding Lets.
+    """
+
+    __slots__ = ("bindings", "body")
+
+    def __init__(self, bindings, body):
+        self.bindings = bindings
+        self.body = body
+
+
+class App(Node):
+    """Application of a letrec-bound procedure, named by rator."""
+
+    __slots__ = ("rator", "args")
+
+    def __init__(self, rator, args):
+        self.rator = rator
+        self.args = args
+
+
+class Lambda(Node):
+    """formals is a tuple of Bindings."""
+
+    __slots__ = ("formals", "body")
+
+    def __init__(self, formals, body):
+        self.formals = formals
+        self.body = body
+
+
+class Loop(Node):
+    """
+    The body of a procedure that calls itself in tail position, compiled as
+    a loop. target is a Binding naming the top of the loop, and each Recur
+    in body with the same target starts the next iteration.
+    """
+
+    __slots__ = ("target", "formals", "body")
+
+    def __init__(self, target, formals, body):
+        self.target = target
+        self.formals = formals
+        self.body = body
+
+
+class Recur(Node):
+    """A self tail call: rebind formals to args and jump to target."""
+
+    __slots__ = ("target", "formals", "args")
+
+    def __init__(self, target, formals, args):
+        self.target = target
+        self.formals = formals
+        self.args = args
+
+
+class Letrec(Node):
+    """
+    Top-level letrec. bindings is a tuple of (name, Lambda) pairs. Programs
+    without a letrec are parsed as a Letrec with no bindings.
+    """
+
+    __slots__ = ("bindings", "body")
+
+    def __init__(self, bindings, body):
+        self.bindings = bindings
+        self.body = body
+
+
+def same(a, b):
+    """
+    Structural equality of expressions. Bindings compare by identity, and
+    constants by type as well as value, so True and 1 differ.
+    """
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if type(a) is not type(b):
+            return False
+        elif isinstance(a, Node):
+            stack.extend((getattr(a, name), getattr(b, name)) for name in a.__slots__)
+        elif isinstance(a, tuple):
+            if len(a) != len(b):
+                return False
+            stack.extend(zip(a, b))
+        elif isinstance(a, Binding):
+            if a is not b:
+                return False
+        elif a != b:
+            return False
+    return True
+
+
+def children(expr):
+    """The immediate subexpressions of expr, in evaluation order."""
+    match expr:
+        case PrimCall(args=args) | App(args=args) | Recur(args=args):
+            return args
+        case If():
+            return (expr.test, expr.consequent, expr.alternative)
+        case Let():
+            return (*(rhs for _, rhs in expr.bindings), expr.body)
+        case Lambda(body=body) | Loop(body=body):
+            return (body,)
+    return ()
+
+
+def nodes(expr):
+    """Yield expr and every expression within it."""
+    stack = [expr]
+    while stack:
+        expr = stack.pop()
+        yield expr
+        stack.extend(reversed(children(expr)))
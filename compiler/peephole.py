@@ -0,0 +1,168 @@
+"""
+Peephole optimization of the emitted Line stream.
+
+Peephole sits between emit_program and a Writer. It keeps a sliding window
+of the most recent instructions and, after each one, tries the rewrite
+rules against the instructions at the end of the window. Comment-only lines
+are not matched but held with the instruction before them, so the window
+is bounded by its instruction count however many comments there are.
+Labels only match rules that ask for them, so no other rewrite spans a
+jump target.
+
+    with FileWriter(path) as writer, Peephole(writer.write) as peephole:
+        emit_program(program, peephole.write)
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+from .io import Line
+
+WINDOW = 8
+
+
+@dataclass
+class Rule:
+    """
+    patterns match consecutive instructions, and may refer back to groups
+    matched by earlier patterns. rewrite receives the match and returns the
+    replacement: new instruction texts, or indices of matched lines to keep.
+    """
+
+    patterns: list
+    rewrite: object
+
+    def __post_init__(self):
+        self.regex = re.compile("\n".join(f"(?:{p})" for p in self.patterns))
+
+
+def keep(*indices):
+    return lambda match: list(indices)
+
+
+def fold_offset(match):
+    op, imm, reg, offset = match.groups()
+    offset = int(offset) + (int(imm) if op == "add" else -int(imm))
+    return [f"movq {offset}(%{reg}), %{reg}"]
+
+
+def combine_adjustments(match):
+    op1, imm1, op2, imm2 = match.groups()
+    offset = (int(imm1) if op1 == "add" else -int(imm1)) + (
+        int(imm2) if op2 == "add" else -int(imm2)
+    )
+    if offset > 0:
+        return [f"add ${offset}, %rsp"]
+    elif offset < 0:
+        return [f"sub ${-offset}, %rsp"]
+    return []
+
+
+def store_cdr_first(match):
+    cdr_offset = match.group(4)
+    return [f"movq %rax, {cdr_offset}(%rbp)", 1, 2]
+
+
+RULES = {
+    # a value stored to a stack slot is still in the register
+    "store-load": Rule(
+        [r"movq %(\w+), (-?\d+)\(%rsp\)", r"movq \2\(%rsp\), %\1"], keep(0)
+    ),
+    # likewise for a value copied to another register
+    "copy-back": Rule([r"movq %(\w+), %(\w+)", r"movq %\2, %\1"], keep(0)),
+    # car and cdr untag the pointer before loading through it
+    "fold-offset": Rule(
+        [r"(add|sub)q \$(\d+), %(\w+)", r"movq (-?\d+)\(%\3\), %\3"],
+        fold_offset,
+    ),
+    "stack-adjust": Rule(
+        [r"(add|sub) \$(\d+), %rsp", r"(add|sub) \$(\d+), %rsp"],
+        combine_adjustments,
+    ),
+    # cons spills the cdr and reloads it after storing the car; store it to
+    # the heap straight away instead. The spill slot is a temporary below
+    # the live stack slots, so it is dead once the pair is built.
+    "cons-store": Rule(
+        [
+            r"movq %rax, (-?\d+)\(%rsp\)",
+            r"movq (-?\d+)\(%rsp\), %rax",
+            r"movq %rax, (-?\d+)\(%rbp\)",
+            r"movq \1\(%rsp\), %rax",
+            r"movq %rax, (-?\d+)\(%rbp\)",
+        ],
+        store_cdr_first,
+    ),
+    "self-move": Rule([r"movq %(\w+), %\1"], keep()),
+    "jump-to-next": Rule([r"jmp (\w+)", r"\1:"], keep(1)),
+    "unreachable": Rule([r"jmp \w+|ret", r"[a-z][^:]*"], keep(0)),
+}
+
+
+class Peephole:
+    def __init__(self, emit, rules=None, window=WINDOW):
+        self.emit = emit
+        self.rules = RULES if rules is None else rules
+        self.size = window
+        # instructions, and the comment-only lines that follow each of them
+        self.window = []
+        self.comments = []
+        # instructions removed, by rule name
+        self.removed = Counter()
+
+    def write(self, line: Line):
+        if not line.text:
+            if self.window:
+                self.comments[-1].append(line)
+            else:
+                self.emit(line)
+            return
+        self.window.append(line)
+        self.comments.append([])
+        while self.rewrite():
+            pass
+        while len(self.window) > self.size:
+            self.emit_first()
+
+    def rewrite(self):
+        """Apply the first rule that matches the end of the window."""
+        for name, rule in self.rules.items():
+            n = len(rule.patterns)
+            if len(self.window) < n:
+                continue
+            matched = self.window[-n:]
+            text = "\n".join(line.text for line in matched)
+            if (match := rule.regex.fullmatch(text)) is not None:
+                replacement = [
+                    matched[x]
+                    if isinstance(x, int)
+                    else Line(x, indents=matched[0].indents)
+                    for x in rule.rewrite(match)
+                ]
+                # the comments between the matched instructions follow them
+                comments = [line for lines in self.comments[-n:] for line in lines]
+                del self.window[-n:], self.comments[-n:]
+                self.window.extend(replacement)
+                self.comments.extend([] for _ in replacement)
+                if self.comments:
+                    self.comments[-1].extend(comments)
+                else:
+                    for line in comments:
+                        self.emit(line)
+                self.removed[name] += n - len(replacement)
+                return True
+        return False
+
+    def emit_first(self):
+        self.emit(self.window.pop(0))
+        for line in self.comments.pop(0):
+            self.emit(line)
+
+    def flush(self):
+        while self.window:
+            self.emit_first()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
@@ -0,0 +1,189 @@
+"""
+A streaming reader for program text.
+
+It reads both ordinary Scheme syntax and the Python-literal form described
+in the readme, producing the compiler's input representation directly:
+
+    (letrec ((f (lambda (x) (fx+ x 1)))) (f 41))
+    [letrec, [("f", [λ, [x], ("fx+", x, 1)])], ("f", 41)]
+
+Parentheses read as tuples and brackets as lists, so () is null either way.
+Commas are whitespace. Keywords and primitive names read as strs, and other
+symbols as Vars unless the symbol table says otherwise. Text is consumed in
+chunks, so apart from the program itself the reader holds one chunk and one
+open list per level of nesting.
+
+There is no quote form: '() reads as null, and quoting any other datum is
+an error, as is a quote that is not before a parenthesis. Strings take
+double quotes, in the Python-literal form too.
+"""
+import re
+
+from . import PRIMITIVES, SPECIAL_FORMS, Var
+
+CHUNK_SIZE = 1 << 16
+
+KEYWORDS = {
+    "lambda": "lambda",
+    "λ": "lambda",
+    "letrec": "letrec",
+    **{name: name for name in SPECIAL_FORMS},
+    **{name: name for name in PRIMITIVES},
+}
+
+CHAR_NAMES = {
+    "space": " ",
+    "newline": "\n",
+    "tab": "\t",
+    "return": "\r",
+    "vt": "\v",
+    "ff": "\f",
+}
+
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "v": "\v", "f": "\f"}
+
+CLOSING = {"(": ")", "[": "]"}
+
+TOKEN = re.compile(
+    r"""
+    (?P<space>[\s,]+)
+    | (?P<comment>;[^\n]*|\#(?=\s)[^\n]*)
+    | (?P<quote>'(?=\())
+    | (?P<open>[(\[])
+    | (?P<close>[)\]])
+    | (?P<string>"(?:[^"\\]|\\.)*")
+    | (?P<char>\#\\(?:[A-Za-z]+|.))
+    | (?P<atom>[^\s,()\[\];"']+)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+INTEGER = re.compile(r"[+-]?[0-9]+")
+
+
+class ReadError(ValueError):
+    def __init__(self, message, line, column):
+        super().__init__(f"line {line}, column {column}: {message}")
+        self.line = line
+        self.column = column
+
+
+def tokens(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yield (kind, text, line, column) for each token in stream, reading it
+    chunk_size characters at a time. Lines and columns count from 1.
+    """
+    buffer = ""
+    pos = 0
+    line, line_start = 1, 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - pos < chunk_size:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            line_start -= pos
+            pos = 0
+        if pos == len(buffer):
+            return
+        match = TOKEN.match(buffer, pos)
+        # a token that reaches the end of the buffer may continue in the
+        # next chunk
+        if match is None or (match.end() == len(buffer) and not eof):
+            if not eof:
+                chunk_size *= 2
+                continue
+            message = f"unexpected {buffer[pos]!r}"
+            if buffer[pos] == "'":
+                message += ", only '() can be quoted"
+            elif buffer[pos] == '"':
+                message = "unterminated string"
+            raise ReadError(message, line, pos - line_start + 1)
+        kind, text = match.lastgroup, match.group()
+        if kind not in ("space", "comment"):
+            yield kind, text, line, pos - line_start + 1
+        if (newlines := text.count("\n")) > 0:
+            line += newlines
+            line_start = pos + text.rindex("\n") + 1
+        pos = match.end()
+
+
+def read(stream, symbols=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield each datum read from the text stream. symbols maps symbol names
+    to the values they read as, and is consulted before KEYWORDS.
+    """
+    for datum, _, _ in read_located(stream, symbols, chunk_size):
+        yield datum
+
+
+def read_located(stream, symbols=None, chunk_size=CHUNK_SIZE):
+    """Like read, but yield (datum, line, column) for each datum."""
+    symbols = {**KEYWORDS, **(symbols or {})}
+    stack = []
+    # where the quote before the next open parenthesis is
+    quote = None
+    for kind, text, line, column in tokens(stream, chunk_size):
+        if kind == "quote":
+            quote = line, column
+            continue
+        elif kind == "open":
+            stack.append((text, [], line, column, quote))
+            quote = None
+            continue
+        elif kind == "close":
+            if not stack:
+                raise ReadError(f"unexpected {text!r}", line, column)
+            opener, items, open_line, open_column, quoted = stack.pop()
+            if CLOSING[opener] != text:
+                raise ReadError(
+                    f"expected {CLOSING[opener]!r}, got {text!r}", line, column
+                )
+            if quoted is not None and items:
+                raise ReadError("only '() can be quoted", *quoted)
+            datum = tuple(items) if opener == "(" else items
+            line, column = quoted or (open_line, open_column)
+        else:
+            datum = read_atom(kind, text, symbols, line, column)
+        if stack:
+            stack[-1][1].append(datum)
+        else:
+            yield datum, line, column
+    if stack:
+        opener, _, line, column, _ = stack[-1]
+        raise ReadError(f"unclosed {opener!r}", line, column)
+
+
+def read_atom(kind, text, symbols, line, column):
+    if kind == "string":
+        return re.sub(r"\\(.)", lambda m: ESCAPES.get(m[1], m[1]), text[1:-1])
+    elif kind == "char":
+        name = text[2:]
+        if len(name) == 1:
+            return name
+        elif name in CHAR_NAMES:
+            return CHAR_NAMES[name]
+        raise ReadError(f"unknown character {text!r}", line, column)
+    elif text in symbols:
+        return symbols[text]
+    elif INTEGER.fullmatch(text):
+        return int(text)
+    elif text in ("#t", "#true", "True"):
+        return True
+    elif text in ("#f", "#false", "False"):
+        return False
+    elif text.startswith("#"):
+        raise ReadError(f"unknown syntax {text!r}", line, column)
+    return Var(text)
+
+
+def read_program(stream, symbols=None, chunk_size=CHUNK_SIZE):
+    """Read a program, which must be the only datum in stream."""
+    data = read_located(stream, symbols, chunk_size)
+    try:
+        program, _, _ = next(data)
+    except StopIteration:
+        raise ReadError("empty program", 1, 1) from None
+    for _, line, column in data:
+        raise ReadError("more than one datum in program", line, column)
+    return program
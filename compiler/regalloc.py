@@ -0,0 +1,163 @@
+"""
+Register allocation for variables.
+
+Variables are kept in the registers that scheme_entry preserves in the
+Context where possible. Each lambda body, and the program body, is numbered
+in evaluation order, and a variable is live from its binding to its last
+reference. Every procedure allocates from the same registers, so a variable
+live across a non-tail call stays on the stack. The rest are allocated by
+linear scan; when more are live than there are registers, those whose
+intervals end last are spilled to the stack.
+"""
+from bisect import bisect_right
+
+from .nodes import App, Const, If, Let, Loop, PrimCall, Recur, Ref
+from .walk import trampoline
+
+REGISTERS = ("rbx", "r12", "r13", "r14", "r15")
+
+
+class Intervals:
+    def __init__(self):
+        self.position = 0
+        self.start = {}
+        self.end = {}
+        # positions of non-tail calls, in increasing order
+        self.calls = []
+
+    def tick(self):
+        self.position += 1
+        return self.position
+
+    def define(self, binding):
+        self.start[binding] = self.tick()
+
+    def use(self, binding):
+        self.end[binding] = self.tick()
+
+    def call(self):
+        self.calls.append(self.tick())
+
+    def crosses_call(self, start, end):
+        i = bisect_right(self.calls, start)
+        return i < len(self.calls) and self.calls[i] < end
+
+
+def allocate(formals, body, registers=REGISTERS):
+    """Return a dict mapping the Bindings given registers to their register."""
+    if not registers:
+        return {}
+    intervals = Intervals()
+    for formal in formals:
+        intervals.define(formal)
+    trampoline(number(body, True, intervals))
+    return linear_scan(intervals, registers)
+
+
+def linear_scan(intervals, registers):
+    candidates = []
+    for binding, start in intervals.start.items():
+        end = intervals.end.get(binding, start)
+        if not intervals.crosses_call(start, end):
+            candidates.append((start, end, binding))
+    candidates.sort(key=lambda candidate: candidate[0])
+
+    allocation = {}
+    free = list(reversed(registers))
+    active = []
+    for start, end, binding in candidates:
+        for interval in [interval for interval in active if interval[0] < start]:
+            active.remove(interval)
+            free.append(allocation[interval[1]])
+        if free:
+            allocation[binding] = free.pop()
+            active.append((end, binding))
+            continue
+        furthest = max(active, key=lambda interval: interval[0])
+        if furthest[0] > end:
+            allocation[binding] = allocation.pop(furthest[1])
+            active.remove(furthest)
+            active.append((end, binding))
+    return allocation
+
+
+def number(expr, tail, intervals):
+    return NUMBER[type(expr)](expr, tail, intervals)
+
+
+def number_const(expr, tail, intervals):
+    pass
+
+
+def number_ref(expr, tail, intervals):
+    intervals.use(expr.binding)
+
+
+def number_primcall(expr, tail, intervals):
+    # emitters may read variable operands after evaluating the other args
+    for arg in expr.args:
+        if not isinstance(arg, Ref):
+            yield number(arg, False, intervals)
+    for arg in expr.args:
+        if isinstance(arg, Ref):
+            intervals.use(arg.binding)
+
+
+def number_if(expr, tail, intervals):
+    yield number(expr.test, False, intervals)
+    yield number(expr.consequent, tail, intervals)
+    yield number(expr.alternative, tail, intervals)
+
+
+def number_let(expr, tail, intervals):
+    for lhs, rhs in expr.bindings:
+        yield number(rhs, False, intervals)
+        intervals.define(lhs)
+    yield number(expr.body, tail, intervals)
+
+
+def number_operands_last(args, intervals):
+    """Number args, the operand args (constants and variables) last."""
+    for arg in args:
+        if not isinstance(arg, (Const, Ref)):
+            yield number(arg, False, intervals)
+    for arg in args:
+        if isinstance(arg, Ref):
+            intervals.use(arg.binding)
+
+
+def number_app(expr, tail, intervals):
+    # a tail call moves operand args into place after evaluating the others
+    yield number_operands_last(expr.args, intervals)
+    if not tail:
+        intervals.call()
+
+
+def number_loop(expr, tail, intervals):
+    start = intervals.tick()
+    yield number(expr.body, tail, intervals)
+    end = intervals.tick()
+    # variables from outside the loop that are used in it are live for
+    # every iteration
+    for binding, defined in intervals.start.items():
+        if defined < start < intervals.end.get(binding, defined):
+            intervals.end[binding] = end
+
+
+def number_recur(expr, tail, intervals):
+    yield number_operands_last(expr.args, intervals)
+    # the formals are written as the args are evaluated
+    for formal in expr.formals:
+        intervals.use(formal)
+
+
+NUMBER = {
+    Loop: number_loop,
+    Recur: number_recur,
+    Const: number_const,
+    Ref: number_ref,
+    PrimCall: number_primcall,
+    If: number_if,
+    Let: number_let,
+    App: number_app,
+}
@@ -0,0 +1,77 @@
+"""
+Runtime representation of values: tags, masks and immediate encodings.
+"""
+import string
+from dataclasses import dataclass
+
+###
+# Masks                 Tags
+# fixnum: | 00000011 |  00000000
+# bool:   | 10111111 |
+# char:   | 00111111 |  00001111
+#         |          |
+# Values  |          |
+# F       | 00101111 |
+# T       | 01101111 |
+# null    | 00111111 |
+###
+
+FXSHIFT = 2
+FXMASK = 0x03
+FXTAG = 0x00
+BOOL_F = 0x2F
+BOOL_T = 0x6F
+BOOL_BIT = 6
+BOOL_MASK = 0xBF  # BOOL_MASK & (T or F) give F. Doesn't clash with null
+NULL = 0x3F
+WORDSIZE = 8  # bytes
+
+FIXNUM_BITS = WORDSIZE * 8 - FXSHIFT
+FXLOWER = -(2 ** (FIXNUM_BITS - 1))
+FXUPPER = (2 ** (FIXNUM_BITS - 1)) - 1
+
+CHARS = string.ascii_letters + string.punctuation + string.whitespace + string.digits
+CHARSHIFT = 8
+CHARTAG = 0x0F
+CHARMASK = 0x3F
+
+PAIR_TAG = 1
+OBJ_MASK = 7
+CAR_OFFSET = 0
+CDR_OFFSET = 8
+
+
+@dataclass(frozen=True)
+class Var:
+    name: str
+
+
+def is_fixnum(x):
+    return not is_bool(x) and isinstance(x, int) and FXLOWER <= x <= FXUPPER
+
+
+def is_bool(x):
+    return x is True or x is False
+
+
+def is_null(x):
+    return x == ()
+
+
+def is_char(x):
+    return isinstance(x, str) and len(x) == 1 and x in CHARS
+
+
+def is_immediate(x):
+    return is_fixnum(x) or is_bool(x) or is_null(x) or is_char(x)
+
+
+def immediate_rep(x):
+    if is_fixnum(x):
+        return x << FXSHIFT
+    elif is_bool(x):
+        return BOOL_T if x else BOOL_F
+    elif is_null(x):
+        return NULL
+    elif is_char(x):
+        return (ord(x) << CHARSHIFT) | CHARTAG
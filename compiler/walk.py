@@ -0,0 +1,38 @@
+"""
+Explicit-stack tree walks.
+
+Recursive walks over programs (parsing, emission) are written as generator
+functions that yield where they would otherwise recurse:
+
+    result = yield parse(child, scope)
+
+trampoline drives such generators with an explicit stack, so the nesting
+depth of a program is bounded by memory rather than by the Python recursion
+limit.
+"""
+from types import GeneratorType
+
+
+def trampoline(walk):
+    """
+    Run walk to completion and return its result. Yielding a generator runs
+    it as a sub-walk and sends its return value back; yielding anything else
+    sends that value straight back, so leaf helpers can be plain functions.
+    """
+    if not isinstance(walk, GeneratorType):
+        return walk
+    stack = [walk]
+    value = None
+    while stack:
+        try:
+            child = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+        else:
+            if isinstance(child, GeneratorType):
+                stack.append(child)
+                value = None
+            else:
+                value = child
+    return value
@@ -1,65 +1,66 @@
 #include "startup.h"
 #include <stdio.h>
+#include <stdlib.h>
 #include <sys/mman.h>
 #include <unistd.h>
 
-void print_ptr_rec(ptr x) {
+void print_ptr_rec(FILE *out, ptr x) {
   if (is_fixnum(x)) {
-    printf("%ld", ((int64_t)x) >> fxshift);
+    fprintf(out, "%ld", ((int64_t)x) >> fxshift);
   } else if (x == bool_f) {
-    printf("#f");
+    fprintf(out, "#f");
   } else if (x == bool_t) {
-    printf("#t");
+    fprintf(out, "#t");
   } else if (x == null) {
-    printf("()");
+    fprintf(out, "()");
   } else if (is_char(x)) {
     int c = x >> chrshift;
     if (c == char_tab) {
-      printf("#\\tab");
+      fprintf(out, "#\\tab");
     } else if (c == char_return) {
-      printf("#\\return");
+      fprintf(out, "#\\return");
     } else if (c == char_newline) {
-      printf("#\\newline");
+      fprintf(out, "#\\newline");
     } else if (c == char_ff) {
-      printf("#\\ff");
+      fprintf(out, "#\\ff");
     } else if (c == char_vt) {
-      printf("#\\vt");
+      fprintf(out, "#\\vt");
     } else if (c == char_space) {
-      printf("#\\space");
+      fprintf(out, "#\\space");
     } else {
-      printf("#\\%c", c);
+      fprintf(out, "#\\%c", c);
     }
   } else if (is_pair(x)) {
     ptr current = x;
     ptr a = car(x);
     ptr d = cdr(x);
 
-    printf("(");
+    fprintf(out, "(");
     for (;;) {
-      print_ptr_rec(a);
+      print_ptr_rec(out, a);
       if (is_pair(d)) {
-	printf(" ");
+	fprintf(out, " ");
 	current = d;
 	a = car(current);
 	d = cdr(current);
       } else if (d == null) {
 	break;
       } else {
-	printf(" . ");
-	print_ptr_rec(d);
+	fprintf(out, " . ");
+	print_ptr_rec(out, d);
 	break;
       }
     }
-    printf(")");
+    fprintf(out, ")");
   }
 }
 
-void print_ptr(ptr x) {
-  print_ptr_rec(x);
-  printf("\n");
+void print_ptr(FILE *out, ptr x) {
+  print_ptr_rec(out, x);
+  fprintf(out, "\n");
 }
 
-static char *allocate_protected_space(int size) {
+char *allocate_protected_space(int size) {
   int page = getpagesize();
   int status;
   int aligned_size = ((size + page - 1) / page) * page;
@@ -82,7 +83,7 @@ static char *allocate_protected_space(int size) {
   return p + page;
 }
 
-static void deallocate_protected_space(char *p, int size) {
+void deallocate_protected_space(char *p, int size) {
   int page = getpagesize();
   int status;
   int aligned_size = ((size + page - 1) / page) * page;
@@ -92,14 +93,34 @@ static void deallocate_protected_space(char *p, int size) {
   }
 }
 
-int main() {
+/* Run entry with a fresh stack and heap, printing its result to out. */
+void execute(ptr (*entry)(Context *, char *, char *), FILE *out) {
   Context ctx;
   int stack_size = 16 * 4096; /* Holds 16K cells */
   char *stack_top = allocate_protected_space(stack_size);
   char *stack_base = stack_top + stack_size;
   char *heap = allocate_protected_space(stack_size);
-  print_ptr(scheme_entry(&ctx, stack_base, heap));
+  print_ptr(out, entry(&ctx, stack_base, heap));
   deallocate_protected_space(stack_top, stack_size);
   deallocate_protected_space(heap, stack_size);
+}
+
+/* As execute, returning the output in a string to be freed by free_output. */
+char *execute_to_string(ptr (*entry)(Context *, char *, char *)) {
+  char *output;
+  size_t size;
+  FILE *out = open_memstream(&output, &size);
+  execute(entry, out);
+  fclose(out);
+  return output;
+}
+
+void free_output(char *output) { free(output); }
+
+/* The shared library is loaded into the compiler, which supplies entry. */
+#ifndef INC_SHARED
+int main() {
+  execute(scheme_entry, stdout);
   return 0;
 }
+#endif
@@ -4,7 +4,16 @@ from pathlib import Path
 import pytest
 
 from compiler import emit_program
-from compiler.io import FileWriter
+from compiler.build import Assembler, runtime_object
+from compiler.cache import Cache
+from compiler.jit import Jit
+from compiler.peephole import Peephole
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "gas: runs programs built with gas, in a new process"
+    )
 
 
 @pytest.fixture()
@@ -12,19 +21,48 @@ def project_root():
     return Path(__file__).parent.parent
 
 
+@pytest.fixture(params=[False, True], ids=["O0", "O1"])
+def optimize(request):
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def runtime_cache(tmp_path_factory):
+    return Cache(tmp_path_factory.mktemp("runtime"))
+
+
+@pytest.fixture(scope="session")
+def runtime(runtime_cache):
+    return runtime_object(runtime_cache)
+
+
+@pytest.fixture(scope="session")
+def jits(runtime_cache):
+    return {optimize: Jit(runtime_cache, optimize) for optimize in (False, True)}
+
+
+# the jit encodes listings itself, so programs are also built with gas to
+# check the encoder against
+@pytest.fixture(params=["jit", pytest.param("gas", marks=pytest.mark.gas)])
+def backend(request):
+    return request.param
+
+
 @pytest.fixture()
-def compile_and_run(tmp_path, project_root):
+def compile_and_run(request, backend, optimize):
+    if backend == "jit":
+        return request.getfixturevalue("jits")[optimize].run
+    tmp_path = request.getfixturevalue("tmp_path")
+    runtime = request.getfixturevalue("runtime")
+
     def _compile_and_run(program):
-        startup = project_root / "startup.c"
-        asm_file = tmp_path / "program.s"
         binary = tmp_path / "test"
-        with FileWriter(asm_file) as writer:
-            emit_program(program, writer.write)
-
-        subprocess.run(
-            ["gcc", "-fomit-frame-pointer", startup, asm_file, "-o", binary],
-            check=True,
-        )
+        with Assembler(binary, runtime) as assembler:
+            if optimize:
+                with Peephole(assembler.write) as peephole:
+                    emit_program(program, peephole.write, optimize=True)
+            else:
+                emit_program(program, assembler.write, optimize=False)
         return subprocess.run([binary], check=True, capture_output=True).stdout.decode(
             "utf-8"
         )
@@ -0,0 +1,86 @@
+"""
+Reading what as assembles from a listing, to check compiler.encoder and
+compiler.elf against.
+"""
+import pathlib
+import struct
+import subprocess
+import tempfile
+
+from compiler.elf import (
+    ELF_HEADER,
+    ELF_MAGIC,
+    EM_X86_64,
+    ET_REL,
+    SECTION_HEADER,
+    SHT_SYMTAB,
+    SYMBOL,
+)
+
+RELA = struct.Struct("<QQq")
+SHT_RELA = 4
+R_X86_64_PC32 = 2
+R_X86_64_PLT32 = 4
+
+
+def assemble_object(listing):
+    """Assemble listing, the text of a listing, with as and return the object."""
+    with tempfile.TemporaryDirectory() as directory:
+        obj = pathlib.Path(directory) / "program.o"
+        command = ["as", "--64", "-o", obj, "-"]
+        subprocess.run(command, input=listing.encode(), check=True)
+        return obj.read_bytes()
+
+
+def string_at(data, offset):
+    return data[offset : data.index(b"\0", offset)].decode()
+
+
+def read_text(data):
+    """
+    Return the code in .text, with its relocations applied, and a dict of
+    the offsets of the symbols defined in it. Listings only refer to their
+    own labels, so every relocation is PC-relative within .text.
+    """
+    header = ELF_HEADER.unpack_from(data)
+    ident, kind, machine = header[:3]
+    shoff, shentsize, shnum, shstrndx = header[6], *header[11:]
+    if ident[:4] != ELF_MAGIC or kind != ET_REL or machine != EM_X86_64:
+        raise ValueError("not an x86-64 relocatable object")
+    sections = [
+        SECTION_HEADER.unpack_from(data, shoff + i * shentsize) for i in range(shnum)
+    ]
+
+    def contents(section):
+        offset, size = section[4], section[5]
+        return data[offset : offset + size]
+
+    names = sections[shstrndx][4]
+    text = next(
+        i
+        for i, section in enumerate(sections)
+        if string_at(data, names + section[0]) == ".text"
+    )
+    code = bytearray(contents(sections[text]))
+
+    symbols = []
+    for section in sections:
+        if section[1] == SHT_SYMTAB:
+            strings = sections[section[6]][4]
+            table = contents(section)
+            for name, _, _, shndx, value, _ in SYMBOL.iter_unpack(table):
+                symbols.append((string_at(data, strings + name), shndx, value))
+
+    for section in sections:
+        if section[1] != SHT_RELA or section[7] != text:
+            continue
+        for offset, info, addend in RELA.iter_unpack(contents(section)):
+            name, shndx, value = symbols[info >> 32]
+            if info & 0xFFFFFFFF not in (R_X86_64_PC32, R_X86_64_PLT32):
+                raise ValueError(f"unsupported relocation {info & 0xFFFFFFFF}")
+            if shndx != text:
+                raise ValueError(f"{name!r} is not defined in .text")
+            struct.pack_into("<i", code, offset, value + addend - offset)
+
+    defined = {name: value for name, shndx, value in symbols if shndx == text and name}
+    return code, defined
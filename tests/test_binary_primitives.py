@@ -1,6 +1,10 @@
 import pytest
 
-from compiler import FXUPPER
+from compiler import FXUPPER, Var, emit_program, multiply_by
+from compiler.fold import wrap
+
+x = Var("x")
+y = Var("y")
 
 
 @pytest.mark.parametrize(
@@ -316,3 +320,90 @@ def test_char_comparisons(program, out, compile_and_run):
 )
 def test_fxmul(program, out, compile_and_run):
     assert compile_and_run(program) == out
+
+
+OPERATIONS = {
+    "fx+": lambda a, b: a + b,
+    "fx-": lambda a, b: a - b,
+    "fx*": lambda a, b: a * b,
+    "fxlogand": lambda a, b: a & b,
+    "fxlogor": lambda a, b: a | b,
+    "fx=": lambda a, b: a == b,
+    "fx<": lambda a, b: a < b,
+    "fx<=": lambda a, b: a <= b,
+    "fx>": lambda a, b: a > b,
+    "fx>=": lambda a, b: a >= b,
+}
+
+# a constant, a constant too large for an immediate, a variable and an
+# expression, with values 7, 1 << 40, 3 and 4
+OPERANDS = [(7, 7), (1 << 40, 1 << 40), (y, 3), (("fxadd1", y), 4)]
+
+
+def show(value):
+    if isinstance(value, bool):
+        return "#t" if value else "#f"
+    return wrap(value)
+
+
+@pytest.mark.parametrize("op", OPERATIONS)
+def test_operand_forms(op, compile_and_run):
+    results = ()
+    expected = []
+    for arg1, value1 in reversed(OPERANDS):
+        for arg2, value2 in reversed(OPERANDS):
+            results = ("cons", (op, arg1, arg2), results)
+            expected.insert(0, show(OPERATIONS[op](value1, value2)))
+    program = ("let", [(y, 3)], results)
+    assert compile_and_run(program) == f"({' '.join(map(str, expected))})\n"
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        ("fx+", x, 1),
+        ("fx+", 1, x),
+        ("fx-", x, 1),
+        ("fx-", 1, x),
+        ("fx<", x, 100),
+        ("fx<", 100, x),
+        ("fx*", x, 3),
+        ("fxlogand", x, y),
+    ],
+)
+def test_operands_are_not_spilled(program):
+    lines = []
+    emit_program(("let", [(x, 1), (y, 2)], program), lines.append, optimize=False)
+    stores = [line.text for line in lines if line.text.endswith("(%rsp)")]
+    assert len(stores) == 2
+
+
+@pytest.mark.parametrize(
+    ("k", "instructions"),
+    [
+        [0, ["movq $0, %rax"]],
+        [1, []],
+        [-1, ["negq %rax"]],
+        [8, ["salq $3, %rax"]],
+        [3, ["leaq (%rax,%rax,2), %rax"]],
+        [-20, ["leaq (%rax,%rax,4), %rax", "salq $2, %rax", "negq %rax"]],
+        [7, ["imulq $7, %rax"]],
+        [1 << 40, ["salq $40, %rax"]],
+        [7 << 40, None],
+        [True, None],
+    ],
+)
+def test_multiply_by(k, instructions):
+    assert multiply_by(k) == instructions
+
+
+@pytest.mark.parametrize("k", [0, 1, -1, 2, 3, 5, 6, 9, 10, 7, -8, 1 << 40, 7 << 40])
+def test_fxmul_constant(k, compile_and_run):
+    values = [0, 1, -3, 12345, FXUPPER // 3]
+    results = ()
+    for value in reversed(values):
+        results = ("cons", ("fx*", y, k), ("cons", ("fx*", k, y), results))
+        results = ("let", [(y, value)], results)
+    # without optimization, y is a variable and k an immediate
+    expected = " ".join(f"{wrap(value * k)} {wrap(value * k)}" for value in values)
+    assert compile_and_run(results) == f"({expected})\n"
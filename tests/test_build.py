@@ -0,0 +1,133 @@
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from compiler import emit_program
+from compiler.build import (
+    Assembler,
+    assemble,
+    cached_executable,
+    encode_executable,
+    executable_key,
+    runtime_key,
+    runtime_object,
+)
+from compiler.cache import Cache
+from compiler.io import FileWriter, Line
+
+program = ("fx+", ("car", ("cons", 1, 2)), 3)
+
+
+def run(binary):
+    return subprocess.run([binary], check=True, capture_output=True).stdout
+
+
+def test_assembler_pipes_listing(tmp_path):
+    binary = tmp_path / "test"
+    with Assembler(binary, threshold=1) as assembler:
+        emit_program(program, assembler.write)
+    assert run(binary) == b"4\n"
+    assert list(tmp_path.iterdir()) == [binary]
+
+
+def test_assemble_kept_listing(tmp_path):
+    asm_file, binary = tmp_path / "program.s", tmp_path / "test"
+    with FileWriter(asm_file) as writer:
+        emit_program(program, writer.write)
+    assemble(asm_file, binary)
+    assert run(binary) == b"4\n"
+
+
+def test_assembler_error(tmp_path):
+    with pytest.raises(subprocess.CalledProcessError):
+        with Assembler(tmp_path / "test") as assembler:
+            assembler.write(1 >> Line("notaninstruction"))
+
+
+def test_emission_error_builds_nothing(tmp_path):
+    binary = tmp_path / "test"
+    with pytest.raises(KeyError):
+        with Assembler(binary) as assembler:
+            emit_program(program, assembler.write)
+            raise KeyError
+    assert not binary.exists()
+
+
+def test_runtime_object_cached(tmp_path, monkeypatch):
+    cache = Cache(tmp_path / "cache")
+    obj = runtime_object(cache)
+    assert obj.suffix == ".o"
+    binary = tmp_path / "test"
+    with Assembler(binary, obj) as assembler:
+        emit_program(program, assembler.write)
+    assert run(binary) == b"4\n"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("runtime recompiled")
+
+    monkeypatch.setattr(subprocess, "run", fail)
+    assert runtime_object(cache) == obj
+
+
+def test_runtime_key(tmp_path):
+    source = tmp_path / "startup.c"
+    header = tmp_path / "startup.h"
+    source.write_text("int x;\n")
+    header.write_text("")
+    key = runtime_key((source, header))
+    assert runtime_key((source, header), flags=("-O2",)) != key
+    header.write_text("#define X\n")
+    assert runtime_key((source, header)) != key
+
+
+def build(calls):
+    def write_listing(writer):
+        calls.append(writer)
+        emit_program(program, writer.write)
+
+    return write_listing
+
+
+def test_cached_executable(tmp_path, runtime):
+    cache = Cache(tmp_path / "cache")
+    key = executable_key(program, {"peephole": False})
+    calls = []
+    binary = cached_executable(cache, key, build(calls), runtime)
+    assert run(binary) == b"4\n"
+    assert b"scheme_entry" in cache.get(f"{key}.s")
+    assert cached_executable(cache, key, build(calls), runtime) == binary
+    assert len(calls) == 1
+
+
+def test_concurrent_cached_executables(tmp_path, runtime):
+    cache = Cache(tmp_path / "cache")
+    key = executable_key(program, {})
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        binaries = list(
+            executor.map(
+                lambda _: cached_executable(cache, key, build([]), runtime), range(4)
+            )
+        )
+    assert all(run(binary) == b"4\n" for binary in binaries)
+    assert not [path for path in cache.directory.iterdir() if path.name[0] == "."]
+
+
+@pytest.mark.parametrize(
+    ("other", "options"),
+    [
+        [program, {"peephole": True}],
+        [("fx+", ("car", ("cons", 1, 2)), 4), {"peephole": False}],
+    ],
+)
+def test_executable_key(other, options):
+    key = executable_key(program, {"peephole": False})
+    assert executable_key(program, {"peephole": False}) == key
+    assert executable_key(other, options) != key
+
+
+def test_encode_executable(tmp_path, runtime):
+    binary = tmp_path / "test"
+    encode_executable(build([]), binary, runtime)
+    assert run(binary) == b"4\n"
+    assert list(tmp_path.iterdir()) == [binary]
@@ -0,0 +1,67 @@
+import io
+import os
+
+import pytest
+
+from compiler import Var
+from compiler.cache import Cache, decode_program, encode_program, load_program
+
+x = Var("x")
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        42,
+        True,
+        (),
+        [],
+        "a",
+        ("letrec", [("f", ["lambda", [x], ("fx+", x, 1)])], ("f", 41)),
+        ("let", ((x, (False, "b")),), [x, [], ()]),
+    ],
+)
+def test_encode_decode(program):
+    assert decode_program(encode_program(program)) == program
+
+
+def test_encode_decode_deep():
+    program = 0
+    for _ in range(10000):
+        program = ("fxadd1", program)
+    data = encode_program(program)
+    assert encode_program(decode_program(data)) == data
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = Cache(tmp_path, max_bytes=20)
+    cache.put("a", b"0123456789")
+    cache.put("b", b"0123456789")
+    os.utime(cache.path("a"), (0, 0))
+    os.utime(cache.path("b"), (1, 1))
+    cache.get("a")  # a is now the most recently used
+    cache.put("c", b"0123456789")
+    assert cache.get("a") == b"0123456789"
+    assert cache.get("b") is None
+    assert cache.get("c") == b"0123456789"
+
+
+def test_load_program_hit_skips_reading(tmp_path):
+    cache = Cache(tmp_path)
+    opened = []
+
+    def open_source():
+        opened.append(True)
+        return io.StringIO("(fx+ 1 2)")
+
+    assert load_program(cache, "digest", open_source) == ("fx+", 1, 2)
+    assert load_program(cache, "digest", open_source) == ("fx+", 1, 2)
+    assert len(opened) == 1
+
+
+def test_load_program_discards_corrupt_entry(tmp_path):
+    cache = Cache(tmp_path)
+    load_program(cache, "digest", lambda: io.StringIO("1"))
+    (entry,) = tmp_path.iterdir()
+    entry.write_bytes(b"garbage")
+    assert load_program(cache, "digest", lambda: io.StringIO("1")) == 1
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from compiler import Compilation, Var, emit_program
+
+f, n, x = "f", Var("n"), Var("x")
+
+program = (
+    "letrec",
+    [(f, ("lambda", [n], ("if", ("fxzero?", n), n, ("f", ("fxsub1", n)))))],
+    ("let", [(x, ("f", 3))], ("if", ("fx<", x, 1), ("fx+", x, 2), x)),
+)
+
+
+def listing(optimize=True):
+    lines = []
+    emit_program(program, lines.append, optimize=optimize)
+    return [str(line) for line in lines]
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_listing_is_deterministic(optimize):
+    assert listing(optimize) == listing(optimize)
+
+
+def test_labels_start_at_zero():
+    assert any(line.startswith("L_0:") for line in listing())
+
+
+def test_concurrent_compilations():
+    expected = listing()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: listing(), range(32)))
+    assert all(result == expected for result in results)
+
+
+def test_stats():
+    compilation = emit_program(program, [].append)
+    assert compilation.stats["labels"] == next(compilation.labels)
+    assert compilation.stats["procedures"] == 2
+    assert compilation.stats["registers"] > 0
+    unoptimized = emit_program(program, [].append, optimize=False)
+    assert unoptimized.stats["registers"] == 0
+
+
+def test_compilation_labels():
+    compilation = Compilation()
+    assert [compilation.label() for _ in range(3)] == ["L_0", "L_1", "L_2"]
+    assert Compilation().label() == "L_0"
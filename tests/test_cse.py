@@ -0,0 +1,108 @@
+import pytest
+
+from compiler import Var, parse_program
+from compiler.cse import cse_program
+from compiler.nodes import If, Let, PrimCall, nodes
+
+a = Var("a")
+x = Var("x")
+y = Var("y")
+
+pair = ("cons", ("cons", 1, 2), ("cons", 3, 4))
+
+
+def cse(program):
+    return cse_program(parse_program(program)).body
+
+
+def calls(expr, op):
+    return sum(
+        1 for node in nodes(expr) if isinstance(node, PrimCall) and node.op == op
+    )
+
+
+@pytest.mark.parametrize(
+    ("body", "op", "count"),
+    [
+        [("fx+", ("car", ("cdr", x)), ("car", ("cdr", x))), "cdr", 1],
+        [("fx+", ("car", ("cdr", x)), ("car", ("cdr", x))), "car", 1],
+        [("fx+", ("car", x), ("fx+", ("car", x), ("car", x))), "car", 1],
+        [("let", [(y, ("car", x))], ("fx+", y, ("car", x))), "car", 1],
+        [("fx+", ("car", x), ("car", ("cdr", x))), "car", 2],
+        [("if", ("pair?", x), ("fx+", ("car", x), ("car", x)), 0), "car", 1],
+        # cons allocates a new pair each time; three more bind x
+        [("fx+", ("car", ("cons", 1, 2)), ("car", ("cons", 1, 2))), "cons", 5],
+    ],
+)
+def test_common_calls(body, op, count):
+    assert calls(cse(("let", [(x, pair)], body)), op) == count
+
+
+def test_not_hoisted_out_of_arms():
+    body = cse(("let", [(x, 1)], ("if", ("pair?", x), ("car", x), ("car", x))))
+    [test] = [node for node in nodes(body) if isinstance(node, If)]
+    assert calls(test.consequent, "car") == calls(test.alternative, "car") == 1
+    assert calls(body, "car") == 2
+
+
+def test_bound_in_inner_region():
+    inner = ("let", [(y, x)], ("fx+", ("car", y), ("car", y)))
+    body = cse(("let", [(x, pair)], inner))
+    [_, y_let, cse_let] = [node for node in nodes(body) if isinstance(node, Let)]
+    assert cse_let is y_let.body
+    assert calls(cse_let.bindings[0][1], "car") == 1
+
+
+def test_subexpression_inside_bound_call_not_bound():
+    caar = ("car", ("car", x))
+    body = cse(("let", [(x, pair)], ("fx+", caar, caar)))
+    lets = [node for node in nodes(body) if isinstance(node, Let)]
+    # the let binding x, and one for ("car", ("car", x))
+    assert len(lets) == 2
+
+
+@pytest.mark.parametrize(
+    ("program", "expected"),
+    [
+        [
+            ("let", [(x, pair)], ("fx+", ("car", ("cdr", x)), ("car", ("cdr", x)))),
+            "6\n",
+        ],
+        [
+            (
+                "let",
+                [(x, pair)],
+                (
+                    "let",
+                    [(a, ("fx+", ("car", ("car", x)), ("cdr", ("car", x))))],
+                    ("fx*", a, ("fx+", ("car", ("car", x)), ("cdr", ("car", x)))),
+                ),
+            ),
+            "9\n",
+        ],
+        [
+            (
+                "letrec",
+                [
+                    (
+                        "f",
+                        (
+                            "λ",
+                            [x],
+                            (
+                                "if",
+                                ("pair?", x),
+                                ("fx+", ["f", ("car", x)], ["f", ("car", x)]),
+                                x,
+                            ),
+                        ),
+                    )
+                ],
+                ["f", ("cons", ("cons", 5, ()), ())],
+            ),
+            "20\n",
+        ],
+    ],
+)
+def test_cse_programs(compile_and_run, program, expected):
+    assert compile_and_run(program) == expected
@@ -0,0 +1,100 @@
+import pytest
+
+from compiler import Var, emit_program, parse_program
+from compiler.dce import eliminate_program
+from compiler.nodes import Const, Let, nodes
+
+x = Var("x")
+y = Var("y")
+z = Var("z")
+
+countdown = ("λ", [x], ("if", ("fxzero?", x), 0, ["countdown", ("fxsub1", x)]))
+
+
+def eliminate(program):
+    return eliminate_program(parse_program(program))
+
+
+def lets(expr):
+    return [
+        lhs.name
+        for node in nodes(expr)
+        if isinstance(node, Let)
+        for lhs, _ in node.bindings
+    ]
+
+
+@pytest.mark.parametrize(
+    ("program", "kept"),
+    [
+        [("let", [(x, 1), (y, 2)], y), ["y"]],
+        [("let", [(x, ("fx+", 1, 2))], 3), []],
+        # y is only referenced by x, which is dead
+        [("let", [(y, 1)], ("let", [(x, ("fxadd1", y))], 3)), []],
+        [("let", [(x, ("cons", 1, 2))], 3), ["x"]],
+        [
+            ("letrec", [("countdown", countdown)], ("let", [(x, ["countdown", 3])], 3)),
+            ["x"],
+        ],
+        [("let*", [(x, 1), (y, ("fxadd1", x)), (z, ("fxadd1", y))], x), ["x"]],
+    ],
+)
+def test_dead_bindings(program, kept):
+    assert lets(eliminate(program).body) == kept
+
+
+def test_constant_test():
+    program = eliminate(("let", [(x, 1)], ("if", True, 2, ("fx+", x, 3))))
+    assert isinstance(program.body, Const)
+    assert program.body.value == 2
+
+
+def test_unreachable_procedures():
+    program = eliminate(
+        (
+            "letrec",
+            [
+                ("countdown", countdown),
+                ("f", ("λ", [x], ["countdown", x])),
+                ("g", ("λ", [x], ["f", x])),
+                ("h", ("λ", [x], ["h", x])),
+            ],
+            ["g", 3],
+        )
+    )
+    assert [name for name, _ in program.bindings] == ["countdown", "f", "g"]
+
+
+def test_procedures_only_called_from_dead_code():
+    program = eliminate(
+        ("letrec", [("countdown", countdown)], ("if", False, ["countdown", 1], 2))
+    )
+    assert program.bindings == ()
+
+
+def test_fewer_instructions():
+    program = ("let", [(y, 1)], ("let", [(x, ("fx*", y, y))], ("fxadd1", y)))
+    plain, optimized = [], []
+    emit_program(program, plain.append, optimize=False)
+    emit_program(program, optimized.append, optimize=True)
+    assert not any("imulq" in line.text for line in optimized)
+    assert len(optimized) < len(plain)
+
+
+@pytest.mark.parametrize(
+    ("program", "expected"),
+    [
+        [("let", [(x, ("cons", 1, 2)), (y, 3)], ("car", x)), "1\n"],
+        [("let", [(x, 1), (y, ("fx+", 1, 2))], ("if", ("fx<", x, 2), x, y)), "1\n"],
+        [
+            (
+                "letrec",
+                [("countdown", countdown), ("f", ("λ", [x], 7))],
+                ("let", [(x, ["countdown", 10])], ["f", x]),
+            ),
+            "7\n",
+        ],
+    ],
+)
+def test_eliminated_programs(compile_and_run, program, expected):
+    assert compile_and_run(program) == expected
@@ -0,0 +1,29 @@
+import sys
+
+from compiler import Var
+
+x = Var("x")
+
+
+def test_long_and(compile_and_run):
+    program = ("and", *([True] * 2000), 7)
+    assert compile_and_run(program) == "7\n"
+
+
+def test_long_or(compile_and_run):
+    program = ("or", *([False] * 2000), 7)
+    assert compile_and_run(program) == "7\n"
+
+
+def test_long_let_star_chain(compile_and_run):
+    n = sys.getrecursionlimit() * 2
+    program = ("let*", [(x, 0), *[(x, ("fxadd1", x))] * n], x)
+    assert compile_and_run(program) == f"{n}\n"
+
+
+def test_deeply_nested_arithmetic(compile_and_run):
+    n = sys.getrecursionlimit() * 2
+    program = 0
+    for _ in range(n):
+        program = ("fxadd1", program)
+    assert compile_and_run(program) == f"{n}\n"
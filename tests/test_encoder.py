@@ -0,0 +1,103 @@
+import pytest
+
+from compiler import Var, emit_program
+from compiler.elf import write_object
+from compiler.encoder import Encoder, encode
+from compiler.io import Line
+
+from .gas import assemble_object, read_text
+
+f, n, x = "f", Var("n"), Var("x")
+
+
+def encode_lines(*texts):
+    encoder = Encoder()
+    for text in texts:
+        encoder.write(Line(text) if text.endswith(":") else 1 >> Line(text))
+    return encoder.finish()
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ["ret", "c3"],
+        ["shlq $1, %rax", "48d1e0"],
+        ["sal $1, %al", "d0e0"],
+        ["sal $6, %al", "c0e006"],
+        ["movq $0xffffffff, %rax", "48b8ffffffff00000000"],
+        ["movq $-1, %rax", "48c7c0ffffffff"],
+        ["addq $1000, %rax", "4805e8030000"],
+        ["addq $1000, %rbx", "4881c3e8030000"],
+        ["cmpq $1, %rax", "4883f801"],
+        ["movq 0(%rax), %rax", "488b00"],
+        ["movq 0(%rbp), %rax", "488b4500"],
+        ["movq %rax, -8(%rsp)", "48894424f8"],
+        ["movq $5, -8(%rsp)", "48c74424f805000000"],
+        ["and $0xFC, %al", "24fc"],
+        ["leaq (%rax,%rax,2), %rax", "488d0440"],
+        ["imulq $3, %rax", "486bc003"],
+        ["imulq $300, %rax", "4869c02c010000"],
+        ["imulq -16(%rsp), %rax", "480faf4424f0"],
+        ["movq %rax, %r11", "4989c3"],
+        ["movq 8(%r12), %rax", "498b442408"],
+        ["movq 0(%r13), %rax", "498b4500"],
+        ["sete %al", "0f94c0"],
+        ["movzbq %al, %rax", "480fb6c0"],
+        ["negq %rax", "48f7d8"],
+        ["not %rax", "48f7d0"],
+        ["sub $16, %rsp", "4883ec10"],
+        ["subq %rbx, %rax", "4829d8"],
+    ],
+)
+def test_encode(text, expected):
+    assert encode(text).hex() == expected
+
+
+def test_jumps_lengthen():
+    short, _ = encode_lines("L_0:", "jmp L_0", "je L_0")
+    assert short.hex() == "ebfe74fc"
+    padding = ["movq $0, %rax"] * 20
+    far, symbols = encode_lines("jmp L_1", "je L_1", *padding, "L_1:", "call L_1")
+    # to L_1 from the end of each jump
+    assert far[:5].hex() == f"e9{151 - 5:02x}000000"
+    assert far[5:11].hex() == f"0f84{151 - 11:02x}000000"
+    assert symbols["L_1"] == 11 + 7 * 20
+
+
+@pytest.mark.parametrize(
+    "texts",
+    [
+        ["jmp L_1"],
+        ["frobq %rax"],
+        ["addq $0x80000000, %rbx"],
+        ["imulq $-0x80000001, %rax"],
+        ["movq $0x80000000, 8(%rsp)"],
+        ["movq 0x80000000(%rsp), %rax"],
+    ],
+)
+def test_encode_errors(texts):
+    with pytest.raises(ValueError):
+        encode_lines(*texts)
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_same_code_as_gas(optimize):
+    program = (
+        "letrec",
+        [(f, ("lambda", [n], ("if", ("fxzero?", n), n, ("f", ("fxsub1", n)))))],
+        ("let", [(x, ("cons", ("f", 300), 2))], ("fx*", ("car", x), ("cdr", x))),
+    )
+    lines = []
+    emit_program(program, lines.append, optimize=optimize)
+    encoder = Encoder()
+    for line in lines:
+        encoder.write(line)
+    code, symbols = encoder.finish()
+    expected = read_text(assemble_object("".join(map(str, lines))))
+    assert (code, symbols) == (bytes(expected[0]), expected[1])
+
+
+def test_object_round_trip():
+    code, symbols = encode_lines("f:", "call g", "ret", "g:", "ret")
+    obj = write_object(code, symbols, globals={"g"}, functions={"f"})
+    assert read_text(obj) == (bytearray(code), symbols)
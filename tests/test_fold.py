@@ -0,0 +1,74 @@
+import pytest
+
+from compiler import FXLOWER, FXUPPER, Var, parse_program
+from compiler.fold import fold_program
+from compiler.nodes import Const, If, Let, PrimCall
+
+x = Var("x")
+y = Var("y")
+
+
+def fold(program):
+    return fold_program(parse_program(program)).body
+
+
+@pytest.mark.parametrize(
+    ("program", "value"),
+    [
+        [("fx+", 3, 4), 7],
+        [("fxadd1", ("fxadd1", 5)), 7],
+        [("fx<", 1, 2), True],
+        [("char->fixnum", "a"), 97],
+        [("fixnum->char", 97), "a"],
+        [("fx+", FXUPPER, 1), FXLOWER],
+        [("fx*", FXUPPER, 2), -2],
+        [("fxlognot", 5), -6],
+        [("char<", "a", "b"), True],
+        [("fx=", "a", 97), False],
+        [("not", ()), False],
+        [("let", [(x, 2)], ("let*", [(y, ("fx*", x, 3))], ("fx-", y, x))), 4],
+        [("if", ("fxzero?", 0), 1, ("car", 2)), 1],
+        [("if", ("fx>", 1, 2), ("car", 2), 1), 1],
+    ],
+)
+def test_fold_to_constant(program, value):
+    folded = fold(program)
+    assert isinstance(folded, Const)
+    assert folded.value == value
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        ("fxadd1", "a"),
+        ("char->fixnum", 1),
+        ("fixnum->char", -1),
+        ("car", ("cons", 1, 2)),
+    ],
+)
+def test_fold_leaves_ill_typed_and_heap_operations(program):
+    assert isinstance(fold(program), PrimCall)
+
+
+def test_fold_keeps_non_constant_bindings():
+    folded = fold(("let", [(x, 1), (y, ("cons", 1, 2))], ("if", ("pair?", y), x, 0)))
+    assert isinstance(folded, Let)
+    assert [lhs.var for lhs, _ in folded.bindings] == [y]
+    assert isinstance(folded.body, If)
+    assert isinstance(folded.body.consequent, Const)
+
+
+@pytest.mark.parametrize(
+    ("program", "out"),
+    [
+        [("fx+", FXUPPER, 1), f"{FXLOWER}\n"],
+        [("fx-", FXLOWER, 1), f"{FXUPPER}\n"],
+        [("fx*", FXUPPER, FXUPPER), "1\n"],
+        [("fxlognot", -536870912), "536870911\n"],
+        [("fixnum->char", ("char->fixnum", "z")), "#\\z\n"],
+        [("fx<", "a", 97), "#f\n"],
+        [("let", [(x, 5)], ("if", ("fx=", x, 5), ("fx*", x, x), 0)), "25\n"],
+    ],
+)
+def test_fold_matches_runtime(program, out, compile_and_run):
+    assert compile_and_run(program) == out
@@ -1,5 +1,7 @@
 import pytest
 
+from compiler import Var, emit_program
+
 
 @pytest.mark.parametrize(
     ("program", "out"),
@@ -83,3 +85,51 @@ def test_and(program, out, compile_and_run):
 )
 def test_or(program, out, compile_and_run):
     assert compile_and_run(program) == out
+
+
+x = Var("x")
+y = Var("y")
+
+
+def classify(test, *args):
+    return ("letrec", [("f", ("λ", [x, y], ("if", test, 1, 0)))], ["f", *args])
+
+
+@pytest.mark.parametrize(
+    ("test", "args", "out"),
+    [
+        [("fxzero?", x), [0, 0], "1\n"],
+        [("fxzero?", x), [1, 0], "0\n"],
+        [("not", ("fx<", x, y)), [1, 2], "0\n"],
+        [("not", ("fx<", x, y)), [2, 1], "1\n"],
+        [("and", ("fx<", x, y), ("fx>", y, 10)), [1, 20], "1\n"],
+        [("and", ("fx<", x, y), ("fx>", y, 10)), [1, 5], "0\n"],
+        [("or", ("fxzero?", x), ("fx>=", y, 3)), [0, 0], "1\n"],
+        [("or", ("fxzero?", x), ("fx>=", y, 3)), [1, 3], "1\n"],
+        [("or", ("fxzero?", x), ("fx>=", y, 3)), [1, 2], "0\n"],
+        [("and", ("not", ("fx=", x, y)), ("or", ("fx<=", x, 0), y)), [1, 2], "1\n"],
+        [("and", ("not", ("fx=", x, y)), ("or", ("fx<=", x, 0), y)), [1, False], "0\n"],
+        [("if", ("char?", x), ("char<", x, y), ("null?", y)), ["a", "b"], "1\n"],
+        [("if", ("char?", x), ("char<", x, y), ("null?", y)), [1, ()], "1\n"],
+        [("if", ("char?", x), ("char<", x, y), ("null?", y)), [1, 2], "0\n"],
+        [("or", x, y), [False, False], "0\n"],
+        [("or", x, y), [False, 0], "1\n"],
+    ],
+)
+def test_branch_on_predicates(test, args, out, compile_and_run):
+    assert compile_and_run(classify(test, *args)) == out
+
+
+@pytest.mark.parametrize(
+    "test",
+    [
+        ("fxzero?", x),
+        ("not", ("pair?", x)),
+        ("and", ("fx<", x, y), ("not", ("fx=", x, 0))),
+        ("or", ("null?", x), ("char>", x, y)),
+    ],
+)
+def test_branch_does_not_materialize_booleans(test):
+    lines = []
+    emit_program(classify(test, 1, 2), lines.append, optimize=False)
+    assert not [line for line in lines if line.text.startswith("set")]
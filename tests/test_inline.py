@@ -0,0 +1,100 @@
+import pytest
+
+from compiler import Var, parse_program
+from compiler.inline import inline_program
+from compiler.nodes import App, Let, Ref, nodes
+
+x = Var("x")
+y = Var("y")
+
+add12 = ("λ", [x], ("fx+", x, 12))
+double = ("λ", [x], ("fx+", x, x))
+countdown = ("λ", [x], ("if", ("fxzero?", x), 0, ["countdown", ("fxsub1", x)]))
+
+
+def inline(program, **kwargs):
+    return inline_program(parse_program(program), **kwargs)
+
+
+def apps(expr):
+    return [node.rator for node in nodes(expr) if isinstance(node, App)]
+
+
+def test_inline_small_procedure():
+    program = inline(("letrec", [("f", add12)], ("fx+", ["f", 1], ["f", 2])))
+    assert apps(program.body) == []
+    assert [type(node) for node in nodes(program.body)].count(Let) == 2
+
+
+def test_args_evaluated_once():
+    bindings = [("double", double), ("countdown", countdown)]
+    program = inline(("letrec", bindings, ["double", ["countdown", 3]]))
+    assert apps(program.body) == ["countdown"]
+
+
+def test_fresh_bindings_per_call_site():
+    program = inline(("letrec", [("f", add12)], ("fx+", ["f", 1], ["f", 2])))
+    lets = [node for node in nodes(program.body) if isinstance(node, Let)]
+    [(first, _)], [(second, _)] = (let.bindings for let in lets)
+    assert first is not second
+    refs = [node.binding for node in nodes(program.body) if isinstance(node, Ref)]
+    assert refs == [first, second]
+
+
+def test_nested_inlining():
+    program = inline(
+        ("letrec", [("f", add12), ("g", ("λ", [y], ["f", ["f", y]]))], ["g", 1])
+    )
+    assert apps(program.body) == []
+
+
+@pytest.mark.parametrize(
+    "bindings",
+    [
+        [("countdown", countdown)],
+        [
+            ("even", ("λ", [x], ("if", ("fxzero?", x), 1, ["odd", ("fxsub1", x)]))),
+            ("odd", ("λ", [x], ("if", ("fxzero?", x), 0, ["even", ("fxsub1", x)]))),
+        ],
+    ],
+)
+def test_recursive_groups_not_inlined(bindings):
+    name = bindings[0][0]
+    program = inline(("letrec", bindings, [name, 3]))
+    assert apps(program.body) == [name]
+
+
+def test_threshold():
+    program = ("letrec", [("f", add12)], ["f", 1])
+    assert apps(inline(program, threshold=2).body) == ["f"]
+    assert apps(inline(program, threshold=4).body) == []
+
+
+def test_arity_mismatch_not_inlined():
+    assert apps(inline(("letrec", [("f", add12)], ["f", 1, 2])).body) == ["f"]
+
+
+@pytest.mark.parametrize(
+    ("program", "expected"),
+    [
+        [("letrec", [("f", add12)], ("fx+", ["f", 1], ["f", 2])), "27\n"],
+        [
+            (
+                "letrec",
+                [("double", double), ("countdown", countdown)],
+                ["double", ("fx+", 5, ["countdown", 3])],
+            ),
+            "10\n",
+        ],
+        [
+            (
+                "letrec",
+                [("f", add12), ("g", ("λ", [x, y], ("fx-", ["f", y], ["f", x])))],
+                ["g", ("let", [(x, 1)], ["f", x]), 100],
+            ),
+            "87\n",
+        ],
+    ],
+)
+def test_inlined_programs(compile_and_run, program, expected):
+    assert compile_and_run(program) == expected
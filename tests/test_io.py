@@ -0,0 +1,122 @@
+import pytest
+
+from compiler import Var, emit_program
+from compiler.io import Buffer, FileWriter, Line, StreamWriter
+
+x = Var("x")
+
+
+@pytest.mark.parametrize(
+    ("line", "expected"),
+    [
+        [Line("ret"), "ret\n"],
+        [1 >> Line("ret"), "    ret\n"],
+        [1 >> Line("ret") // "done", "    ret  # done\n"],
+        [Line() // "note", "# note\n"],
+        [2 >> Line() // "note", "        # note\n"],
+    ],
+)
+def test_line_str(line, expected):
+    assert str(line) == expected
+
+
+def test_line_fields():
+    line = 1 >> Line("ret") // "done"
+    assert (line.text, line.comment, line.indents) == ("ret", "done", 1)
+
+
+def test_buffer_renders_lines():
+    program = ("let", [(x, ("cons", 1, 2))], ("fx+", ("car", x), ("cdr", x)))
+    lines = []
+    emit_program(program, lines.append)
+    buffer = Buffer()
+    for line in lines:
+        buffer.write(line)
+    assert len(buffer) == len(lines)
+    assert list(buffer) == lines
+    assert "".join(buffer.render()) == "".join(map(str, lines))
+
+
+def test_buffer_interns():
+    buffer = Buffer()
+    for _ in range(2):
+        buffer.write(1 >> Line("".join(["re", "t"])))
+    assert buffer.texts[0] is buffer.texts[1]
+
+
+class Chunks:
+    def __init__(self):
+        self.chunks = []
+
+    def writelines(self, lines):
+        self.chunks.append(list(lines))
+
+    def flush(self):
+        pass
+
+
+@pytest.mark.parametrize(
+    ("threshold", "sizes"), [[2, [2, 2, 1]], [5, [5]], [None, [5]]]
+)
+def test_stream_writer_chunks(threshold, sizes):
+    with StreamWriter(threshold) as writer:
+        writer.file = Chunks()
+        for i in range(5):
+            writer.write(1 >> Line(f"movq ${i}, %rax"))
+    assert [len(chunk) for chunk in writer.file.chunks] == sizes
+    assert sum(writer.file.chunks, []) == [f"    movq ${i}, %rax\n" for i in range(5)]
+    assert not writer.lines
+
+
+def test_file_writer_streams(tmp_path):
+    path = tmp_path / "out.s"
+    with FileWriter(path, threshold=1) as writer:
+        writer.write(Line("ret"))
+        assert writer.file.tell() == len("ret\n")
+        assert not writer.lines
+        writer.write(Line("ret"))
+    assert path.read_text() == "ret\nret\n"
+
+
+f, g, n, a, b = "f", "g", Var("n"), Var("a"), Var("b")
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        (
+            "letrec",
+            [(f, ("lambda", [n], ("if", ("fxzero?", n), n, ("f", ("fxsub1", n)))))],
+            ("let", [(x, ("cons", 1, 2))], ("fx+", ("f", 3), ("cdr", x))),
+        ),
+        # a tail call that swaps its args, so the moves form a cycle
+        (
+            "letrec",
+            [
+                (
+                    g,
+                    (
+                        "lambda",
+                        [a, b],
+                        (
+                            "if",
+                            ("fxzero?", a),
+                            ("not", ("boolean?", ("fxlognot", b))),
+                            ("g", b, a),
+                        ),
+                    ),
+                )
+            ],
+            ("g", 1, 0),
+        ),
+    ],
+)
+def test_lean_listing(program):
+    commented = []
+    emit_program(program, commented.append)
+    lean = []
+    emit_program(program, lean.append, comments=False)
+    assert not any(line.comment for line in lean)
+    assert [line.text for line in lean] == [
+        line.text for line in commented if line.text
+    ]
@@ -0,0 +1,29 @@
+from compiler import Var, emit_program
+
+x = Var("x")
+
+
+def test_code_runs_repeatedly(jits):
+    jit = jits[True]
+    code = jit.compile(("let", [(x, ("cons", 1, 2))], ("cdr", x)))
+    try:
+        assert [jit.execute(code) for _ in range(3)] == ["2\n"] * 3
+    finally:
+        code.close()
+
+
+def test_encode_listing(jits):
+    jit = jits[True]
+    lines = []
+
+    def write_listing(encoder):
+        for line in lines:
+            encoder.write(line)
+
+    # comments are passed to the encoder too
+    emit_program(("fx+", ("car", ("cons", 1, 2)), 3), lines.append)
+    code = jit.encode(write_listing)
+    try:
+        assert jit.execute(code) == "4\n"
+    finally:
+        code.close()
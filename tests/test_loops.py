@@ -0,0 +1,176 @@
+import pytest
+
+from compiler import Var, emit_program, parse_program
+from compiler.loops import loop_program
+from compiler.nodes import App, Let, Loop, PrimCall, Recur, nodes
+
+n = Var("n")
+acc = Var("acc")
+k = Var("k")
+x = Var("x")
+λ = "lambda"
+
+# fixnum->char of 1 is not a printable char, so this is not folded
+unfoldable = ("char->fixnum", ("fixnum->char", 1))
+
+
+def sum_to(step):
+    """A loop adding step to acc n times."""
+    return (
+        "letrec",
+        [
+            (
+                "f",
+                (
+                    λ,
+                    [n, acc],
+                    (
+                        "if",
+                        ("fxzero?", n),
+                        acc,
+                        ["f", ("fxsub1", n), ("fx+", acc, step)],
+                    ),
+                ),
+            )
+        ],
+        ["f", 10, 0],
+    )
+
+
+def converted(program):
+    [(_, lam)] = loop_program(parse_program(program)).bindings
+    return lam.body
+
+
+def test_self_tail_call_becomes_loop():
+    body = converted(sum_to(1))
+    assert isinstance(body, Loop)
+    assert [type(node) for node in nodes(body)].count(Recur) == 1
+    assert not any(isinstance(node, App) for node in nodes(body))
+
+
+def test_non_tail_self_call_is_not_converted():
+    program = ("letrec", [("f", (λ, [n], ("fxadd1", ["f", n])))], 1)
+    assert not any(isinstance(node, Loop) for node in nodes(converted(program)))
+
+
+def test_invariant_hoisted():
+    body = converted(sum_to(("fx*", 3, 4)))
+    assert isinstance(body, Let)
+    [(_, rhs)] = body.bindings
+    assert rhs.op == "fx*"
+    assert isinstance(body.body, Loop)
+    assert not any(
+        isinstance(node, PrimCall) and node.op == "fx*" for node in nodes(body.body)
+    )
+
+
+def test_invariant_let_hoisted():
+    step = ("let", [(k, ("fx*", 3, 4))], ("fx+", k, n))
+    body = converted(sum_to(step))
+    assert isinstance(body, Let)
+    assert body.bindings[0][0].name == "k"
+
+
+def scaled_sum(step):
+    """A loop adding step to acc n times, passing k back unchanged."""
+    return (
+        "letrec",
+        [
+            (
+                "f",
+                (
+                    λ,
+                    [n, acc, k],
+                    (
+                        "if",
+                        ("fxzero?", n),
+                        acc,
+                        ["f", ("fxsub1", n), ("fx+", acc, step), k],
+                    ),
+                ),
+            )
+        ],
+        ["f", 10, 0, 2],
+    )
+
+
+def test_invariant_over_unchanged_formal_hoisted():
+    body = converted(scaled_sum(("fx*", ("fxlogor", k, 3), ("fxlogor", k, 5))))
+    assert isinstance(body, Let)
+    [(_, rhs)] = body.bindings
+    assert rhs.op == "fx*"
+    assert isinstance(body.body, Loop)
+    assert not any(
+        isinstance(node, PrimCall) and node.op == "fx*" for node in nodes(body.body)
+    )
+
+
+@pytest.mark.parametrize("step", [("car", ("cons", 1, 2)), ("fx+", n, 1)])
+def test_variant_or_faulting_not_hoisted(step):
+    assert isinstance(converted(sum_to(step)), Loop)
+
+
+def test_unchanged_formal_not_moved():
+    program = (
+        "letrec",
+        [("f", (λ, [n, acc], ("if", ("fxzero?", n), acc, ["f", ("fxsub1", n), acc])))],
+        ["f", 10, 3],
+    )
+    lines = []
+    emit_program(program, lines.append)
+    start = next(i for i, line in enumerate(lines) if line.comment == "loop f")
+    end = next(i for i, line in enumerate(lines) if line.text == "L_scheme_entry:")
+    loop = [line.text for line in lines[start:end] if line.text[:1].isalpha()]
+    assert loop[-1].startswith("jmp")
+    # the loop only loads n and acc from memory on entry
+    assert not any("(%rsp)" in text for text in loop)
+
+
+@pytest.mark.parametrize(
+    ("program", "expected"),
+    [
+        [sum_to(1), "10\n"],
+        [sum_to(unfoldable), "10\n"],
+        [sum_to(("let", [(k, unfoldable)], ("fx+", k, k))), "20\n"],
+        [sum_to(("fx+", n, unfoldable)), "65\n"],
+        [scaled_sum(("fx*", ("fxlogor", k, 3), ("fxlogor", k, 5))), "210\n"],
+        # x is only read when the args are moved, after the call to g
+        [
+            (
+                "letrec",
+                [
+                    (
+                        "g",
+                        (
+                            λ,
+                            [k],
+                            ("if", ("fxzero?", k), 0, ("fx+", 1, ["g", ("fxsub1", k)])),
+                        ),
+                    ),
+                    (
+                        "f",
+                        (
+                            λ,
+                            [n, acc],
+                            (
+                                "if",
+                                ("fx>", n, 100),
+                                ("fx+", n, acc),
+                                (
+                                    "let",
+                                    [(x, ("fx+", n, 10))],
+                                    ["f", x, ("fx+", acc, ["g", 2])],
+                                ),
+                            ),
+                        ),
+                    ),
+                ],
+                ["f", 1, 0],
+            ),
+            "121\n",
+        ],
+    ],
+)
+def test_loop_programs(compile_and_run, program, expected):
+    assert compile_and_run(program) == expected
@@ -0,0 +1,60 @@
+import pytest
+
+from compiler import Var, parse_program
+from compiler.nodes import App, Const, If, Let, Letrec, PrimCall, Ref
+
+x = Var("x")
+y = Var("y")
+
+
+def test_parse_expression_is_wrapped_in_letrec():
+    program = parse_program(("fx+", ("fxadd1", 2), 1))
+    assert isinstance(program, Letrec)
+    assert program.bindings == ()
+    assert isinstance(program.body, PrimCall)
+    assert [type(arg) for arg in program.body.args] == [PrimCall, Const]
+
+
+def test_parse_desugars_and_or_let_star():
+    program = parse_program(("let*", [(x, 1), (y, ("and", x, True))], y))
+    outer = program.body
+    assert isinstance(outer, Let) and outer.bindings[0][0].var == x
+    inner = outer.body
+    assert isinstance(inner, Let) and inner.bindings[0][0].var == y
+    assert isinstance(inner.bindings[0][1], If)
+    assert isinstance(inner.body, Ref) and inner.body.binding is inner.bindings[0][0]
+
+
+def test_parse_application():
+    program = parse_program(("letrec", [("f", ("λ", [x], x))], ["f", 1]))
+    assert isinstance(program.body, App)
+    assert program.body.rator == "f"
+
+
+@pytest.mark.parametrize(
+    ("program", "exc"),
+    [
+        [("fxadd1", 1, 2), TypeError],
+        [("if", True, 1), ValueError],
+        [("let", [(1, 2)], 3), ValueError],
+        [["f", 1], ValueError],
+        [2**70, ValueError],
+    ],
+)
+def test_parse_errors(program, exc):
+    with pytest.raises(exc):
+        parse_program(program)
+
+
+def test_parse_resolves_shadowed_variables():
+    program = parse_program(("let", [(x, 1)], ("let", [(x, ("fx+", x, 1))], x)))
+    outer, inner = program.body, program.body.body
+    outer_x, inner_x = outer.bindings[0][0], inner.bindings[0][0]
+    assert outer_x is not inner_x
+    assert inner.bindings[0][1].args[0].binding is outer_x
+    assert inner.body.binding is inner_x
+
+
+def test_parse_unbound_variable():
+    with pytest.raises(LookupError):
+        parse_program(("fxadd1", x))
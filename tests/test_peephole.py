@@ -0,0 +1,147 @@
+import pytest
+
+from compiler import Var, emit_program
+from compiler.io import Line
+from compiler.peephole import RULES, WINDOW, Peephole
+
+x = Var("x")
+
+
+def optimize(*texts, rules=None):
+    lines = []
+    with Peephole(lines.append, rules) as peephole:
+        for text in texts:
+            peephole.write(Line(text) if text.endswith(":") else 1 >> Line(text))
+    return [line.text for line in lines], peephole.removed
+
+
+@pytest.mark.parametrize(
+    ("texts", "expected", "rule"),
+    [
+        [
+            ["movq %rax, -8(%rsp)", "movq -8(%rsp), %rax"],
+            ["movq %rax, -8(%rsp)"],
+            "store-load",
+        ],
+        [
+            ["movq %rax, %rbx", "movq %rbx, %rax"],
+            ["movq %rax, %rbx"],
+            "copy-back",
+        ],
+        [
+            ["subq $1, %rax", "movq 0(%rax), %rax"],
+            ["movq -1(%rax), %rax"],
+            "fold-offset",
+        ],
+        [
+            ["addq $7, %rax", "movq 0(%rax), %rax"],
+            ["movq 7(%rax), %rax"],
+            "fold-offset",
+        ],
+        [["sub $16, %rsp", "add $16, %rsp"], [], "stack-adjust"],
+        [["sub $16, %rsp", "add $8, %rsp"], ["sub $8, %rsp"], "stack-adjust"],
+        [["movq %rax, %rax"], [], "self-move"],
+        [["jmp L_1", "L_1:"], ["L_1:"], "jump-to-next"],
+        [["ret", "movq $8, %rax", "ret"], ["ret"], "unreachable"],
+        [
+            [
+                "movq %rax, -16(%rsp)",
+                "movq -8(%rsp), %rax",
+                "movq %rax, 0(%rbp)",
+                "movq -16(%rsp), %rax",
+                "movq %rax, 8(%rbp)",
+            ],
+            ["movq %rax, 8(%rbp)", "movq -8(%rsp), %rax", "movq %rax, 0(%rbp)"],
+            "cons-store",
+        ],
+    ],
+)
+def test_rules(texts, expected, rule):
+    lines, removed = optimize(*texts)
+    assert lines == expected
+    assert removed[rule] == len(texts) - len(expected)
+
+
+@pytest.mark.parametrize(
+    "texts",
+    [
+        ["movq %rax, -8(%rsp)", "movq -16(%rsp), %rax"],
+        ["movq %rax, -8(%rsp)", "L_1:", "movq -8(%rsp), %rax"],
+        ["subq $1, %rax", "movq 0(%rbx), %rax"],
+        ["jmp L_1", "L_2:"],
+        ["ret", "L_1:", "ret"],
+    ],
+)
+def test_no_rewrite(texts):
+    lines, removed = optimize(*texts)
+    assert lines == texts
+    assert not removed
+
+
+def test_comments_pass_through():
+    lines = []
+    with Peephole(lines.append) as peephole:
+        peephole.write(1 >> Line("movq %rax, -8(%rsp)"))
+        peephole.write(1 >> Line() // "between")
+        peephole.write(1 >> Line("movq -8(%rsp), %rax"))
+    assert [(line.text, line.comment) for line in lines] == [
+        ("movq %rax, -8(%rsp)", ""),
+        ("", "between"),
+    ]
+
+
+def test_comments_of_removed_instructions_kept():
+    lines = []
+    with Peephole(lines.append) as peephole:
+        peephole.write(1 >> Line("sub $16, %rsp") // "first")
+        peephole.write(1 >> Line() // "between")
+        peephole.write(1 >> Line("add $16, %rsp"))
+        peephole.write(1 >> Line() // "after")
+    assert [(line.text, line.comment) for line in lines] == [
+        ("", "between"),
+        ("", "after"),
+    ]
+
+
+def test_window_holds_instructions_not_comments():
+    written = []
+    lines = []
+    with Peephole(lines.append) as peephole:
+        for i in range(1000):
+            written.append(1 >> Line(f"movq %rax, {-8 * i}(%rsp)"))
+            written.extend(1 >> Line() // "comment" for _ in range(10))
+            for line in written[-11:]:
+                peephole.write(line)
+            assert len(peephole.window) <= WINDOW
+            assert len(lines) >= len(written) - 11 * WINDOW
+    assert lines == written
+
+
+def test_configurable_rules():
+    texts = ["subq $1, %rax", "movq 0(%rax), %rax"]
+    lines, removed = optimize(*texts, rules={"self-move": RULES["self-move"]})
+    assert lines == texts
+    assert not removed
+
+
+def test_program_shrinks():
+    program = ("let", [(x, ("cons", 1, 2))], ("fx+", ("car", x), ("cdr", x)))
+    plain = []
+    emit_program(program, plain.append)
+    optimized = []
+    with Peephole(optimized.append) as peephole:
+        emit_program(program, peephole.write)
+    assert len(optimized) == len(plain) - sum(peephole.removed.values())
+    assert sum(peephole.removed.values()) > 0
+
+
+@pytest.mark.parametrize(
+    ("program", "expected"),
+    [
+        [("car", ("cons", 1, 2)), "1\n"],
+        [("cdr", ("cons", 1, ("cons", 2, ()))), "(2)\n"],
+        [("let", [(x, ("cons", 1, 2))], ("fx+", ("car", x), ("cdr", x))), "3\n"],
+    ],
+)
+def test_peephole_programs(compile_and_run, program, expected):
+    assert compile_and_run(program) == expected
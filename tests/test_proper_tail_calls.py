@@ -1,8 +1,10 @@
 import pytest
 
-from compiler import Var
+from compiler import Var, emit_parallel_move, emit_program
 
 x = Var("x")
+y = Var("y")
+z = Var("z")
 n = Var("n")
 ac = Var("ac")
 λ = "lambda"
@@ -89,3 +91,97 @@ ac = Var("ac")
 )
 def test_deeply_nested_procedures(program, out, compile_and_run):
     assert compile_and_run(program) == out
+
+
+def rotate(body):
+    """A procedure that rotates its args n times, then computes body."""
+    return (
+        "letrec",
+        [
+            (
+                "f",
+                (
+                    λ,
+                    [x, y, z, n],
+                    ("if", ("fxzero?", n), body, ["f", y, z, x, ("fxsub1", n)]),
+                ),
+            ),
+            ("g", (λ, [x, y], ("if", ("fxzero?", x), y, ["g", ("fxsub1", x), x]))),
+        ],
+        ("cons", ["f", 1, 2, 3, 4], ("cons", ["f", 1, 2, 3, 5], ["g", 3, 10])),
+    )
+
+
+@pytest.mark.parametrize(
+    ("program", "out"),
+    [
+        [rotate(("fx-", x, ("fx-", y, z))), "(0 4 . 1)\n"],
+        [
+            (
+                "letrec",
+                [
+                    (
+                        "f",
+                        (
+                            λ,
+                            [x, y, n],
+                            (
+                                "if",
+                                ("fxzero?", n),
+                                ("fx-", x, y),
+                                # the second arg reads the slot of the first
+                                ["f", ("fx+", y, 1), ("fx*", x, 2), ("fxsub1", n)],
+                            ),
+                        ),
+                    )
+                ],
+                ["f", 1, 2, 3],
+            ),
+            "1\n",
+        ],
+    ],
+)
+def test_tail_call_arg_shuffle(program, out, compile_and_run):
+    assert compile_and_run(program) == out
+
+
+def moves(pairs):
+    lines = []
+    emit_parallel_move(pairs, lines.append)
+    return [line.text for line in lines]
+
+
+def test_parallel_move_skips_moves_in_place():
+    assert moves([("-16(%rsp)", "-16(%rsp)")]) == []
+
+
+def test_parallel_move_orders_dependent_moves():
+    assert moves([("-8(%rsp)", "-16(%rsp)"), ("$4", "-8(%rsp)")]) == [
+        "movq -8(%rsp), %rax",
+        "movq %rax, -16(%rsp)",
+        "movq $4, -8(%rsp)",
+    ]
+
+
+def test_parallel_move_breaks_cycles():
+    assert moves([("-8(%rsp)", "-16(%rsp)"), ("-16(%rsp)", "-8(%rsp)")]) == [
+        "movq -16(%rsp), %r11",
+        "movq -8(%rsp), %rax",
+        "movq %rax, -16(%rsp)",
+        "movq %r11, -8(%rsp)",
+    ]
+
+
+def test_arg_in_place_is_not_moved():
+    program = (
+        "letrec",
+        [("f", (λ, [n, ac], ("if", ("fxzero?", n), ac, ["f", ("fxsub1", n), ac])))],
+        ["f", 3, 7],
+    )
+    lines = []
+    emit_program(program, lines.append, optimize=False)
+    texts = [line.text for line in lines]
+    texts = texts[: texts.index("L_scheme_entry:")]
+    start = next(i for i, line in enumerate(lines) if line.comment == "lambda@f")
+    # ac is the second arg, already in -16(%rsp)
+    assert not any(text.endswith("-16(%rsp)") for text in texts[start:])
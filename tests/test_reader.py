@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+from compiler import Var
+from compiler.reader import ReadError, read, read_program
+
+x = Var("x")
+
+
+@pytest.mark.parametrize(
+    ("text", "datum"),
+    [
+        ["42", 42],
+        ["-7", -7],
+        ["#t", True],
+        ["False", False],
+        ["()", ()],
+        ["#\\a", "a"],
+        ["#\\space", " "],
+        ['"fx+"', "fx+"],
+        ["(fx+ 1 2)", ("fx+", 1, 2)],
+        ['("fx+", 1, 2)', ("fx+", 1, 2)],
+        ["[λ, [x], x]", ["lambda", [x], x]],
+        ["(lambda (x) x) ; identity", ("lambda", (x,), x)],
+        ['["f", 1]  # call f', ["f", 1]],
+        ["(let* ((x 1)) x)", ("let*", ((x, 1),), x)],
+        ["(even? 4)", (Var("even?"), 4)],
+        ["'()", ()],
+        ["(cons 1 '( ))", ("cons", 1, ())],
+    ],
+)
+def test_read(text, datum):
+    assert read_program(io.StringIO(text)) == datum
+
+
+def test_read_symbols():
+    assert read_program(io.StringIO("(f x)"), {"f": "f"}) == ("f", x)
+
+
+def test_read_across_chunks():
+    text = "(fxadd1 " * 100 + "#\\newline" + ")" * 100
+    expected = "\n"
+    for _ in range(100):
+        expected = ("fxadd1", expected)
+    assert read_program(io.StringIO(text), chunk_size=3) == expected
+
+
+def test_read_many():
+    assert list(read(io.StringIO("1 (2) [3]"))) == [1, (2,), [3]]
+
+
+@pytest.mark.parametrize(
+    ("text", "line", "column"),
+    [
+        ["(fx+ 1\n  2", 1, 1],
+        ["(fx+ 1 2))", 1, 10],
+        ["(fx+ 1\n   2]", 2, 5],
+        ["(cons #\\bogus 1)", 1, 7],
+        ['(1\n "abc', 2, 2],
+        ["1 2", 1, 3],
+        ["", 1, 1],
+        ["(cons 1\n '(2))", 2, 2],
+        ["(cons 'a 1)", 1, 7],
+    ],
+)
+def test_read_errors(text, line, column):
+    with pytest.raises(ReadError) as e:
+        read_program(io.StringIO(text))
+    assert (e.value.line, e.value.column) == (line, column)
+
+
+@pytest.mark.parametrize(
+    "text", ["'(1 2)", "(cons 'a 1)", "'a", "(cons 'a '())", "'fx+'", "' ()"]
+)
+def test_quoted_datum_rejected(text):
+    with pytest.raises(ReadError, match="only '\\(\\) can be quoted"):
+        read_program(io.StringIO(text))
+
+
+def test_compile_scheme_source(compile_and_run):
+    text = """
+    (letrec ((even? (lambda (x) (if (fx= x 0) #t (odd? (fxsub1 x)))))
+             (odd? (lambda (x) (if (fx= x 0) #f (even? (fxsub1 x))))))
+      (even? 4))
+    """
+    assert compile_and_run(read_program(io.StringIO(text))) == "#t\n"
@@ -0,0 +1,187 @@
+import pytest
+
+from compiler import Var, parse_program
+from compiler.regalloc import REGISTERS, allocate
+
+a, b, c, d, e, f, x, y = (Var(name) for name in "abcdefxy")
+
+
+def allocation(program, registers=REGISTERS):
+    """The registers given to each name in program's body, or its lambda."""
+    parsed = parse_program(program)
+    if parsed.bindings:
+        [(_, lam)] = parsed.bindings
+        formals, body = lam.formals, lam.body
+    else:
+        formals, body = (), parsed.body
+    bindings = {}
+    stack = [body]
+    while stack:
+        node = stack.pop()
+        for lhs, rhs in getattr(node, "bindings", ()):
+            bindings[lhs] = None
+            stack.append(rhs)
+        for name in ("body", "test", "consequent", "alternative"):
+            if hasattr(node, name):
+                stack.append(getattr(node, name))
+        stack.extend(getattr(node, "args", ()))
+    allocated = allocate(formals, body, registers)
+    return {
+        binding.name: allocated.get(binding) for binding in (*formals, *bindings)
+    }
+
+
+def test_formals_and_lets_in_registers():
+    lam = ("λ", [x, y], ("let", [(a, ("fx+", x, y))], a))
+    program = ("letrec", [("f", lam)], 1)
+    registers = allocation(program)
+    assert all(registers.values())
+    # x and y are both live when a is bound
+    assert registers["x"] != registers["y"]
+
+
+def test_registers_are_reused():
+    program = ("let", [(a, 1)], ("let", [(b, ("fxadd1", a))], ("fxadd1", b)))
+    registers = allocation(program, registers=("rbx",))
+    assert registers == {"a": "rbx", "b": "rbx"}
+
+
+def test_spill_under_pressure():
+    names = (a, b, c, d, e, f)
+    total = ("fx+", a, ("fx+", b, ("fx+", c, ("fx+", d, ("fx+", e, f)))))
+    program = ("let", [(v, i) for i, v in enumerate(names)], total)
+    registers = allocation(program)
+    assert sorted(r for r in registers.values() if r) == sorted(REGISTERS)
+    assert list(registers.values()).count(None) == 1
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        ("fx+", x, ["f", 1]),
+        ("fx+", ["f", 1], x),
+        ("let", [(a, ["f", 1])], ("fx+", a, x)),
+    ],
+)
+def test_live_across_call_stays_on_stack(body):
+    program = ("letrec", [("f", ("λ", [x], body))], 1)
+    assert allocation(program)["x"] is None
+
+
+def test_tail_call_args_use_registers():
+    program = ("letrec", [("f", ("λ", [x], ["f", ("fx+", x, x)]))], 1)
+    assert allocation(program)["x"] is not None
+
+
+def test_no_registers():
+    program = ("let", [(a, 1)], a)
+    assert allocation(program, registers=()) == {"a": None}
+
+
+@pytest.mark.parametrize(
+    ("program", "expected"),
+    [
+        [
+            (
+                "letrec",
+                [
+                    (
+                        "f",
+                        (
+                            "λ",
+                            [x, y],
+                            (
+                                "if",
+                                ("fxzero?", x),
+                                y,
+                                ["f", ("fxsub1", x), ("fx+", x, y)],
+                            ),
+                        ),
+                    )
+                ],
+                ["f", 100, 0],
+            ),
+            "5050\n",
+        ],
+        [
+            (
+                "let",
+                [(v, i) for i, v in enumerate((a, b, c, d, e, f, x), 1)],
+                (
+                    "fx-",
+                    a,
+                    ("fx+", b, ("fx+", c, ("fx+", d, ("fx+", e, ("fx+", f, x))))),
+                ),
+            ),
+            "-26\n",
+        ],
+        [
+            (
+                "letrec",
+                [
+                    ("g", ("λ", [x], ("fx*", x, 2))),
+                    (
+                        "f",
+                        (
+                            "λ",
+                            [x, y],
+                            (
+                                "let",
+                                [(a, ["g", x]), (b, ("fx+", x, y))],
+                                ("fx+", ("fx+", a, b), ["g", b]),
+                            ),
+                        ),
+                    ),
+                ],
+                ["f", 3, 4],
+            ),
+            "27\n",
+        ],
+    ],
+)
+def test_register_programs(compile_and_run, program, expected):
+    assert compile_and_run(program) == expected
+
+
+g, h, z = (Var(name) for name in "ghz")
+# g counts z down to 0 through non-tail calls
+countdown = (
+    "g",
+    ("λ", [z], ("if", ("fxzero?", z), 0, ("fx+", 1, ["g", ("fxsub1", z)]))),
+)
+
+
+def mutual_tail_calls(second):
+    """f tail calls h with x, which is only read when the args are moved."""
+    return (
+        "letrec",
+        [
+            countdown,
+            ("h", ("λ", [a, b], ("if", ("fx<", a, 0), ["f", a], ("fx-", a, b)))),
+            (
+                "f",
+                (
+                    "λ",
+                    [a],
+                    (
+                        "if",
+                        ("fx<", a, 0),
+                        0,
+                        ("let", [(x, ("fxadd1", a))], ["h", x, second]),
+                    ),
+                ),
+            ),
+        ],
+        ["f", 10],
+    )
+
+
+@pytest.mark.parametrize(
+    ("second", "expected"),
+    [
+        (["g", 3], "8\n"),
+        (("let", [(y, ("fx+", a, 7))], ("fx+", y, y)), "-23\n"),
+    ],
+)
+def test_tail_call_operand_outlives_other_args(compile_and_run, second, expected):
+    assert compile_and_run(mutual_tail_calls(second)) == expected